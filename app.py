@@ -1,12 +1,15 @@
-from flask import Flask, request, jsonify, render_template, send_file, session, redirect, url_for, flash
+from flask import Flask, request, jsonify, render_template, send_file, session, redirect, url_for, flash, Response, stream_with_context, send_from_directory
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 import pandas as pd
+import numpy as np
 import os
 import requests
 from werkzeug.security import generate_password_hash, check_password_hash
 import werkzeug
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import RequestEntityTooLarge
 # Compatibility shim: some werkzeug builds omit __version__ attribute which
 # Flask's test client expects. Ensure it's present for tests and tooling.
 if not hasattr(werkzeug, '__version__'):
@@ -17,13 +20,25 @@ if not hasattr(werkzeug, '__version__'):
         werkzeug.__version__ = '0'
 import json
 import hashlib
+import hmac
 import secrets
-from sqlalchemy import or_, func
+import threading
+import click
+import time
+import atexit
+import unicodedata
+from collections import deque
+from sqlalchemy import or_, func, case, event
+from sqlalchemy.exc import IntegrityError, OperationalError
 from dotenv import load_dotenv
+from storage import HashingReader, storage_from_env
+from changefeed import SYNC_ENTITIES
 import smtplib
 from email.message import EmailMessage
 import zipfile
-from io import BytesIO
+import tempfile
+import shutil
+from io import BytesIO, StringIO
 from authlib.integrations.flask_client import OAuth
 from google.oauth2 import id_token as google_id_token
 from google.auth.transport import requests as google_requests
@@ -49,10 +64,26 @@ try:
     from reportlab.pdfgen import canvas as _pdf_canvas
     from reportlab.lib.utils import ImageReader
     from reportlab.lib.colors import HexColor
+    from reportlab.graphics.barcode import qrencoder
     HAVE_PDF = True
 except Exception:
     HAVE_PDF = False
 
+# Optional image processing (member photo thumbnails)
+try:
+    from PIL import Image, ImageOps
+    HAVE_PIL = True
+except Exception:
+    HAVE_PIL = False
+
+# Optional columnar analytics export (Parquet)
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAVE_PYARROW = True
+except Exception:
+    HAVE_PYARROW = False
+
 app = Flask(__name__)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 db_path = os.path.join(BASE_DIR, "gym.db")
@@ -74,18 +105,41 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
 Migrate(app, db)
 
-# Static uploads (member photos)
-UPLOAD_FOLDER = os.path.join(BASE_DIR, 'static', 'uploads')
+with app.app_context():
+    _engine = db.engine
+if _engine.dialect.name == 'sqlite':
+    # pysqlite only opens a transaction before DML, so a SAVEPOINT issued first
+    # starts one of its own and its RELEASE commits. Let SQLAlchemy emit BEGIN.
+    @event.listens_for(_engine, 'connect')
+    def _sqlite_connect(dbapi_conn, connection_record):
+        dbapi_conn.isolation_level = None
+
+    @event.listens_for(_engine, 'begin')
+    def _sqlite_begin(conn):
+        conn.exec_driver_sql('BEGIN')
+
+# Static uploads (member photos); /static/uploads URLs assume the default folder
+UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER') or os.path.join(BASE_DIR, 'static', 'uploads')
 ALLOWED_IMAGE_EXTS = {'.jpg', '.jpeg', '.png', '.webp'}
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 # Local backups directory
-BACKUP_DIR = os.path.join(BASE_DIR, 'backups')
+BACKUP_DIR = os.getenv('BACKUP_DIR') or os.path.join(BASE_DIR, 'backups')
 os.makedirs(BACKUP_DIR, exist_ok=True)
 
 # Load environment variables and configure secret key
 load_dotenv(os.path.join(BASE_DIR, '.env'))
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-change-me')
+
+# Photos, backups and raw data uploads go through storage.py: the local
+# folders above by default, an S3-compatible bucket with STORAGE_BACKEND=s3
+DATA_UPLOAD_DIR = os.getenv('DATA_UPLOAD_DIR') or os.path.join(BASE_DIR, 'data_uploads')
+photo_store = storage_from_env('uploads', UPLOAD_FOLDER)
+backup_store = storage_from_env('backups', BACKUP_DIR)
+data_store = storage_from_env('data_uploads', DATA_UPLOAD_DIR)
+STORAGE_AREAS = {'uploads': photo_store, 'backups': backup_store, 'data_uploads': data_store}
+# Largest request body accepted (bytes); werkzeug answers 413 beyond this
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', str(256 * 1024 * 1024))) or None
 # Cookie security settings
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
@@ -151,51 +205,203 @@ def set_setting_json(key: str, value_obj):
     set_setting(key, json.dumps(value_obj))  # type: ignore[name-defined]
 
 
-def find_member_image_url(member_id: int):
-    for ext in ALLOWED_IMAGE_EXTS:
-        rel = f"/static/uploads/member_{member_id}{ext}"
-        abs_path = os.path.join(UPLOAD_FOLDER, f"member_{member_id}{ext}")
-        if os.path.exists(abs_path):
-            return rel
-    return None
+# Member photos: the original is stored under Member.photo_key in photo_store
+# and Member.photo_etag is a hash of its bytes, both written on upload.
+# Derivatives (a square avatar thumbnail and a medium image, WebP, EXIF
+# stripped and orientation applied) are stored as
+# derived/member_<id>_<etag>_<size>.webp, so URLs come straight from the row
+# and the files can be cached forever (/media/members/).
+PHOTO_SIZES = {'thumb': 160, 'md': 720}  # thumb: square crop; md: longest side
+_photo_executor = None
+_photo_inflight: set[tuple[int, str]] = set()
+_photo_lock = threading.Lock()
 
-def _find_member_image_abs_path(member_id: int) -> str | None:
-    for ext in ALLOWED_IMAGE_EXTS:
-        abs_path = os.path.join(UPLOAD_FOLDER, f"member_{member_id}{ext}")
-        if os.path.exists(abs_path):
-            return abs_path
-    return None
 
-def _build_member_card_pdf_bytes(member: "Member") -> tuple[bool, bytes, str]:
-    if not HAVE_PDF:
-        return False, b"", "PDF generation library not installed"
-    buf = BytesIO()
-    page_w, page_h = A4
-    c = _pdf_canvas.Canvas(buf, pagesize=A4)
-    # Card layout
-    margin = 36
-    card_w = page_w - margin * 2
-    card_h = 220
-    card_x = margin
-    card_y = page_h - margin - card_h
+def _photo_derivative_name(member_id: int, etag: str, size: str) -> str:
+    return f"member_{member_id}_{etag}_{size}.webp"
+
+
+def _photo_derivative_key(member_id: int, etag: str, size: str) -> str:
+    return f"derived/{_photo_derivative_name(member_id, etag, size)}"
+
+
+def _remove_photo_derivatives(member_id: int, keep_version: str | None = None) -> None:
+    prefix = f"derived/member_{member_id}_"
+    for obj in list(photo_store.list(prefix)):
+        if keep_version is None or not obj.key.startswith(f"{prefix}{keep_version}_"):
+            photo_store.delete(obj.key)
+
+
+def build_photo_derivatives(member_id: int, photo_key: str, etag: str) -> bool:
+    """Write the thumb/md WebP files for one original. Safe to call repeatedly."""
+    if not HAVE_PIL or not etag:
+        return False
+    with photo_store.local_path(photo_key) as src, Image.open(src) as original:
+        img = ImageOps.exif_transpose(original)
+        img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+        for size, px in PHOTO_SIZES.items():
+            if size == 'thumb':
+                out = ImageOps.fit(img, (px, px), Image.Resampling.LANCZOS)
+            else:
+                out = img.copy()
+                out.thumbnail((px, px), Image.Resampling.LANCZOS)
+            buf = BytesIO()
+            # No exif= argument: metadata is dropped from the derivative
+            out.save(buf, 'WEBP', quality=80 if size == 'md' else 75, method=4)
+            photo_store.put_bytes(_photo_derivative_key(member_id, etag, size), buf.getvalue(), 'image/webp')
+    _remove_photo_derivatives(member_id, keep_version=etag)
+    return True
+
+
+def _run_photo_job(member_id: int, photo_key: str, etag: str) -> bool:
+    try:
+        return build_photo_derivatives(member_id, photo_key, etag)
+    except Exception as exc:
+        app.logger.warning('photo derivatives failed for member %s: %s', member_id, exc)
+        return False
+    finally:
+        with _photo_lock:
+            _photo_inflight.discard((member_id, etag))
+
+
+def submit_photo_derivatives(member_id: int, photo_key: str, etag: str):
+    """Queue derivative generation on the background pool (deduplicated per version)."""
+    global _photo_executor
+    if not HAVE_PIL:
+        return None
+    with _photo_lock:
+        if (member_id, etag) in _photo_inflight:
+            return None
+        _photo_inflight.add((member_id, etag))
+        if _photo_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _photo_executor = ThreadPoolExecutor(max_workers=int(os.getenv('PHOTO_WORKERS', '2')), thread_name_prefix='photo')
+    return _photo_executor.submit(_run_photo_job, member_id, photo_key, etag)
+
+
+def member_photo_key(member: "Member", size: str | None = None) -> str | None:
+    """Storage key of the original (``size=None``) or a derivative; a missing derivative is built inline."""
+    if not member.photo_key:
+        return None
+    if size is None:
+        return member.photo_key
+    key = _photo_derivative_key(member.id, member.photo_etag, size)
+    if not photo_store.exists(key):
+        try:
+            if not build_photo_derivatives(member.id, member.photo_key, member.photo_etag):
+                return None
+        except Exception:
+            return None
+    return key
+
+
+def member_photo_bytes(member: "Member", size: str | None = None) -> bytes | None:
+    key = member_photo_key(member, size)
+    if not key:
+        return None
+    try:
+        with photo_store.open(key) as fh:
+            return fh.read()
+    except FileNotFoundError:
+        return None
+
+
+def member_photo_urls(member: "Member") -> dict:
+    """Photo URLs from the row alone (no storage access)."""
+    if not member.photo_key:
+        return {'image_url': None, 'thumb_url': None, 'photo_url': None}
+    if photo_store.backend == 'local':
+        image_url = f"/static/uploads/{member.photo_key}"
+    else:
+        image_url = f"/files/uploads/{member.photo_key}"
+    return {
+        'image_url': image_url,
+        'thumb_url': f"/media/members/{_photo_derivative_name(member.id, member.photo_etag, 'thumb')}",
+        'photo_url': f"/media/members/{_photo_derivative_name(member.id, member.photo_etag, 'md')}",
+    }
+
+
+def _stream_etag(fh) -> str:
+    h = hashlib.sha256()
+    for chunk in iter(lambda: fh.read(1 << 16), b''):
+        h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+def backfill_member_photos() -> int:
+    """Set photo_key/photo_etag for rows whose photo predates the columns. One listing of the store."""
+    found: dict[int, object] = {}
+    for obj in photo_store.list():
+        if '/' in obj.key:
+            continue
+        stem, ext = os.path.splitext(obj.key)
+        if ext.lower() in ALLOWED_IMAGE_EXTS and stem.startswith('member_') and stem[7:].isdigit():
+            member_id = int(stem[7:])
+            prev = found.get(member_id)
+            if prev is None or obj.modified > prev.modified:
+                found[member_id] = obj
+    updated = 0
+    for member in Member.query.filter(Member.photo_key.is_(None), Member.id.in_(list(found))).yield_per(500):
+        member.photo_key = found[member.id].key
+        with photo_store.open(member.photo_key) as fh:
+            member.photo_etag = _stream_etag(fh)
+        updated += 1
+    db.session.commit()
+    return updated
+
+CARD_W, CARD_H = 523, 220  # card design size in points; sheets scale it down
+
+
+def _draw_qr(c, data: str, x: float, y: float, size: float) -> None:
+    """QR code as one filled path of dark runs.
+
+    Same encoder as reportlab's QrCodeWidget, without building a Shape per
+    module (which dominated the cost of bulk card sheets).
+    """
+    qr = qrencoder.QRCode(None, qrencoder.QRErrorCorrectLevel.M)
+    qr.addData(data)
+    qr.make()
+    n = qr.getModuleCount()
+    box = size / n
+    path = c.beginPath()
+    for r, row in enumerate(qr.modules):
+        col = 0
+        while col < n:
+            if row[col]:
+                start = col
+                while col < n and row[col]:
+                    col += 1
+                path.rect(x + start * box, y + size - (r + 1) * box, (col - start) * box, box)
+            else:
+                col += 1
+    c.setFillColor(HexColor("#000000"))
+    c.drawPath(path, fill=1, stroke=0)
+
+
+def _draw_member_card(c, member: "Member", x: float, y: float, scale: float = 1.0, issued: str | None = None) -> None:
+    """Draw one card with its bottom-left corner at (x, y)."""
+    c.saveState()
+    c.translate(x, y)
+    c.scale(scale, scale)
+    card_w, card_h = CARD_W, CARD_H
     # Background
     c.setFillColor(HexColor("#111827"))
-    c.roundRect(card_x, card_y, card_w, card_h, 12, fill=1, stroke=0)
+    c.roundRect(0, 0, card_w, card_h, 12, fill=1, stroke=0)
     # Accent bar
     c.setFillColor(HexColor("#2563EB"))
-    c.roundRect(card_x, card_y + card_h - 24, card_w, 24, 12, fill=1, stroke=0)
+    c.roundRect(0, card_h - 24, card_w, 24, 12, fill=1, stroke=0)
     # Title
     c.setFillColor(HexColor("#FFFFFF"))
     c.setFont("Helvetica-Bold", 14)
-    c.drawString(card_x + 16, card_y + card_h - 18, f"{get_gym_name()} - MEMBER CARD")
+    c.drawString(16, card_h - 18, f"{get_gym_name()} - MEMBER CARD")
     # Photo area
-    img_path = _find_member_image_abs_path(member.id)
+    photo = member_photo_bytes(member, 'md') or member_photo_bytes(member)
     img_size = 120
-    img_x = card_x + 16
-    img_y = card_y + card_h - 24 - 16 - img_size
-    if img_path:
+    img_x = 16
+    img_y = card_h - 24 - 16 - img_size
+    if photo:
         try:
-            c.drawImage(ImageReader(img_path), img_x, img_y, width=img_size, height=img_size, preserveAspectRatio=True, mask='auto')
+            c.drawImage(ImageReader(BytesIO(photo)), img_x, img_y, width=img_size, height=img_size, preserveAspectRatio=True, mask='auto')
         except Exception:
             # draw placeholder
             c.setFillColor(HexColor("#374151"))
@@ -205,7 +411,7 @@ def _build_member_card_pdf_bytes(member: "Member") -> tuple[bool, bytes, str]:
         c.rect(img_x, img_y, img_size, img_size, fill=1, stroke=0)
     # Details
     text_x = img_x + img_size + 20
-    text_y = card_y + card_h - 50
+    text_y = card_h - 50
     c.setFillColor(HexColor("#E5E7EB"))
     c.setFont("Helvetica", 12)
     serial = 1000 + (member.id or 0)
@@ -213,32 +419,133 @@ def _build_member_card_pdf_bytes(member: "Member") -> tuple[bool, bytes, str]:
     c.drawString(text_x, text_y - 20, f"Serial: #{serial}")
     c.drawString(text_x, text_y - 40, f"Phone: {member.phone or ''}")
     c.drawString(text_x, text_y - 60, f"Admission Date: {member.admission_date.isoformat()}")
+    # Check-in QR (signed token, see /api/checkin/<token>)
+    qr_size = 110
+    c.setFillColor(HexColor("#FFFFFF"))
+    c.rect(card_w - 16 - qr_size - 4, img_y - 4, qr_size + 8, qr_size + 8, fill=1, stroke=0)
+    _draw_qr(c, member_checkin_token(member.id), card_w - 16 - qr_size, img_y, qr_size)
     # Footer / issued date
     c.setFillColor(HexColor("#60A5FA"))
     c.setFont("Helvetica-Oblique", 10)
-    c.drawString(card_x + 16, card_y + 12, f"Issued: {datetime.now().strftime('%Y-%m-%d')}")
+    c.drawString(16, 12, f"Issued: {issued or datetime.now().strftime('%Y-%m-%d')}")
+    c.restoreState()
+
+
+def _build_member_card_pdf_bytes(member: "Member", issued: str | None = None) -> tuple[bool, bytes, str]:
+    if not HAVE_PDF:
+        return False, b"", "PDF generation library not installed"
+    buf = BytesIO()
+    page_w, page_h = A4
+    c = _pdf_canvas.Canvas(buf, pagesize=A4)
+    margin = 36
+    _draw_member_card(c, member, margin, page_h - margin - CARD_H, scale=(page_w - margin * 2) / CARD_W, issued=issued)
     c.showPage()
     c.save()
     buf.seek(0)
     return True, buf.read(), f"card_member_{member.id}.pdf"
 
 
-def _save_member_image(member_id: int, storage) -> tuple[bool, str]:
+# Rendered cards are cached on disk as member_<id>_<key>.pdf. The key hashes
+# everything printed on the card, the "Issued" date included, so a stale file
+# (or yesterday's) is simply never looked up; _invalidate_member_card removes
+# the old file once the new one is written.
+CARD_CACHE_DIR = os.getenv('CARD_CACHE_DIR') or os.path.join(BASE_DIR, 'cache', 'cards')
+CARD_LAYOUT_VERSION = 2
+
+
+def _member_card_key(member: "Member", issued: str) -> str:
+    photo = [member.photo_key, member.photo_etag] if member.photo_key else None
+    parts = [
+        CARD_LAYOUT_VERSION, member.id, member.name, member.phone or '',
+        member.admission_date.isoformat() if member.admission_date else '', photo, get_gym_name(),
+        member_checkin_token(member.id), issued,
+    ]
+    return hashlib.sha256(json.dumps(parts, default=str).encode('utf-8')).hexdigest()[:20]
+
+
+def _invalidate_member_card(member_id: int, keep: str | None = None) -> None:
+    prefix = f"member_{member_id}_"
+    try:
+        names = os.listdir(CARD_CACHE_DIR)
+    except OSError:
+        return
+    for name in names:
+        if name.startswith(prefix) and name != keep:
+            try:
+                os.remove(os.path.join(CARD_CACHE_DIR, name))
+            except OSError:
+                pass
+
+
+def _member_card_pdf(member: "Member") -> tuple[bool, bytes, str]:
+    """Cached variant of _build_member_card_pdf_bytes."""
+    fname = f"card_member_{member.id}.pdf"
+    issued = datetime.now().strftime('%Y-%m-%d')
+    cache_name = f"member_{member.id}_{_member_card_key(member, issued)}.pdf"
+    cache_path = os.path.join(CARD_CACHE_DIR, cache_name)
+    try:
+        with open(cache_path, 'rb') as fh:
+            return True, fh.read(), fname
+    except OSError:
+        pass
+    ok, pdf_bytes, msg = _build_member_card_pdf_bytes(member, issued)
+    if not ok:
+        return ok, pdf_bytes, msg
+    try:
+        os.makedirs(CARD_CACHE_DIR, exist_ok=True)
+        tmp = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as fh:
+            fh.write(pdf_bytes)
+        os.replace(tmp, cache_path)
+        _invalidate_member_card(member.id, keep=cache_name)
+    except OSError:
+        pass
+    return True, pdf_bytes, fname
+
+
+def _write_member_card_sheet(members, out) -> int:
+    """Lay out ID-card sized cards (2 per row) on A4 pages into ``out``. Returns cards drawn."""
+    page_w, page_h = A4
+    margin, gap = 28, 10
+    cell_w = (page_w - 2 * margin - gap) / 2
+    scale = cell_w / CARD_W
+    cell_h = CARD_H * scale
+    rows = int((page_h - 2 * margin + gap) // (cell_h + gap))
+    per_page = rows * 2
+    issued = datetime.now().strftime('%Y-%m-%d')
+    c = _pdf_canvas.Canvas(out, pagesize=A4)
+    count = 0
+    for member in members:
+        slot = count % per_page
+        if count and slot == 0:
+            c.showPage()
+        row, col = divmod(slot, 2)
+        x = margin + col * (cell_w + gap)
+        y = page_h - margin - (row + 1) * cell_h - row * gap
+        _draw_member_card(c, member, x, y, scale=scale, issued=issued)
+        count += 1
+    if count == 0:
+        c.setFont("Helvetica", 12)
+        c.drawString(margin, page_h - margin - 12, "No members matched.")
+    c.showPage()
+    c.save()
+    return count
+
+
+def _save_member_image(member: "Member", storage) -> tuple[bool, str]:
+    """Store the upload as the member's photo and set photo_key/photo_etag (caller commits)."""
     filename = storage.filename or ''
     ext = os.path.splitext(filename)[1].lower()
     if ext not in ALLOWED_IMAGE_EXTS:
         return False, 'Only JPG, JPEG, PNG, WEBP images are allowed'
-    # Remove any existing images for this member (any ext)
-    for e in ALLOWED_IMAGE_EXTS:
-        existing = os.path.join(UPLOAD_FOLDER, f"member_{member_id}{e}")
-        try:
-            if os.path.exists(existing):
-                os.remove(existing)
-        except Exception:
-            pass
-    dest = os.path.join(UPLOAD_FOLDER, f"member_{member_id}{ext}")
-    storage.save(dest)
-    return True, f"/static/uploads/member_{member_id}{ext}"
+    key = f"member_{member.id}{ext}"
+    reader = HashingReader(storage.stream)
+    photo_store.put_file(key, reader, storage.mimetype or None)
+    if member.photo_key and member.photo_key != key:
+        photo_store.delete(member.photo_key)
+    member.photo_key = key
+    member.photo_etag = reader.sha256.hexdigest()[:16]
+    return True, member_photo_urls(member)['image_url']
 
 class Member(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -256,30 +563,48 @@ class Member(db.Model):
     monthly_fee = db.Column(db.Float, nullable=True)
     last_contact_at = db.Column(db.DateTime, nullable=True)
     is_active = db.Column(db.Boolean, default=True)  # Member active/inactive status
-
-    def to_dict(self):
-        # Compute current month fee status and last recorded amount
-        now = datetime.now()
-        try:
-            p = Payment.query.filter_by(member_id=self.id, year=now.year, month=now.month).first()
-            status = p.status if p else 'Unpaid'
-        except Exception:
-            status = 'Unpaid'
-        try:
-            tx = PaymentTransaction.query.filter_by(
-                member_id=self.id,
-                year=now.year,
-                month=now.month
-            ).order_by(PaymentTransaction.created_at.desc()).first()
-            last_amt = float(tx.amount) if tx and tx.amount is not None else None
-            last_time = tx.created_at.isoformat() if tx and tx.created_at else None
-        except Exception:
-            last_amt = None
-            last_time = None
-        try:
-            monthly_price = float(get_setting('monthly_price') or '0')
-        except Exception:
-            monthly_price = 0.0
+    photo_key = db.Column(db.String(80), nullable=True)  # file name under static/uploads
+    photo_etag = db.Column(db.String(32), nullable=True)  # content hash, versions derivative URLs
+
+    def to_dict(self, fields: set[str] | None = None, fee_info: tuple | None = None,
+                monthly_price: float | None = None, country_code: str | None = None):
+        """Serialize for the API.
+
+        ``fields`` limits the output to those keys (and skips the lookups they
+        need). ``fee_info`` is an optional prefetched ``(status, amount, time)``
+        for the current month, see ``_members_to_dicts``.
+        """
+        def want(*keys):
+            return fields is None or any(k in fields for k in keys)
+
+        status, last_amt, last_time = 'Unpaid', None, None
+        if want(*MEMBER_FEE_FIELDS):
+            if fee_info is not None:
+                status, last_amt, last_time = fee_info
+            else:
+                # Compute current month fee status and last recorded amount
+                now = datetime.now()
+                try:
+                    p = Payment.query.filter_by(member_id=self.id, year=now.year, month=now.month).first()
+                    status = p.status if p else 'Unpaid'
+                except Exception:
+                    status = 'Unpaid'
+                try:
+                    tx = PaymentTransaction.query.filter_by(
+                        member_id=self.id,
+                        year=now.year,
+                        month=now.month
+                    ).order_by(PaymentTransaction.created_at.desc()).first()
+                    last_amt = float(tx.amount) if tx and tx.amount is not None else None
+                    last_time = tx.created_at.isoformat() if tx and tx.created_at else None
+                except Exception:
+                    last_amt = None
+                    last_time = None
+        if monthly_price is None and want('monthly_price'):
+            try:
+                monthly_price = float(get_setting('monthly_price') or '0')
+            except Exception:
+                monthly_price = 0.0
         display_training = None
         if self.custom_training and self.custom_training.strip():
             display_training = self.custom_training.strip()
@@ -289,14 +614,17 @@ class Member(db.Model):
             elif tt == 'personal': display_training = 'Personal'
             elif tt == 'cardio': display_training = 'Cardio'
             else: display_training = tt
-        return {
+        photos = member_photo_urls(self)
+        data = {
             "id": self.id,
             "serial": 1000 + (self.id or 0),
             "name": self.name,
             "phone": self.phone,
-            "phone_normalized": _normalize_phone(self.phone or ''),
+            "phone_normalized": _normalize_phone(self.phone or '', country_code) if want('phone_normalized') else None,
             "admission_date": self.admission_date.isoformat(),
-            "image_url": find_member_image_url(self.id) if self.id else None,
+            "image_url": photos['image_url'],
+            "thumb_url": photos['thumb_url'],
+            "photo_url": photos['photo_url'],
             "plan_type": self.plan_type or 'monthly',
             "referral_code": self.referral_code or '',
             "referred_by": self.referred_by,
@@ -315,6 +643,19 @@ class Member(db.Model):
             "last_contact_at": self.last_contact_at.isoformat() if self.last_contact_at else None,
             "is_active": bool(self.is_active) if hasattr(self, 'is_active') else True,
         }
+        if fields is not None:
+            data = {k: v for k, v in data.items() if k in fields or k == 'id'}
+        return data
+
+
+MEMBER_API_FIELDS = (
+    'id', 'serial', 'name', 'phone', 'phone_normalized', 'admission_date', 'image_url', 'thumb_url', 'photo_url',
+    'plan_type', 'referral_code', 'referred_by', 'access_tier', 'email', 'training_type',
+    'special_tag', 'current_fee_status', 'current_fee_amount', 'last_tx_time', 'last_tx_amount',
+    'monthly_price', 'custom_training', 'monthly_fee', 'display_training_type',
+    'last_contact_at', 'is_active',
+)
+MEMBER_FEE_FIELDS = ('current_fee_status', 'current_fee_amount', 'last_tx_time', 'last_tx_amount')
 
 class Payment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -352,6 +693,19 @@ class PaymentTransaction(db.Model):
     method = db.Column(db.String(50), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'member_id': self.member_id,
+            'user_id': self.user_id,
+            'plan_type': self.plan_type,
+            'year': self.year,
+            'month': self.month,
+            'amount': self.amount,
+            'method': self.method,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+
 class Setting(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     key = db.Column(db.String(100), unique=True, nullable=False)
@@ -385,6 +739,8 @@ class Product(db.Model):
     is_active = db.Column(db.Boolean, nullable=False, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Low-stock lookups: is_active = 1 AND stock <= :threshold
+    __table_args__ = (db.Index('ix_product_active_stock', 'is_active', 'stock'),)
 
     def to_dict(self):
         return {
@@ -416,6 +772,9 @@ class Sale(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     synced_from_offline = db.Column(db.Boolean, nullable=False, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Set once the sale reached each export target (see SaleExportQueue)
+    sheet_exported_at = db.Column(db.DateTime, nullable=True)
+    csv_exported_at = db.Column(db.DateTime, nullable=True)
     items = db.relationship('SaleItem', backref='sale', cascade='all, delete-orphan')
 
     def to_dict(self, include_items: bool = False):
@@ -440,6 +799,88 @@ class Sale(db.Model):
         return data
 
 
+class SalesDaily(db.Model):
+    # Rollup of sale totals per UTC day, maintained by _add_sale
+    day = db.Column(db.Date, primary_key=True)
+    total = db.Column(db.Float, nullable=False, default=0.0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ProductSalesDaily(db.Model):
+    # Per-product rollup per UTC day; product_id 0 = ad-hoc items without a product
+    day = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(140), primary_key=True)
+    qty = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+
+
+class StockMovement(db.Model):
+    # Append-only stock ledger: one row per product change (sale, adjust, import)
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
+    sale_id = db.Column(db.Integer, db.ForeignKey('sale.id'), nullable=True)
+    delta = db.Column(db.Integer, nullable=False)
+    stock_after = db.Column(db.Integer, nullable=True)
+    reason = db.Column(db.String(30), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'product_id': self.product_id,
+            'sale_id': self.sale_id,
+            'delta': self.delta,
+            'stock_after': self.stock_after,
+            'reason': self.reason,
+            'user_id': self.user_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+
+
+class CheckIn(db.Model):
+    # Append-only scanner log, written in batches by CheckinWriter
+    __tablename__ = 'checkin'
+    id = db.Column(db.Integer, primary_key=True)
+    member_id = db.Column(db.Integer, db.ForeignKey('member.id'), nullable=False)
+    direction = db.Column(db.String(3), nullable=False, default='in')  # in/out
+    allowed = db.Column(db.Boolean, nullable=False, default=True)
+    access_tier = db.Column(db.String(20), nullable=True)
+    source = db.Column(db.String(20), nullable=True)  # kiosk/staff
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)  # server local time
+    __table_args__ = (
+        db.Index('ix_checkin_created_at', 'created_at'),
+        db.Index('ix_checkin_member_created', 'member_id', 'created_at'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'member_id': self.member_id,
+            'direction': self.direction,
+            'allowed': bool(self.allowed),
+            'access_tier': self.access_tier,
+            'source': self.source,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+
+
+class CheckinHourly(db.Model):
+    # Occupancy rollup per local hour; CheckinDaily is the same per day
+    hour = db.Column(db.DateTime, primary_key=True)
+    entries = db.Column(db.Integer, nullable=False, default=0)
+    exits = db.Column(db.Integer, nullable=False, default=0)
+    denied = db.Column(db.Integer, nullable=False, default=0)
+
+
+class CheckinDaily(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    entries = db.Column(db.Integer, nullable=False, default=0)
+    exits = db.Column(db.Integer, nullable=False, default=0)
+    denied = db.Column(db.Integer, nullable=False, default=0)
+
+
 class SaleItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     sale_id = db.Column(db.Integer, db.ForeignKey('sale.id'), nullable=False)
@@ -461,6 +902,45 @@ class SaleItem(db.Model):
         }
 
 
+class LiveEvent(db.Model):
+    # Short-lived feed behind /api/events (pruned after LIVE_EVENT_RETENTION_HOURS)
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    kind = db.Column(db.String(50), nullable=False)
+    data_json = db.Column(db.Text, nullable=False)
+
+
+class Counter(db.Model):
+    # Named monotonic counters behind allocate_sequence()
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class AppliedOp(db.Model):
+    # Client-generated op ids already ingested by /api/ops/batch (replay guard)
+    op_id = db.Column(db.String(64), primary_key=True)
+    kind = db.Column(db.String(40), nullable=False)
+    ok = db.Column(db.Boolean, default=True)
+    result_json = db.Column(db.Text, nullable=True)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class ChangeLog(db.Model):
+    # Monotonic change feed behind /api/sync. seq is never reused (AUTOINCREMENT)
+    __table_args__ = {'sqlite_autoincrement': True}
+    seq = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)  # member/payment/transaction, '*' for reset
+    entity_id = db.Column(db.Integer, nullable=True)
+    op = db.Column(db.String(10), nullable=False)  # upsert/delete/reset
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class DataVersion(db.Model):
+    # Per-table change counters; bumped in the same transaction as the write.
+    table_name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
 class LoginLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, nullable=True)
@@ -482,6 +962,60 @@ def set_setting(key: str, value: str) -> None:
         s.value = value
     db.session.commit()
 
+# Tables whose writes invalidate cached API responses (see etag_versioned)
+VERSIONED_TABLES = ('member', 'payment', 'payment_transaction', 'setting')
+
+def _bump_data_version(connection, tables) -> None:
+    table = DataVersion.__table__
+    for name in sorted(set(tables)):
+        res = connection.execute(
+            table.update().where(table.c.table_name == name).values(version=table.c.version + 1)
+        )
+        if not res.rowcount:
+            connection.execute(table.insert().values(table_name=name, version=1))
+
+@event.listens_for(db.session, 'after_flush')
+def _track_data_versions(session, flush_context):
+    touched = {
+        obj.__table__.name
+        for obj in (*session.new, *session.dirty, *session.deleted)
+        if getattr(obj, '__table__', None) is not None and obj.__table__.name in VERSIONED_TABLES
+    }
+    if touched:
+        _bump_data_version(session.connection(), touched)
+
+@event.listens_for(db.session, 'after_flush')
+def _track_changes(session, flush_context):
+    rows = []
+    for op, objs in (('upsert', session.new), ('upsert', session.dirty), ('delete', session.deleted)):
+        for obj in objs:
+            table = getattr(obj, '__table__', None)
+            entity = SYNC_ENTITIES.get(table.name) if table is not None else None
+            if entity is None or getattr(obj, 'id', None) is None:
+                continue
+            if objs is session.dirty and not session.is_modified(obj, include_collections=False):
+                continue
+            rows.append({'entity': entity, 'entity_id': obj.id, 'op': op, 'changed_at': datetime.utcnow()})
+    if rows:
+        session.connection().execute(ChangeLog.__table__.insert(), rows)
+
+def record_changes(entity: str, ids, op: str = 'upsert') -> None:
+    """Log changes made outside the ORM unit of work (bulk deletes/updates).
+    Commits with the session."""
+    now = datetime.utcnow()
+    rows = [{'entity': entity, 'entity_id': int(i), 'op': op, 'changed_at': now} for i in ids]
+    if rows:
+        db.session.connection().execute(ChangeLog.__table__.insert(), rows)
+
+def mark_tables_changed(*tables: str) -> None:
+    """Bump data versions for writes that bypass the ORM unit of work
+    (bulk ``query.delete()``/``update()``). Commits with the session."""
+    _bump_data_version(db.session.connection(), tables)
+
+def get_data_versions(tables) -> dict[str, int]:
+    rows = db.session.query(DataVersion.table_name, DataVersion.version).filter(DataVersion.table_name.in_(list(tables))).all()
+    return {name: int(version or 0) for name, version in rows}
+
 def _sql_column_exists(table: str, column: str) -> bool:
     try:
         res = db.session.execute(db.text(f"PRAGMA table_info('{table}')")).mappings().all()
@@ -494,6 +1028,7 @@ def _sql_column_exists(table: str, column: str) -> bool:
 
 def _ensure_schema():
     db.create_all()
+    photo_columns_added = False
     try:
         if not _sql_column_exists('member', 'plan_type'):
             db.session.execute(db.text("ALTER TABLE member ADD COLUMN plan_type TEXT DEFAULT 'monthly'"))
@@ -519,36 +1054,226 @@ def _ensure_schema():
             db.session.execute(db.text("ALTER TABLE member ADD COLUMN last_contact_at TEXT"))
         if not _sql_column_exists('member', 'is_active'):
             db.session.execute(db.text("ALTER TABLE member ADD COLUMN is_active INTEGER DEFAULT 1"))
+        if not _sql_column_exists('member', 'photo_key'):
+            db.session.execute(db.text("ALTER TABLE member ADD COLUMN photo_key TEXT"))
+            db.session.execute(db.text("ALTER TABLE member ADD COLUMN photo_etag TEXT"))
+            photo_columns_added = True
+        if not _sql_column_exists('sale', 'sheet_exported_at'):
+            db.session.execute(db.text("ALTER TABLE sale ADD COLUMN sheet_exported_at DATETIME"))
+            db.session.execute(db.text("ALTER TABLE sale ADD COLUMN csv_exported_at DATETIME"))
+            # Earlier sales went through the old in-memory queue; don't resend them
+            db.session.execute(db.text("UPDATE sale SET sheet_exported_at = CURRENT_TIMESTAMP, csv_exported_at = CURRENT_TIMESTAMP"))
+        db.session.execute(db.text("CREATE INDEX IF NOT EXISTS ix_product_active_stock ON product (is_active, stock)"))
         db.session.commit()
     except Exception:
         db.session.rollback()
+    if photo_columns_added:
+        try:
+            backfill_member_photos()
+        except Exception:
+            db.session.rollback()
+    try:
+        # First start with the rollup tables: backfill them from existing sales
+        if db.session.query(SalesDaily.day).first() is None and db.session.query(Sale.id).first() is not None:
+            rebuild_sales_rollups()
+    except Exception:
+        db.session.rollback()
 
 def _hash_bytes(data: bytes) -> str:
     h = hashlib.sha256(); h.update(data); return h.hexdigest()
 
-def _gen_referral_code(prefix: str = 'M') -> str:
-    code = f"{prefix}{secrets.token_hex(3)}"
-    while Member.query.filter_by(referral_code=code).first() is not None:
-        code = f"{prefix}{secrets.token_hex(3)}"
-    return code
+def allocate_sequence(name: str, count: int = 1) -> range:
+    """Reserve ``count`` consecutive values from the named counter.
 
+    A single ``UPDATE ... SET value = value + :n`` claims the whole block, so
+    callers never probe for free values and concurrent writers cannot hand
+    out the same number. Runs in the caller's transaction; values from a
+    rolled-back transaction are simply reused.
+    """
+    if count < 1:
+        raise ValueError('count must be >= 1')
+    table = Counter.__table__
+    stmt = table.update().where(table.c.name == name).values(value=table.c.value + count)
+    for _ in range(2):
+        if db.engine.dialect.update_returning:
+            row = db.session.execute(stmt.returning(table.c.value)).first()
+        else:
+            row = None
+            if db.session.execute(stmt).rowcount:
+                row = db.session.execute(db.select(table.c.value).where(table.c.name == name)).first()
+        if row is not None:
+            end = int(row[0])
+            return range(end - count + 1, end + 1)
+        try:
+            # First use of this counter
+            with db.session.begin_nested():
+                db.session.execute(table.insert().values(name=name, value=count))
+            return range(1, count + 1)
+        except IntegrityError:
+            continue  # another writer created it; claim through the UPDATE
+    raise RuntimeError(f'could not allocate from counter {name}')
+
+_CROCKFORD = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+def encode_base32(n: int, width: int = 1) -> str:
+    """Crockford base32 (no I, L, O, U), zero-padded to ``width``."""
+    if n < 0:
+        raise ValueError('n must be >= 0')
+    out = []
+    while n:
+        n, r = divmod(n, 32)
+        out.append(_CROCKFORD[r])
+    return ''.join(reversed(out)).rjust(width, '0')
+
+# Referral codes are shared publicly, so sequence numbers are scrambled with
+# an odd multiplier mod 32**7 (a bijection, so still collision-free). Seven
+# base32 digits also keep them clear of the legacy 6-hex-digit codes.
+_REFERRAL_WIDTH = 7
+_REFERRAL_SPACE = 32 ** _REFERRAL_WIDTH
+_REFERRAL_MULT = 0x2F0F1A3B  # odd, so invertible mod 2**35
+
+def referral_codes(count: int, prefix: str = 'M') -> list[str]:
+    return [
+        f"{prefix}{encode_base32((n * _REFERRAL_MULT) % _REFERRAL_SPACE, _REFERRAL_WIDTH)}"
+        for n in allocate_sequence('referral_code', count)
+    ]
 
-def _generate_invoice_number() -> str:
+def invoice_numbers(count: int) -> list[str]:
+    """Invoice numbers as PREFIXyyyymmdd-NNNNNN from one global counter.
+    POS_INVOICE_ENCODING=decimal switches the suffix from base32 to digits."""
     prefix = os.getenv('POS_INVOICE_PREFIX', 'INV')
     day = datetime.now(timezone.utc).strftime('%Y%m%d')
-    while True:
-        suffix = secrets.token_hex(2).upper()
-        candidate = f"{prefix}{day}-{suffix}"
-        if not Sale.query.filter_by(invoice_number=candidate).first():
-            return candidate
+    decimal = os.getenv('POS_INVOICE_ENCODING', 'base32').lower() == 'decimal'
+    return [
+        f"{prefix}{day}-{str(n).zfill(6) if decimal else encode_base32(n, 6)}"
+        for n in allocate_sequence('invoice', count)
+    ]
+
+def _gen_referral_code(prefix: str = 'M') -> str:
+    return referral_codes(1, prefix)[0]
+
+
+def _generate_invoice_number() -> str:
+    return invoice_numbers(1)[0]
+
+
+def _sale_hash(secret: bytes, invoice: str, total: float) -> str:
+    return hashlib.sha256((invoice or '').encode('utf-8') + str(total or 0).encode('utf-8') + secret).hexdigest()
 
 
 def _sale_verification_hash(invoice: str, total: float) -> str:
-    h = hashlib.sha256()
-    h.update((invoice or '').encode('utf-8'))
-    h.update(str(total or 0).encode('utf-8'))
-    h.update((app.config.get('SECRET_KEY') or 'secret').encode('utf-8'))
-    return h.hexdigest()
+    return _sale_hash((app.config.get('SECRET_KEY') or 'secret').encode('utf-8'), invoice, total)
+
+
+def member_checkin_token(member_id: int) -> str:
+    """``<id>-<sig>`` printed as the card QR; the signature is a truncated HMAC of the id."""
+    key = (app.config.get('SECRET_KEY') or 'secret').encode('utf-8')
+    digest = hmac.new(key, f"member-checkin:{int(member_id)}".encode('utf-8'), hashlib.sha256).digest()
+    return f"{int(member_id)}-{encode_base32(int.from_bytes(digest[:10], 'big'), 16)}"
+
+
+def parse_checkin_token(token: str) -> int | None:
+    """Member id for a valid token, else None. No database access."""
+    head, _, sig = (token or '').strip().upper().partition('-')
+    if not head.isdigit() or len(sig) != 16 or len(head) > 12:
+        return None
+    member_id = int(head)
+    expected = member_checkin_token(member_id).partition('-')[2]
+    return member_id if hmac.compare_digest(expected, sig) else None
+
+
+def _find_hash_mismatches(secret: bytes, rows: list[tuple]) -> list[tuple]:
+    """Rows are (id, invoice_number, total, verification_hash). Top-level so it can run in a process pool."""
+    return [row for row in rows if _sale_hash(secret, row[1], row[2]) != row[3]]
+
+
+SALES_VERIFIED_SETTING = 'sales_verified_through_id'
+SALES_VERIFY_REPORT_SETTING = 'sales_verify_last_report'
+MAX_REPORTED_MISMATCHES = 1000
+
+
+def _process_pool(workers: int):
+    """ProcessPoolExecutor whose workers start fresh instead of forking this
+    process (its scheduler/writer threads, locks and open SQLite handles)."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+
+def verify_sales(full: bool = False, workers: int = 0, batch_size: int = 5000) -> dict:
+    """Recompute Sale.verification_hash for sales after the stored high-water mark.
+
+    Only (id, invoice, total, hash) columns are streamed with ``yield_per`` and
+    checked batch by batch; ``workers > 1`` spreads batches over a process pool.
+    The mark advances to the last id checked, so later runs only see new
+    sales. ``full=True`` starts from the beginning to catch edits to rows that
+    were already verified.
+    """
+    started = time.monotonic()
+    secret = (app.config.get('SECRET_KEY') or 'secret').encode('utf-8')
+    from_id = 0 if full else int(get_setting(SALES_VERIFIED_SETTING, '0') or 0)
+    result = db.session.execute(
+        db.select(Sale.id, Sale.invoice_number, Sale.total, Sale.verification_hash)
+        .where(Sale.id > from_id)
+        .order_by(Sale.id)
+        .execution_options(yield_per=batch_size)
+    )
+    batches = (list(map(tuple, part)) for part in result.partitions())
+    checked, through_id, mismatches = 0, from_id, []
+
+    def _collect(batch, bad):
+        nonlocal checked, through_id
+        checked += len(batch)
+        through_id = max(through_id, batch[-1][0])
+        mismatches.extend(bad)
+
+    if workers and workers > 1:
+        with _process_pool(workers) as pool:
+            pending = []
+            for batch in batches:
+                pending.append((batch, pool.submit(_find_hash_mismatches, secret, batch)))
+                if len(pending) >= workers * 2:
+                    b, fut = pending.pop(0)
+                    _collect(b, fut.result())
+            for b, fut in pending:
+                _collect(b, fut.result())
+    else:
+        for batch in batches:
+            _collect(batch, _find_hash_mismatches(secret, batch))
+
+    report = {
+        'full': bool(full),
+        'from_id': from_id,
+        'through_id': through_id,
+        'checked': checked,
+        'mismatch_count': len(mismatches),
+        'mismatches': [
+            {'id': r[0], 'invoice_number': r[1], 'total': float(r[2] or 0.0)}
+            for r in mismatches[:MAX_REPORTED_MISMATCHES]
+        ],
+        'seconds': round(time.monotonic() - started, 3),
+        'finished_at': datetime.utcnow().isoformat(),
+    }
+    if through_id > from_id or full:
+        set_setting(SALES_VERIFIED_SETTING, str(through_id))
+    set_setting_json(SALES_VERIFY_REPORT_SETTING, report)
+    if mismatches:
+        append_audit('sales.verify.mismatch', {'count': len(mismatches), 'ids': [r[0] for r in mismatches[:50]]})
+    return report
+
+
+@app.cli.command('verify-sales')
+@click.option('--full', is_flag=True, help='Re-check every sale, ignoring the high-water mark.')
+@click.option('--workers', default=0, type=int, help='Process pool size (0 = in-process).')
+@click.option('--batch-size', default=5000, type=int)
+def verify_sales_command(full, workers, batch_size):
+    """Recompute sale verification hashes and report tampered rows."""
+    report = verify_sales(full=full, workers=workers, batch_size=batch_size)
+    print(f"Checked {report['checked']} sale(s) (ids {report['from_id'] + 1}..{report['through_id']}) in {report['seconds']}s")
+    for row in report['mismatches']:
+        print(f"MISMATCH sale {row['id']} invoice {row['invoice_number']} total {row['total']}")
+    if report['mismatch_count']:
+        raise SystemExit(1)
 
 
 def _log_login_event(user: "User", method: str) -> None:
@@ -565,6 +1290,23 @@ def _log_login_event(user: "User", method: str) -> None:
         db.session.rollback()
 
 
+# Discovery clients are expensive to build (credentials + discovery doc), so
+# one per (api, scope, key file) is kept for the life of the process. The
+# underlying httplib2 transport is not thread-safe; calls go through the lock.
+_google_clients: dict[tuple, object] = {}
+_google_client_lock = threading.RLock()
+
+def _google_client(api: str, version: str, scope: str, sa_file: str):
+    key = (api, version, scope, sa_file)
+    with _google_client_lock:
+        client = _google_clients.get(key)
+        if client is None:
+            creds = service_account.Credentials.from_service_account_file(sa_file, scopes=[scope])
+            client = build(api, version, credentials=creds, cache_discovery=False)
+            _google_clients[key] = client
+        return client
+
+
 def _sale_to_csv_bytes(sale: Sale) -> bytes:
     rows = ["invoice_number,customer,total,payment_method,created_at"]
     rows.append(
@@ -578,7 +1320,19 @@ def _sale_to_csv_bytes(sale: Sale) -> bytes:
     return "\n".join(rows).encode('utf-8')
 
 
-def _append_sale_to_sheet(sale: Sale) -> tuple[bool, str | dict]:
+def _sale_sheet_row(sale: Sale) -> list:
+    return [
+        sale.invoice_number,
+        sale.created_at.isoformat() if sale.created_at else '',
+        sale.customer_name or '',
+        sale.total,
+        sale.payment_method or '',
+        json.dumps([item.to_dict() for item in sale.items]),
+    ]
+
+
+def _append_sales_to_sheet(sales: list[Sale]) -> tuple[bool, str | dict]:
+    """Append one row per sale with a single values.append call."""
     if not HAVE_GDRIVE:
         return False, 'Google API client not installed'
     sheet_id = os.getenv('SALES_SHEET_ID')
@@ -586,41 +1340,173 @@ def _append_sale_to_sheet(sale: Sale) -> tuple[bool, str | dict]:
     if not (sheet_id and sa_file and os.path.exists(sa_file)):
         return False, 'Sheet configuration missing'
     try:
-        scopes = ['https://www.googleapis.com/auth/spreadsheets']
-        creds = service_account.Credentials.from_service_account_file(sa_file, scopes=scopes)
-        service = build('sheets', 'v4', credentials=creds)
-        payload = {
-            'values': [[
-                sale.invoice_number,
-                sale.created_at.isoformat() if sale.created_at else '',
-                sale.customer_name or '',
-                sale.total,
-                sale.payment_method or '',
-                json.dumps([item.to_dict() for item in sale.items]),
-            ]]
-        }
-        service.spreadsheets().values().append(
-            spreadsheetId=sheet_id,
-            range=os.getenv('SALES_SHEET_RANGE', 'Sheet1!A:F'),
-            valueInputOption='USER_ENTERED',
-            body=payload,
-        ).execute()
+        service = _google_client('sheets', 'v4', 'https://www.googleapis.com/auth/spreadsheets', sa_file)
+        with _google_client_lock:
+            service.spreadsheets().values().append(
+                spreadsheetId=sheet_id,
+                range=os.getenv('SALES_SHEET_RANGE', 'Sheet1!A:F'),
+                valueInputOption='USER_ENTERED',
+                body={'values': [_sale_sheet_row(sale) for sale in sales]},
+            ).execute()
         return True, 'appended'
     except Exception as exc:
         return False, str(exc)
 
 
-def _upload_sale_artifacts_to_drive(sale: Sale) -> dict:
-    results = {}
-    csv_bytes = _sale_to_csv_bytes(sale)
-    ok, info = _upload_backup_to_gdrive(csv_bytes, f"sale_{sale.invoice_number}.csv", mime='text/csv')
-    results['csv'] = {'ok': ok, 'info': info}
-    sheet_ok, sheet_info = _append_sale_to_sheet(sale)
-    results['sheet'] = {'ok': sheet_ok, 'info': sheet_info}
-    return results
+def _upload_sales_csv(sales: list[Sale]) -> tuple[bool, dict | str]:
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')
+    csv_bytes = b"\n\n".join(_sale_to_csv_bytes(sale) for sale in sales)
+    fname = f"sales_{stamp}_{sales[0].invoice_number}_{len(sales)}.csv"
+    return _upload_backup_to_gdrive(csv_bytes, fname, mime='text/csv')
 
 
-def _persist_sale(payload: dict, user_id: int | None, synced_offline: bool = False) -> tuple[Sale, dict]:
+def _sales_export_targets() -> list[tuple[str, str, object]]:
+    """(result key, Sale marker column, sender) for each configured target."""
+    targets = []
+    if os.getenv('SALES_SHEET_ID'):
+        targets.append(('sheet', 'sheet_exported_at', _append_sales_to_sheet))
+    if os.getenv('DRIVE_FOLDER_ID'):
+        targets.append(('csv', 'csv_exported_at', _upload_sales_csv))
+    return targets
+
+
+def _sales_export_configured() -> bool:
+    if os.getenv('POS_GOOGLE_BACKUP_ENABLED', '1') in ('0', 'false', 'False') or not HAVE_GDRIVE:
+        return False
+    sa_file = os.getenv('GOOGLE_SERVICE_ACCOUNT_FILE')
+    return bool(sa_file and os.path.exists(sa_file) and (os.getenv('DRIVE_FOLDER_ID') or os.getenv('SALES_SHEET_ID')))
+
+
+class SaleExportQueue:
+    """Ships committed sales to Google Sheets/Drive off the request path.
+
+    Checkout only appends the sale id. A daemon thread drains the queue every
+    ``interval`` seconds (sooner once ``batch_size`` ids are waiting) and
+    sends the whole batch as one Sheets ``values.append`` and one CSV upload.
+    Each target stamps its own column on the sale once it succeeded, so a
+    retry after a failed CSV upload never appends the rows to the Sheet
+    again. Failed batches are retried on the next tick; ids still in memory
+    are flushed best-effort at interpreter exit and ``recover`` re-queues
+    whatever a previous process left unexported.
+    """
+
+    def __init__(self, interval: float, batch_size: int):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._pending: deque[int] = deque()
+        self._cond = threading.Condition()
+        self._worker = None
+        self.last_result: dict = {}
+
+    def enqueue(self, sale_id: int) -> None:
+        with self._cond:
+            self._pending.append(sale_id)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+        self._ensure_worker()
+
+    def pending_count(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def recover(self, days: int = 7) -> int:
+        """Queue recent sales with a configured target still unstamped."""
+        columns = [getattr(Sale, column) for _, column, _ in _sales_export_targets()]
+        if not columns:
+            return 0
+        since = datetime.utcnow() - timedelta(days=days)
+        ids = [sid for (sid,) in db.session.query(Sale.id)
+               .filter(Sale.created_at >= since, or_(*[c.is_(None) for c in columns]))
+               .order_by(Sale.id)]
+        with self._cond:
+            known = set(self._pending)
+            ids = [sid for sid in ids if sid not in known]
+            self._pending.extend(ids)
+        if ids:
+            self._ensure_worker()
+        return len(ids)
+
+    def _ensure_worker(self) -> None:
+        with self._cond:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run, name='sale-export', daemon=True)
+            self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if len(self._pending) < self.batch_size:
+                    self._cond.wait(self.interval)
+            try:
+                self.flush()
+            except Exception as exc:
+                self.last_result = {'ok': False, 'error': str(exc)}
+
+    def flush(self) -> dict:
+        """Export everything queued so far, batch_size ids per call."""
+        results = []
+        while True:
+            with self._cond:
+                batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            if not batch:
+                break
+            result = self._export(batch)
+            results.append(result)
+            if not result['ok']:
+                with self._cond:
+                    # Put the batch back in front and wait for the next tick
+                    self._pending.extendleft(reversed(batch))
+                break
+        if results:
+            self.last_result = results[-1]
+        return {'ok': all(r['ok'] for r in results), 'batches': results}
+
+    def _export(self, sale_ids: list[int]) -> dict:
+        with app.app_context():
+            sales = (
+                Sale.query.options(db.selectinload(Sale.items))
+                .filter(Sale.id.in_(sale_ids))
+                .order_by(Sale.id)
+                .all()
+            )
+            if not sales:
+                return {'ok': True, 'count': 0}
+            result = {'count': len(sales)}
+            ok = True
+            for target, column, send in _sales_export_targets():
+                todo = [sale for sale in sales if getattr(sale, column) is None]
+                if not todo:
+                    continue
+                sent, info = send(todo)
+                result[target] = {'ok': sent, 'info': info}
+                if sent:
+                    table = Sale.__table__
+                    db.session.execute(
+                        table.update().where(table.c.id.in_([sale.id for sale in todo])).values({column: datetime.utcnow()})
+                    )
+                    db.session.commit()
+                ok = ok and sent
+            result['ok'] = ok
+            return result
+
+
+sale_export_queue = SaleExportQueue(
+    interval=float(os.getenv('SALES_EXPORT_INTERVAL_SECONDS', '30')),
+    batch_size=int(os.getenv('SALES_EXPORT_BATCH_SIZE', '200')),
+)
+
+@atexit.register
+def _flush_sale_exports() -> None:
+    if sale_export_queue.pending_count():
+        try:
+            sale_export_queue.flush()
+        except Exception:
+            pass
+
+
+def _normalize_sale_payload(payload: dict) -> dict:
+    """Validate a checkout payload and compute totals. Raises ValueError."""
     items = payload.get('items') or []
     if not items:
         raise ValueError('Cart is empty')
@@ -646,93 +1532,361 @@ def _persist_sale(payload: dict, user_id: int | None, synced_offline: bool = Fal
         except Exception:
             price = 0.0
         subtotal += qty * price
+        product_id = row.get('product_id') or row.get('id')
+        try:
+            product_id = int(product_id) if product_id not in (None, '') else None
+        except Exception:
+            product_id = None
         normalized_items.append({
-            'product_id': row.get('product_id') or row.get('id'),
+            'product_id': product_id,
             'name': row.get('name') or 'Item',
             'quantity': qty,
             'price': price,
         })
-    total = subtotal + tax - discount
-    invoice = payload.get('invoice_number') or _generate_invoice_number()
-    try:
-        sale = Sale(
-            invoice_number=invoice,
-            customer_name=(payload.get('customer_name') or '').strip() or None,
-            subtotal=subtotal,
-            tax=tax,
-            discount=discount,
-            total=total,
-            payment_method=(payload.get('payment_method') or 'cash').lower(),
-            note=(payload.get('note') or '').strip() or None,
-            channel=payload.get('channel') or ('offline' if synced_offline else 'pos'),
-            status=payload.get('status') or 'paid',
-            verification_hash=_sale_verification_hash(invoice, total),
-            user_id=user_id,
-            synced_from_offline=synced_offline,
-        )
-        db.session.add(sale)
-        db.session.flush()
-        for row in normalized_items:
-            item = SaleItem(
-                sale_id=sale.id,
-                product_id=row['product_id'],
-                name=row['name'],
-                quantity=row['quantity'],
-                unit_price=row['price'],
-                total_price=row['price'] * row['quantity'],
+    invoice = str(payload.get('invoice_number') or '').strip() or None
+    if invoice and len(invoice) > 32:
+        raise ValueError('invoice_number too long')
+    return {
+        'items': normalized_items,
+        'tax': tax,
+        'discount': discount,
+        'subtotal': subtotal,
+        'total': subtotal + tax - discount,
+        'invoice_number': invoice,
+    }
+
+
+# Offline tills' clocks drift; allow this much before a timestamp counts as future
+OFFLINE_SALE_CLOCK_SKEW = timedelta(minutes=int(os.getenv('OFFLINE_SALE_CLOCK_SKEW_MINUTES', '5')))
+
+
+def _offline_sale_time(value) -> datetime | None:
+    """Parse an offline order's ISO ``created_at`` into naive UTC. Raises ValueError."""
+    if value in (None, ''):
+        return None
+    try:
+        ts = datetime.fromisoformat(str(value).strip().replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError('created_at must be an ISO 8601 timestamp')
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    if ts > datetime.utcnow() + OFFLINE_SALE_CLOCK_SKEW:
+        raise ValueError('created_at is in the future')
+    return ts
+
+
+class InsufficientStockError(ValueError):
+    def __init__(self, product: Product, requested: int):
+        self.product_id = product.id
+        self.available = product.stock
+        self.requested = requested
+        super().__init__(f"Only {product.stock} of {product.name} in stock")
+
+
+def _record_stock_movements(rows: list[dict]) -> None:
+    if rows:
+        now = datetime.utcnow()
+        db.session.execute(StockMovement.__table__.insert(), [{**row, 'created_at': now} for row in rows])
+
+
+def _decrement_stock(quantities: dict[int, int], *, strict: bool, sale_id: int | None = None,
+                     reason: str = 'sale', user_id: int | None = None) -> dict[int, int]:
+    """Take stock for a sale in the database, not in Python.
+
+    strict (live checkout): one ``UPDATE ... WHERE stock >= :q`` per product,
+    raising InsufficientStockError when it matches nothing, so two tills can
+    never sell the same last unit. Otherwise (offline sales that already
+    happened) one ``CASE`` update clamps at zero for the whole sale. Each
+    change is written to the stock_movement ledger. Returns
+    {product_id: stock_after}; unknown product ids are ignored.
+    """
+    quantities = {int(pid): int(q) for pid, q in quantities.items() if pid and q > 0}
+    if not quantities:
+        return {}
+    table = Product.__table__
+    now = datetime.utcnow()
+    after: dict[int, int] = {}
+    returning = db.engine.dialect.update_returning
+    if strict:
+        for pid, qty in sorted(quantities.items()):
+            stmt = (
+                table.update()
+                .where(table.c.id == pid, table.c.stock >= qty)
+                .values(stock=table.c.stock - qty, updated_at=now)
             )
-            db.session.add(item)
-            if row['product_id']:
-                product = db.session.get(Product, row['product_id'])
-                if product:
-                    product.stock = max(0, product.stock - row['quantity'])
-        db.session.commit()
-    except Exception:
-        db.session.rollback()
-        raise
-    backup_results = {}
-    if os.getenv('POS_GOOGLE_BACKUP_ENABLED', '1') not in ('0', 'false', 'False'):
-        try:
-            backup_results = _upload_sale_artifacts_to_drive(sale)
-        except Exception as exc:
-            backup_results = {'error': str(exc)}
+            if returning:
+                row = db.session.execute(stmt.returning(table.c.stock)).first()
+                matched = row is not None
+            else:
+                matched = db.session.execute(stmt).rowcount == 1
+                row = db.session.execute(db.select(table.c.stock).where(table.c.id == pid)).first() if matched else None
+            if matched:
+                after[pid] = row[0]
+                continue
+            product = db.session.get(Product, pid)
+            if product is not None:
+                db.session.refresh(product)
+                raise InsufficientStockError(product, qty)
+    else:
+        ids = sorted(quantities)
+        take = case(
+            *[(table.c.id == pid, case((table.c.stock >= qty, table.c.stock - qty), else_=0)) for pid, qty in quantities.items()],
+            else_=table.c.stock,
+        )
+        stmt = table.update().where(table.c.id.in_(ids)).values(stock=take, updated_at=now)
+        if returning:
+            after = {pid: stock for pid, stock in db.session.execute(stmt.returning(table.c.id, table.c.stock))}
+        else:
+            db.session.execute(stmt)
+            after = {pid: stock for pid, stock in db.session.execute(db.select(table.c.id, table.c.stock).where(table.c.id.in_(ids)))}
+    # The ORM copies of these rows are stale now
+    for obj in list(db.session.identity_map.values()):
+        if isinstance(obj, Product) and obj.id in after:
+            db.session.expire(obj, ['stock', 'updated_at'])
+    _record_stock_movements([
+        {'product_id': pid, 'sale_id': sale_id, 'delta': -quantities[pid], 'stock_after': stock, 'reason': reason, 'user_id': user_id}
+        for pid, stock in sorted(after.items())
+    ])
+    return after
+
+
+def _add_sale(payload: dict, norm: dict, user_id: int | None, synced_offline: bool) -> Sale:
+    """Stage a Sale and its items and take the stock. Flushes, no commit."""
+    invoice = norm['invoice_number'] or _generate_invoice_number()
+    sale = Sale(
+        invoice_number=invoice,
+        customer_name=(payload.get('customer_name') or '').strip() or None,
+        subtotal=norm['subtotal'],
+        tax=norm['tax'],
+        discount=norm['discount'],
+        total=norm['total'],
+        payment_method=(payload.get('payment_method') or 'cash').lower(),
+        note=(payload.get('note') or '').strip() or None,
+        channel=payload.get('channel') or ('offline' if synced_offline else 'pos'),
+        status=payload.get('status') or 'paid',
+        verification_hash=_sale_verification_hash(invoice, norm['total']),
+        user_id=user_id,
+        synced_from_offline=synced_offline,
+        created_at=norm.get('created_at') or datetime.utcnow(),
+    )
+    for row in norm['items']:
+        sale.items.append(SaleItem(
+            product_id=row['product_id'],
+            name=row['name'],
+            quantity=row['quantity'],
+            unit_price=row['price'],
+            total_price=row['price'] * row['quantity'],
+        ))
+    db.session.add(sale)
+    db.session.flush()
+    quantities: dict[int, int] = {}
+    for row in norm['items']:
+        if row['product_id']:
+            quantities[row['product_id']] = quantities.get(row['product_id'], 0) + row['quantity']
+    _decrement_stock(
+        quantities,
+        strict=not synced_offline,
+        sale_id=sale.id,
+        reason='sale.offline' if synced_offline else 'sale',
+        user_id=user_id,
+    )
+    _rollup_sale(sale)
+    return sale
+
+
+def _backup_sale(sale: Sale) -> dict:
+    # Exported in batches by sale_export_queue; checkout never waits on Google
+    if not _sales_export_configured():
+        return {}
+    sale_export_queue.enqueue(sale.id)
+    return {'queued': True}
+
+
+def _sale_audit(sale: Sale, user_id: int | None, synced_offline: bool, commit: bool = True) -> None:
     append_audit('pos.sale.create', {
         'sale_id': sale.id,
         'invoice_number': sale.invoice_number,
         'total': sale.total,
         'user_id': user_id,
         'synced_from_offline': synced_offline,
-    })
+    }, commit=commit)
+
+
+def _persist_sale(payload: dict, user_id: int | None, synced_offline: bool = False) -> tuple[Sale, dict]:
+    norm = _normalize_sale_payload(payload)
+    try:
+        sale = _add_sale(payload, norm, user_id, synced_offline)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    backup_results = _backup_sale(sale)
+    _sale_audit(sale, user_id, synced_offline)
     return sale, backup_results
 
 
+def _persist_sales_batch(orders: list, user_id: int | None) -> list[dict]:
+    """Ingest queued offline sales in one transaction.
+
+    Orders whose ``invoice_number`` already exists (a retried sync) are
+    reported as duplicates and skipped. Offline sales already happened, so
+    stock is clamped at zero rather than rejected (one CASE update per sale),
+    and the till's ``created_at`` is kept as the sale time (and rollup day);
+    malformed or future timestamps reject the order. Each order runs in a
+    savepoint, so one that fails (unknown product, invoice number taken by a
+    concurrent sync) is reported as rejected without undoing the others.
+    """
+    results = []
+    accepted = []
+    for order in orders:
+        try:
+            if not isinstance(order, dict):
+                raise ValueError('order must be an object')
+            norm = _normalize_sale_payload(order)
+            norm['created_at'] = _offline_sale_time(order.get('created_at'))
+            accepted.append((order, norm))
+        except ValueError as exc:
+            invoice = order.get('invoice_number') if isinstance(order, dict) else None
+            results.append({'invoice_number': invoice, 'status': 'rejected', 'error': str(exc)})
+    invoices = {norm['invoice_number'] for _, norm in accepted if norm['invoice_number']}
+    unnumbered = [norm for _, norm in accepted if not norm['invoice_number']]
+    if unnumbered:
+        for norm, invoice in zip(unnumbered, invoice_numbers(len(unnumbered))):
+            norm['invoice_number'] = invoice
+    existing = {
+        inv: sid for inv, sid in db.session.query(Sale.invoice_number, Sale.id).filter(Sale.invoice_number.in_(invoices))
+    } if invoices else {}
+    product_ids = {row['product_id'] for _, norm in accepted for row in norm['items'] if row['product_id']}
+    known_products = {
+        pid for (pid,) in db.session.query(Product.id).filter(Product.id.in_(product_ids))
+    } if product_ids else set()
+    created = []
+    try:
+        for order, norm in accepted:
+            invoice = norm['invoice_number']
+            if invoice and invoice in existing:
+                results.append({'invoice_number': invoice, 'status': 'duplicate', 'sale_id': existing[invoice]})
+                continue
+            try:
+                missing = sorted({row['product_id'] for row in norm['items'] if row['product_id']} - known_products)
+                if missing:
+                    raise ValueError(f'Unknown product id(s): {", ".join(map(str, missing))}')
+                with db.session.begin_nested():
+                    sale = _add_sale(order, norm, user_id, True)
+            except IntegrityError:
+                results.append({'invoice_number': invoice, 'status': 'rejected', 'error': 'invoice_number already exists'})
+                continue
+            except ValueError as exc:
+                results.append({'invoice_number': invoice, 'status': 'rejected', 'error': str(exc)})
+                continue
+            existing[sale.invoice_number] = sale.id
+            created.append(sale)
+            results.append({'invoice_number': sale.invoice_number, 'status': 'created', 'sale_id': sale.id})
+        for sale in created:
+            _sale_audit(sale, user_id, True, commit=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    for sale in created:
+        _backup_sale(sale)
+    return results
+
+
+def _upsert_add(model, keys: dict, increments: dict) -> None:
+    """INSERT the row or add ``increments`` to it, in one statement where the dialect allows."""
+    table = model.__table__
+    dialect = db.engine.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table).values(**keys, **increments)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={col: table.c[col] + stmt.excluded[col] for col in increments},
+        )
+        db.session.execute(stmt)
+        return
+    cond = [table.c[k] == v for k, v in keys.items()]
+    res = db.session.execute(table.update().where(*cond).values({col: table.c[col] + v for col, v in increments.items()}))
+    if not res.rowcount:
+        db.session.execute(table.insert().values(**keys, **increments))
+
+
+def _rollup_sale(sale: Sale) -> None:
+    """Fold a new sale into sales_daily/product_sales_daily (same transaction)."""
+    day = (sale.created_at or datetime.utcnow()).date()
+    _upsert_add(SalesDaily, {'day': day}, {'total': float(sale.total or 0.0), 'count': 1})
+    per_product: dict[tuple[int, str], list] = {}
+    for item in sale.items:
+        key = (item.product_id or 0, item.name)
+        acc = per_product.setdefault(key, [0, 0.0])
+        acc[0] += item.quantity or 0
+        acc[1] += float(item.total_price or 0.0)
+    for (product_id, name), (qty, revenue) in sorted(per_product.items()):
+        _upsert_add(ProductSalesDaily, {'day': day, 'product_id': product_id, 'name': name}, {'qty': qty, 'revenue': revenue})
+
+
+def rebuild_sales_rollups() -> int:
+    """Recompute both rollups from sale/sale_item (backfill or repair). Returns days written."""
+    day_col = func.date(Sale.created_at)
+    daily = db.session.query(day_col, func.sum(Sale.total), func.count(Sale.id)).group_by(day_col).all()
+    products = (
+        db.session.query(day_col, func.coalesce(SaleItem.product_id, 0), SaleItem.name, func.sum(SaleItem.quantity), func.sum(SaleItem.total_price))
+        .join(Sale, Sale.id == SaleItem.sale_id)
+        .group_by(day_col, func.coalesce(SaleItem.product_id, 0), SaleItem.name)
+        .all()
+    )
+    as_date = lambda v: v if hasattr(v, 'year') else datetime.fromisoformat(str(v)).date()
+    db.session.query(ProductSalesDaily).delete()
+    db.session.query(SalesDaily).delete()
+    db.session.add_all(SalesDaily(day=as_date(d), total=float(t or 0.0), count=int(c or 0)) for d, t, c in daily if d)
+    db.session.add_all(
+        ProductSalesDaily(day=as_date(d), product_id=int(pid), name=name, qty=int(q or 0), revenue=float(r or 0.0))
+        for d, pid, name, q, r in products if d
+    )
+    db.session.commit()
+    return len(daily)
+
+
+@app.cli.command('rebuild-sales-rollups')
+def rebuild_sales_rollups_command():
+    """Backfill sales_daily and product_sales_daily from existing sales."""
+    print(f"Rebuilt sales rollups for {rebuild_sales_rollups()} day(s)")
+
+
+def sales_by_day(start, end) -> list[dict]:
+    rows = SalesDaily.query.filter(SalesDaily.day >= start, SalesDaily.day <= end).order_by(SalesDaily.day).all()
+    return [{'day': r.day.isoformat(), 'total': round(float(r.total or 0.0), 2), 'count': int(r.count or 0)} for r in rows]
+
+
 def _calculate_sales_snapshot() -> dict:
     today = datetime.now(timezone.utc).date()
     start_of_month = today.replace(day=1)
-    today_total = (
-        db.session.query(func.coalesce(func.sum(Sale.total), 0.0))
-        .filter(func.date(Sale.created_at) == today)
-        .scalar()
-        or 0.0
-    )
+    today_total = db.session.query(SalesDaily.total).filter(SalesDaily.day == today).scalar() or 0.0
     month_total = (
-        db.session.query(func.coalesce(func.sum(Sale.total), 0.0))
-        .filter(Sale.created_at >= start_of_month)
+        db.session.query(func.coalesce(func.sum(SalesDaily.total), 0.0))
+        .filter(SalesDaily.day >= start_of_month, SalesDaily.day <= today)
         .scalar()
         or 0.0
     )
     return {'today_total': round(float(today_total), 2), 'month_total': round(float(month_total), 2)}
 
 
-def _best_selling_products(limit: int = 5) -> list[dict]:
+def _best_selling_products(limit: int = 5, days: int | None = None) -> list[dict]:
+    q = db.session.query(
+        ProductSalesDaily.name.label('name'),
+        func.coalesce(func.sum(ProductSalesDaily.qty), 0).label('qty'),
+        func.coalesce(func.sum(ProductSalesDaily.revenue), 0.0).label('revenue'),
+    )
+    if days:
+        since = datetime.now(timezone.utc).date() - timedelta(days=days - 1)
+        q = q.filter(ProductSalesDaily.day >= since)
     rows = (
-        db.session.query(
-            SaleItem.name.label('name'),
-            func.coalesce(func.sum(SaleItem.quantity), 0).label('qty'),
-            func.coalesce(func.sum(SaleItem.total_price), 0.0).label('revenue'),
-        )
-        .group_by(SaleItem.name)
-        .order_by(func.sum(SaleItem.quantity).desc())
+        q.group_by(ProductSalesDaily.product_id, ProductSalesDaily.name)
+        .order_by(func.sum(ProductSalesDaily.qty).desc())
         .limit(limit)
         .all()
     )
@@ -753,7 +1907,7 @@ def _audit_hash(prev: str | None, ts: str, action: str, data_json: str) -> str:
     h.update(data_json.encode('utf-8'))
     return h.hexdigest()
 
-def append_audit(action: str, data: dict) -> None:
+def append_audit(action: str, data: dict, commit: bool = True) -> None:
     ts = datetime.now(timezone.utc).isoformat()
     prev = AuditLog.query.order_by(AuditLog.id.desc()).first()
     prev_hash = prev.hash if prev else None
@@ -761,7 +1915,143 @@ def append_audit(action: str, data: dict) -> None:
     digest = _audit_hash(prev_hash, ts, action, data_json)
     rec = AuditLog(created_at=datetime.now(timezone.utc), action=action, data_json=data_json, prev_hash=prev_hash, hash=digest)
     db.session.add(rec)
-    db.session.commit()
+    if commit:
+        db.session.commit()
+    else:
+        db.session.flush()
+
+# Live updates (Server-Sent Events). Write paths call publish_events(); the
+# rows land in live_event so every worker can serve them. Each worker runs a
+# single poller that checks max(live_event.id) and wakes its own streams, so
+# idle dashboards cost one indexed lookup per worker per SSE_POLL_SECONDS.
+EXCEL_DATA_FILE = os.path.join(BASE_DIR, 'data_file.xlsx')
+LIVE_EVENT_TOPICS = {'payment', 'transaction', 'member', 'excel'}
+
+
+class EventBroker:
+    def __init__(self, poll_interval: float):
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        self._latest_id = 0
+        self._poller = None
+
+    @property
+    def latest_id(self) -> int:
+        return self._latest_id
+
+    def notify(self, event_id: int) -> None:
+        with self._cond:
+            if event_id > self._latest_id:
+                self._latest_id = event_id
+                self._cond.notify_all()
+
+    def wait(self, after_id: int, timeout: float) -> bool:
+        """Block until an event newer than ``after_id`` is known or timeout."""
+        self._ensure_poller()
+        with self._cond:
+            if self._latest_id > after_id:
+                return True
+            self._cond.wait(timeout)
+            return self._latest_id > after_id
+
+    def _ensure_poller(self) -> None:
+        if self._poller is not None and self._poller.is_alive():
+            return
+        with self._cond:
+            if self._poller is not None and self._poller.is_alive():
+                return
+            self._poller = threading.Thread(target=self._poll_loop, name='event-broker', daemon=True)
+            self._poller.start()
+
+    def _poll_loop(self) -> None:
+        while True:
+            try:
+                with app.app_context():
+                    latest = db.session.query(func.max(LiveEvent.id)).scalar() or 0
+                self.notify(int(latest))
+            except Exception:
+                pass
+            time.sleep(self.poll_interval)
+
+
+event_broker = EventBroker(poll_interval=float(os.getenv('SSE_POLL_SECONDS', '2')))
+
+def publish_events(events: list[tuple[str, dict]]) -> None:
+    """Record live deltas (kind, data) for /api/events subscribers."""
+    if not events:
+        return
+    try:
+        rows = [LiveEvent(kind=kind, data_json=json.dumps(data, separators=(',', ':'), default=str)) for kind, data in events]
+        db.session.add_all(rows)
+        db.session.flush()
+        latest = rows[-1].id
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        return
+    if latest % 200 == 0:
+        _prune_live_events()
+    event_broker.notify(latest)
+
+def publish_event(kind: str, data: dict) -> None:
+    publish_events([(kind, data)])
+
+def _payment_event(p) -> tuple[str, dict]:
+    return ('payment.status', {'member_id': p.member_id, 'year': p.year, 'month': p.month, 'status': p.status})
+
+def _transaction_event(tx) -> tuple[str, dict]:
+    return ('transaction.created', {
+        'id': tx.id, 'member_id': tx.member_id, 'plan_type': tx.plan_type,
+        'year': tx.year, 'month': tx.month, 'amount': tx.amount, 'method': tx.method,
+    })
+
+def _prune_live_events() -> None:
+    hours = float(os.getenv('LIVE_EVENT_RETENTION_HOURS', '24'))
+    cutoff = datetime.utcnow() - timedelta(hours=hours)
+    try:
+        LiveEvent.query.filter(LiveEvent.created_at < cutoff).delete()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+
+def _live_events_after(after_id: int, topics: set[str], limit: int = 100) -> list[tuple[int, str, str]]:
+    with app.app_context():
+        rows = (
+            db.session.query(LiveEvent.id, LiveEvent.kind, LiveEvent.data_json)
+            .filter(LiveEvent.id > after_id, or_(*[LiveEvent.kind.like(f'{t}.%') for t in sorted(topics)]))
+            .order_by(LiveEvent.id.asc())
+            .limit(limit)
+            .all()
+        )
+    return [tuple(r) for r in rows]
+
+def _sse_message(event: str, data: str, event_id: str | None = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in data.splitlines() or [''])
+    return '\n'.join(lines) + '\n\n'
+
+def _excel_file_signature() -> int:
+    try:
+        return os.stat(EXCEL_DATA_FILE).st_mtime_ns
+    except OSError:
+        return 0
+
+def _long_lived_streams_ok() -> bool:
+    # Holding a connection open is only safe on cooperative (gevent) or
+    # threaded servers; a sync worker would be pinned for the whole stream.
+    forced = os.getenv('SSE_STREAMING')
+    if forced is not None:
+        return forced not in ('0', 'false', 'False', '')
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched('socket'):
+            return True
+    except Exception:
+        pass
+    return bool(request.environ.get('wsgi.multithread'))
 
 @app.before_first_request
 def create_tables():
@@ -776,6 +2066,12 @@ def create_tables():
         db.session.commit()
     if get_setting('gym_name') is None:
         set_setting('gym_name', 'ZAIDAN FITNESS RECORD')
+    # Sales committed but not exported before the last shutdown
+    if _sales_export_configured():
+        try:
+            sale_export_queue.recover()
+        except Exception:
+            db.session.rollback()
     # Start scheduler once
     start_scheduler_once()
     # Optional immediate rollover on startup if enabled
@@ -822,6 +2118,12 @@ def send_monthly_unpaid_template_job():
         except Exception:
             pass
 
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    limit = app.config.get('MAX_CONTENT_LENGTH')
+    return jsonify({'ok': False, 'error': 'Upload too large', 'max_bytes': limit}), 413
+
+
 # Simple session-based login protection (supports PUBLIC_MODE)
 def login_required(view_func):
     from functools import wraps
@@ -853,6 +2155,112 @@ def admin_required(view_func):
         return view_func(*args, **kwargs)
     return wrapper
 
+def etag_versioned(*tables):
+    """Conditional GET support for read-only JSON endpoints.
+
+    The ETag is derived from the request URL, today's date (responses default
+    to the current month) and the data versions of ``tables``. A matching
+    ``If-None-Match`` is answered with 304 before the view runs.
+    """
+    from functools import wraps
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(*args, **kwargs):
+            versions = get_data_versions(tables)
+            basis = '|'.join([
+                request.full_path,
+                datetime.now().strftime('%Y-%m-%d'),
+                ','.join(f"{t}:{versions.get(t, 0)}" for t in tables),
+            ])
+            etag = hashlib.sha1(basis.encode('utf-8')).hexdigest()[:24]
+            if request.if_none_match.contains(etag):
+                resp = app.response_class(status=304)
+            else:
+                resp = app.make_response(view_func(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+            resp.set_etag(etag)
+            resp.headers['Cache-Control'] = 'private, no-cache'
+            return resp
+        return wrapper
+    return decorator
+
+@app.route('/api/events')
+@login_required
+def live_events():
+    """Server-Sent Events feed of payment, member and transaction deltas.
+
+    ``topics`` narrows the feed (comma separated: payment, transaction,
+    member, excel). Reconnects resume from ``Last-Event-ID``, which is
+    ``<live_event id>`` or ``<id>-<excel mtime_ns>`` when watching the Excel
+    file. On sync workers the response carries whatever is pending and
+    closes, and the browser reconnects after ``retry``.
+    """
+    topics = {t.strip() for t in (request.args.get('topics') or '').split(',')} & LIVE_EVENT_TOPICS
+    topics = topics or {'payment', 'transaction', 'member'}
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or ''
+    after_id = excel_seen = None
+    try:
+        head, _, tail = last_id.partition('-')
+        after_id = int(head)
+        excel_seen = int(tail) if tail else None
+    except ValueError:
+        pass
+    if after_id is None:
+        # Fresh subscriber: only changes from now on
+        after_id = db.session.query(func.max(LiveEvent.id)).scalar() or 0
+    watch_excel = 'excel' in topics
+    streaming = _long_lived_streams_ok()
+    retry_ms = int(float(os.getenv('SSE_RETRY_SECONDS', '3' if streaming else '15')) * 1000)
+    heartbeat = float(os.getenv('SSE_HEARTBEAT_SECONDS', '20'))
+    max_life = float(os.getenv('SSE_MAX_STREAM_SECONDS', '300'))
+    poll = event_broker.poll_interval
+    db.session.remove()
+
+    def generate():
+        cursor = after_id
+        excel_sig = _excel_file_signature() if watch_excel else 0
+        excel_known = excel_sig if excel_seen is None else excel_seen
+        make_id = (lambda: f"{cursor}-{excel_known}") if watch_excel else (lambda: str(cursor))
+        yield f"retry: {retry_ms}\n\n"
+        started = last_write = time.monotonic()
+        while True:
+            seen = event_broker.latest_id
+            rows = _live_events_after(cursor, topics)
+            for rid, kind, data in rows:
+                cursor = rid
+                yield _sse_message(kind, data, make_id())
+            if rows:
+                last_write = time.monotonic()
+                continue
+            if watch_excel:
+                excel_sig = _excel_file_signature()
+                if excel_sig != excel_known:
+                    excel_known = excel_sig
+                    last_write = time.monotonic()
+                    yield _sse_message('excel.changed', json.dumps({'mtime_ns': excel_sig}), make_id())
+            if not streaming:
+                # Persist the cursor so the reconnect picks up from here
+                yield f"id: {make_id()}\n: idle\n\n"
+                return
+            now = time.monotonic()
+            if now - started >= max_life:
+                return
+            if now - last_write >= heartbeat:
+                yield ": ping\n\n"
+                last_write = now
+            # Filtered-out topics still advance the broker; wait on what was
+            # already seen before the query so nothing slips in between.
+            timeout = min(heartbeat - (now - last_write), max_life - (now - started))
+            if watch_excel:
+                timeout = min(timeout, poll)
+            event_broker.wait(max(cursor, seen), max(timeout, 0.1))
+
+    resp = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
 # Auth routes
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -1028,6 +2436,7 @@ def dashboard():
 
 @app.route('/api/stats/monthly')
 @login_required
+@etag_versioned('payment')
 def stats_monthly():
     try:
         year = int(request.args.get('year') or datetime.now().year)
@@ -1116,12 +2525,187 @@ def home_alias():
 @app.route('/members')
 @login_required
 def index():
-    members = Member.query.all()
     currency_code = get_setting('currency_code') or 'USD'
     monthly_price = get_setting('monthly_price') or '8'
     logo_url = get_setting('logo_filename') or ''
     default_cc = get_setting('whatsapp_default_country_code') or '92'
-    return render_template('index.html', members=members, gym_name=get_gym_name(), currency_code=currency_code, monthly_price=monthly_price, logo_url=logo_url, default_cc=default_cc)
+    return render_template('index.html', gym_name=get_gym_name(), currency_code=currency_code, monthly_price=monthly_price, logo_url=logo_url, default_cc=default_cc)
+
+# Typeahead index for the members search box. Each worker keeps its own prefix
+# trie over normalized names, phone digits and serials. Writes made in this
+# process update it in place; writes from other workers or the desktop/CLI
+# tools bump the member data version, which searches read at most every
+# MEMBER_SUGGEST_CHECK_SECONDS, rebuilding only when it has changed.
+def _suggest_text_key(text: str) -> str:
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(text.lower().split())
+
+def _suggest_digits(text: str) -> str:
+    return ''.join(ch for ch in (text or '') if ch.isdigit())
+
+
+class _TrieNode:
+    __slots__ = ('children', 'ids')
+
+    def __init__(self):
+        self.children = {}
+        self.ids = None
+
+
+class MemberSuggestIndex:
+    def __init__(self, check_seconds: float):
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._root = _TrieNode()
+        self._members = {}  # id -> (name, serial, keys)
+        self._country_code = ''
+        self._built_at = None
+        self._versions = None
+        self._checked_at = 0.0
+
+    def _keys_for(self, member_id: int, name: str, phone: str) -> set[str]:
+        keys = set()
+        full = _suggest_text_key(name)
+        if full:
+            keys.add(full)
+            keys.update(full.split())
+        digits = _suggest_digits(phone)
+        if digits:
+            keys.add(digits)
+            local = digits
+            if self._country_code and local.startswith(self._country_code):
+                local = local[len(self._country_code):]
+            local = local.lstrip('0')
+            if local:
+                keys.add(local)
+                keys.add('0' + local)
+        keys.add(str(1000 + member_id))
+        return keys
+
+    @staticmethod
+    def _insert(root: _TrieNode, key: str, member_id: int) -> None:
+        node = root
+        for ch in key:
+            nxt = node.children.get(ch)
+            if nxt is None:
+                nxt = node.children[ch] = _TrieNode()
+            node = nxt
+        if node.ids is None:
+            node.ids = set()
+        node.ids.add(member_id)
+
+    def _discard(self, member_id: int) -> None:
+        entry = self._members.pop(member_id, None)
+        if not entry:
+            return
+        for key in entry[2]:
+            path = [self._root]
+            for ch in key:
+                node = path[-1].children.get(ch)
+                if node is None:
+                    break
+                path.append(node)
+            else:
+                if path[-1].ids:
+                    path[-1].ids.discard(member_id)
+                # Prune the branch back to the last node still in use
+                for depth in range(len(key), 0, -1):
+                    node = path[depth]
+                    if node.ids or node.children:
+                        break
+                    del path[depth - 1].children[key[depth - 1]]
+
+    def rebuild(self, versions: dict | None = None) -> None:
+        self._country_code = _suggest_digits(_default_country_code())
+        root = _TrieNode()
+        members = {}
+        for mid, name, phone in db.session.query(Member.id, Member.name, Member.phone).all():
+            keys = self._keys_for(mid, name, phone)
+            for key in keys:
+                self._insert(root, key, mid)
+            members[mid] = (name, 1000 + mid, keys)
+        with self._lock:
+            self._root = root
+            self._members = members
+            self._built_at = time.monotonic()
+            self._versions = versions
+
+    def upsert(self, member_id: int, name: str, phone: str | None) -> None:
+        with self._lock:
+            if self._built_at is None:
+                return
+            self._discard(member_id)
+            keys = self._keys_for(member_id, name, phone)
+            for key in keys:
+                self._insert(self._root, key, member_id)
+            self._members[member_id] = (name, 1000 + member_id, keys)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._built_at = None
+            self._checked_at = 0.0
+
+    def _refresh(self) -> None:
+        # Members and the settings that shape phone keys (country code)
+        versions = get_data_versions(('member', 'setting'))
+        if self._built_at is None or versions != self._versions:
+            self.rebuild(versions)
+        self._checked_at = time.monotonic()
+
+    def remove(self, member_id: int) -> None:
+        with self._lock:
+            if self._built_at is not None:
+                self._discard(member_id)
+
+    def search(self, query: str, limit: int = 8) -> list[dict]:
+        if self._built_at is None or time.monotonic() - self._checked_at > self.check_seconds:
+            self._refresh()
+        q = query.strip()
+        if q.startswith('#'):
+            q = q[1:]
+        if q and all(ch.isdigit() or ch in ' +-()' for ch in q):
+            key = _suggest_digits(q)
+        else:
+            key = _suggest_text_key(q)
+        if not key:
+            return []
+        with self._lock:
+            node = self._root
+            for ch in key:
+                node = node.children.get(ch)
+                if node is None:
+                    return []
+            # Breadth-first so the shortest (closest) completions come first
+            found = []
+            seen = set()
+            queue = deque([node])
+            while queue and len(found) < limit:
+                cur = queue.popleft()
+                for mid in sorted(cur.ids or ()):
+                    if mid not in seen and mid in self._members:
+                        seen.add(mid)
+                        found.append(mid)
+                        if len(found) >= limit:
+                            break
+                queue.extend(cur.children[ch] for ch in sorted(cur.children))
+            return [{'id': mid, 'name': self._members[mid][0], 'serial': self._members[mid][1]} for mid in found]
+
+
+member_suggest_index = MemberSuggestIndex(check_seconds=float(os.getenv('MEMBER_SUGGEST_CHECK_SECONDS', '2')))
+
+# API: typeahead suggestions for the members search box
+@app.route('/api/members/suggest', methods=['GET'])
+@login_required
+def suggest_members():
+    q = (request.args.get('q') or '').strip()
+    try:
+        limit = max(1, min(int(request.args.get('limit') or 8), 25))
+    except ValueError:
+        return jsonify({"error": "invalid limit"}), 400
+    if not q:
+        return jsonify([])
+    return jsonify(member_suggest_index.search(q, limit))
 
 # API: add member
 @app.route('/api/members', methods=['POST'])
@@ -1162,11 +2746,98 @@ def add_member():
         db.session.add(p)
     db.session.commit()
     append_audit('member.create', {'member_id': m.id, 'name': m.name, 'phone': m.phone, 'admission_date': m.admission_date.isoformat(), 'plan_type': m.plan_type})
+    member_suggest_index.upsert(m.id, m.name, m.phone)
+    publish_event('member.created', {'id': m.id, 'name': m.name, 'admission_date': m.admission_date.isoformat()})
     return jsonify(m.to_dict()), 201
 
+def _members_to_dicts(members: list, fields: set[str] | None = None) -> list[dict]:
+    """Serialize a page of members with the per-row lookups batched.
+
+    Current-month payment status and the latest transaction are fetched with
+    one ``IN`` query each instead of two queries per member.
+    """
+    if not members:
+        return []
+    ids = [m.id for m in members]
+    now = datetime.now()
+    fee = {}
+    if fields is None or any(k in fields for k in MEMBER_FEE_FIELDS):
+        statuses = dict(
+            db.session.query(Payment.member_id, Payment.status)
+            .filter(Payment.member_id.in_(ids), Payment.year == now.year, Payment.month == now.month)
+            .all()
+        )
+        latest = {}
+        txs = (
+            db.session.query(PaymentTransaction.member_id, PaymentTransaction.amount, PaymentTransaction.created_at)
+            .filter(PaymentTransaction.member_id.in_(ids), PaymentTransaction.year == now.year, PaymentTransaction.month == now.month)
+            .order_by(PaymentTransaction.created_at.asc())
+            .all()
+        )
+        for member_id, amount, created_at in txs:
+            latest[member_id] = (amount, created_at)
+        for mid in ids:
+            amount, created_at = latest.get(mid, (None, None))
+            fee[mid] = (
+                statuses.get(mid, 'Unpaid'),
+                float(amount) if amount is not None else None,
+                created_at.isoformat() if created_at else None,
+            )
+    monthly_price = None
+    if fields is None or 'monthly_price' in fields:
+        try:
+            monthly_price = float(get_setting('monthly_price') or '0')
+        except Exception:
+            monthly_price = 0.0
+    country_code = _default_country_code() if fields is None or 'phone_normalized' in fields else ''
+    return [
+        m.to_dict(fields=fields, fee_info=fee.get(m.id), monthly_price=monthly_price, country_code=country_code)
+        for m in members
+    ]
+
+def _apply_member_filters(query, args):
+    """Push the members page filters (is_active, plan_type, training_type,
+    special_tag, status) into SQL. Unknown values are ignored."""
+    active = (args.get('is_active') or '').strip()
+    if active == '1':
+        query = query.filter(Member.is_active == True)  # noqa: E712
+    elif active == '0':
+        query = query.filter(or_(Member.is_active == False, Member.is_active.is_(None)))  # noqa: E712
+    plan_type = (args.get('plan_type') or '').lower().strip()
+    if plan_type == 'monthly':
+        query = query.filter(or_(Member.plan_type == 'monthly', Member.plan_type.is_(None)))
+    elif plan_type == 'yearly':
+        query = query.filter(Member.plan_type == 'yearly')
+    training = (args.get('training_type') or '').lower().strip()
+    if training == 'other':
+        query = query.filter(Member.custom_training.isnot(None), Member.custom_training != '')
+    elif training == 'standard':
+        query = query.filter(or_(Member.training_type == 'standard', Member.training_type.is_(None)))
+    elif training in ('personal', 'cardio'):
+        query = query.filter(Member.training_type == training)
+    special = (args.get('special_tag') or '').strip()
+    if special == '1':
+        query = query.filter(Member.special_tag == True)  # noqa: E712
+    elif special == '0':
+        query = query.filter(or_(Member.special_tag == False, Member.special_tag.is_(None)))  # noqa: E712
+    status = (args.get('status') or '').strip()
+    if status in ('Paid', 'Unpaid', 'N/A'):
+        now = datetime.now()
+        month_rows = db.session.query(Payment.member_id).filter(Payment.year == now.year, Payment.month == now.month)
+        if status == 'Unpaid':
+            # Members without a row for this month count as Unpaid
+            query = query.filter(~Member.id.in_(month_rows.filter(Payment.status != 'Unpaid')))
+        else:
+            query = query.filter(Member.id.in_(month_rows.filter(Payment.status == status)))
+    return query
+
 # API: list members
+# Without ``limit``/``cursor`` the full (filtered) list is returned as before.
+# With them, results are keyset-paginated on id (newest first) and wrapped as
+# {ok, members, next_cursor}; ``with_counts=1`` adds total/active/inactive.
 @app.route('/api/members', methods=['GET'])
 @login_required
+@etag_versioned('member', 'payment', 'payment_transaction', 'setting')
 def list_members():
     q = (request.args.get('search') or '').strip()
     query = Member.query
@@ -1186,12 +2857,46 @@ def list_members():
                 # Also allow direct id matching
                 filters.append(Member.id == num)
         query = query.filter(or_(*filters))
-    members = query.order_by(Member.id.desc()).all()
-    return jsonify([m.to_dict() for m in members])
+    fields = None
+    if request.args.get('fields'):
+        fields = {f.strip() for f in request.args['fields'].split(',') if f.strip()}
+        unknown = fields.difference(MEMBER_API_FIELDS)
+        if unknown:
+            return jsonify({"error": f"unknown fields: {', '.join(sorted(unknown))}"}), 400
+    counts = None
+    if request.args.get('with_counts') in ('1', 'true'):
+        total, active = query.with_entities(
+            func.count(Member.id),
+            func.coalesce(func.sum(case((Member.is_active == True, 1), else_=0)), 0),  # noqa: E712
+        ).order_by(None).one()
+        counts = {'total': int(total or 0), 'active': int(active or 0), 'inactive': int(total or 0) - int(active or 0)}
+    query = _apply_member_filters(query, request.args)
+    paginate = 'limit' in request.args or 'cursor' in request.args
+    if not paginate:
+        members = query.order_by(Member.id.desc()).all()
+        return jsonify(_members_to_dicts(members, fields))
+    try:
+        limit = max(1, min(int(request.args.get('limit') or 50), 200))
+        cursor = int(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError:
+        return jsonify({"error": "invalid limit/cursor"}), 400
+    if cursor is not None:
+        query = query.filter(Member.id < cursor)
+    rows = query.order_by(Member.id.desc()).limit(limit + 1).all()
+    page = rows[:limit]
+    body = {
+        'ok': True,
+        'members': _members_to_dicts(page, fields),
+        'next_cursor': str(page[-1].id) if len(rows) > limit else None,
+    }
+    if counts is not None:
+        body['counts'] = counts
+    return jsonify(body)
 
 # API: get single member
 @app.route('/api/members/<int:member_id>', methods=['GET'])
 @login_required
+@etag_versioned('member', 'payment', 'payment_transaction', 'setting')
 def get_member(member_id):
     m = Member.query.get_or_404(member_id)
     return jsonify(m.to_dict())
@@ -1203,17 +2908,19 @@ def get_member(member_id):
 def delete_member(member_id):
     m = Member.query.get_or_404(member_id)
     # delete related payments
+    payment_ids = [pid for (pid,) in db.session.query(Payment.id).filter_by(member_id=member_id)]
     Payment.query.filter_by(member_id=member_id).delete()
-    # delete any stored photos
-    for e in ALLOWED_IMAGE_EXTS:
-        pth = os.path.join(UPLOAD_FOLDER, f"member_{member_id}{e}")
-        try:
-            if os.path.exists(pth):
-                os.remove(pth)
-        except Exception:
-            pass
+    CheckIn.query.filter_by(member_id=member_id).delete()
+    mark_tables_changed('payment')
+    record_changes('payment', payment_ids, 'delete')
+    # delete the stored photo and its derivatives
+    if m.photo_key:
+        for key in [m.photo_key, *(_photo_derivative_key(member_id, m.photo_etag, size) for size in PHOTO_SIZES)]:
+            photo_store.delete(key)
     db.session.delete(m)
     db.session.commit()
+    member_suggest_index.remove(member_id)
+    _invalidate_member_card(member_id)
     append_audit('member.delete', {'member_id': member_id})
     return jsonify({"ok": True})
 
@@ -1264,6 +2971,9 @@ def update_member(member_id):
     if changed:
         db.session.commit()
         append_audit('member.update', {'member_id': m.id, **changed, 'user_id': session.get('user_id')})
+        if 'name' in changed or 'phone' in changed:
+            member_suggest_index.upsert(m.id, m.name, m.phone)
+        _invalidate_member_card(m.id)
     return jsonify({'ok': True, 'member': m.to_dict(), 'changed': changed})
 
 
@@ -1271,17 +2981,285 @@ def update_member(member_id):
 @app.route('/api/members/<int:member_id>/photo', methods=['POST'])
 @login_required
 def upload_member_photo(member_id):
-    _ = Member.query.get_or_404(member_id)
+    m = Member.query.get_or_404(member_id)
     if 'photo' not in request.files:
         return jsonify({"ok": False, "error": "No photo file provided (field name 'photo')"}), 400
     f = request.files['photo']
     if not f or (f.filename or '').strip() == '':
         return jsonify({"ok": False, "error": "Empty file"}), 400
-    ok, resp = _save_member_image(member_id, f)
+    ok, resp = _save_member_image(m, f)
     if ok:
-        return jsonify({"ok": True, "image_url": resp})
+        db.session.commit()
+        submit_photo_derivatives(m.id, m.photo_key, m.photo_etag)
+        _invalidate_member_card(member_id)
+        return jsonify({"ok": True, **member_photo_urls(m)})
     return jsonify({"ok": False, "error": resp}), 400
 
+# Photo derivatives: names are versioned, so they never change and can be cached forever
+@app.route('/media/members/<path:filename>', methods=['GET'])
+@login_required
+def member_photo_media(filename):
+    if '/' in filename:
+        return jsonify({'ok': False, 'error': 'Not found'}), 404
+    key = f"derived/{filename}"
+    if not photo_store.exists(key):
+        # Requested before the background job finished (or after a cache wipe): build inline
+        stem = filename[:-5] if filename.endswith('.webp') else ''
+        parts = stem.split('_')
+        if len(parts) == 4 and parts[0] == 'member' and parts[1].isdigit() and parts[3] in PHOTO_SIZES:
+            m = db.session.get(Member, int(parts[1]))
+            if m is not None and m.photo_etag == parts[2]:
+                member_photo_key(m, parts[3])
+    return send_stored(photo_store, key, mimetype='image/webp', immutable=True)
+
+
+STORAGE_URL_SECONDS = int(os.getenv('STORAGE_URL_SECONDS', '3600'))
+
+
+def send_stored(store, key: str, *, download_name: str | None = None, mimetype: str | None = None, immutable: bool = False):
+    """Respond with a stored object.
+
+    Local files are sent by werkzeug (conditional requests and Range
+    supported). S3 objects are a redirect to a presigned URL, so the bytes
+    never pass through the app.
+    """
+    try:
+        if not store.exists(key):
+            return jsonify({'ok': False, 'error': 'Not found'}), 404
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'Not found'}), 404
+    if store.backend == 'local':
+        resp = send_file(
+            store.path(key), mimetype=mimetype, as_attachment=bool(download_name),
+            download_name=download_name, conditional=True, max_age=31536000 if immutable else None,
+        )
+        if immutable:
+            resp.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return resp
+    resp = redirect(store.presigned_url(key, expires=STORAGE_URL_SECONDS, filename=download_name), code=302)
+    # The redirect may be reused until shortly before the presigned URL expires
+    resp.headers['Cache-Control'] = f"private, max-age={max(STORAGE_URL_SECONDS - 60, 0) if immutable else 0}"
+    return resp
+
+
+def _storage_signature(area: str, key: str, expires: int) -> str:
+    secret = (app.config.get('SECRET_KEY') or 'secret').encode('utf-8')
+    return hmac.new(secret, f"{area}:{key}:{expires}".encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+
+def storage_url(area: str, key: str, expires_in: int | None = None, filename: str | None = None) -> str:
+    """Time-limited link to a stored object that works without a session.
+
+    S3: a presigned URL. Local: ``/files/<area>/<key>`` signed with SECRET_KEY.
+    """
+    expires_in = expires_in or STORAGE_URL_SECONDS
+    store = STORAGE_AREAS[area]
+    url = store.presigned_url(key, expires=expires_in, filename=filename)
+    if url:
+        return url
+    expires = int(time.time()) + expires_in
+    args = {'download': filename} if filename else {}
+    return url_for('stored_file', area=area, key=key, expires=expires, sig=_storage_signature(area, key, expires), **args)
+
+
+@app.route('/files/<area>/<path:key>', methods=['GET'])
+def stored_file(area, key):
+    store = STORAGE_AREAS.get(area)
+    if store is None:
+        return jsonify({'ok': False, 'error': 'Not found'}), 404
+    try:
+        expires = int(request.args.get('expires') or 0)
+    except ValueError:
+        expires = 0
+    sig = request.args.get('sig') or ''
+    signed = bool(sig) and expires >= time.time() and hmac.compare_digest(sig, _storage_signature(area, key, expires))
+    if not signed:
+        user = db.session.get(User, session['user_id']) if session.get('user_id') else None
+        if user is None or (area == 'backups' and (user.role or 'staff') != 'admin'):
+            return jsonify({'ok': False, 'error': 'Unauthorized'}), 401
+    return send_stored(store, key, download_name=request.args.get('download') or None)
+
+
+MAX_PHOTO_IMPORT_FILES = 2000
+MAX_PHOTO_IMPORT_FILE_BYTES = 25 * 1024 * 1024  # uncompressed, per entry
+PHOTO_IMPORT_MAX_SIDE = 1600
+
+
+def _prepare_import_photo(src: str, dest: str, max_side: int) -> str | None:
+    """Decode, orient and downscale one extracted photo to a JPEG. Returns an error or None.
+
+    Top-level so it can run in a process pool.
+    """
+    try:
+        with Image.open(src) as original:
+            img = ImageOps.exif_transpose(original)
+            img = img.convert('RGB')
+            img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+            img.save(dest, 'JPEG', quality=85, optimize=True)
+        return None
+    except Exception as exc:
+        return f'not a readable image ({exc.__class__.__name__})'
+
+
+def _photo_import_index() -> tuple[dict, dict, dict]:
+    """(serial -> id, phone tail -> ids, name key -> ids) for matching file names."""
+    serials, phones, names = {}, {}, {}
+    for mid, name, phone in db.session.query(Member.id, Member.name, Member.phone):
+        serials[1000 + mid] = mid
+        digits = _suggest_digits(phone)
+        if len(digits) >= 7:
+            phones.setdefault(digits[-10:], set()).add(mid)
+        key = _suggest_text_key(name)
+        if key:
+            names.setdefault(key, set()).add(mid)
+    return serials, phones, names
+
+
+def _match_photo_name(stem: str, index: tuple[dict, dict, dict]) -> tuple[set, str]:
+    """Member ids a file name points at and how it matched (serial, phone or name)."""
+    serials, phones, names = index
+    compact = stem.strip().lstrip('#')
+    if compact.isdigit() and int(compact) in serials:
+        return {serials[int(compact)]}, 'serial'
+    dialled = compact.replace('+', '').replace(' ', '').replace('-', '')
+    if dialled.isdigit() and len(dialled) >= 7:
+        return set(phones.get(dialled[-10:], ())), 'phone'
+    key = _suggest_text_key(compact.replace('_', ' ').replace('-', ' ').replace('.', ' '))
+    return set(names.get(key, ())), 'name'
+
+
+def import_member_photos(archive, workers: int = 0) -> dict:
+    """Match ZIP entries to members by file name and store them as member photos.
+
+    ``archive`` must be a seekable file object. Entries are streamed to temp
+    files one at a time, resized in a process pool when ``workers > 1``,
+    and saved through ``_save_member_image`` so the usual extension rules
+    apply. Files that match the same member, or a name shared by several
+    members, are reported as collisions and skipped.
+    """
+    report = {'matched': [], 'unmatched': [], 'collisions': [], 'failed': []}
+    index = _photo_import_index()
+    by_member: dict[int, list] = {}
+    with zipfile.ZipFile(archive) as zf:
+        entries = [
+            info for info in zf.infolist()
+            if not info.is_dir()
+            and not os.path.basename(info.filename).startswith('.')
+            and '__MACOSX' not in info.filename
+        ]
+        if len(entries) > MAX_PHOTO_IMPORT_FILES:
+            raise ValueError(f'At most {MAX_PHOTO_IMPORT_FILES} files per archive')
+        for info in entries:
+            base = os.path.basename(info.filename)
+            stem, ext = os.path.splitext(base)
+            if ext.lower() not in ALLOWED_IMAGE_EXTS:
+                report['unmatched'].append({'file': info.filename, 'reason': 'Only JPG, JPEG, PNG, WEBP images are allowed'})
+                continue
+            if info.file_size > MAX_PHOTO_IMPORT_FILE_BYTES:
+                report['unmatched'].append({'file': info.filename, 'reason': 'file too large'})
+                continue
+            ids, how = _match_photo_name(stem, index)
+            if not ids:
+                report['unmatched'].append({'file': info.filename, 'reason': f'no member with this {how}'})
+            elif len(ids) > 1:
+                report['collisions'].append({'files': [info.filename], 'member_ids': sorted(ids), 'reason': f'{how} shared by several members'})
+            else:
+                by_member.setdefault(next(iter(ids)), []).append((info, how))
+        jobs = []
+        for member_id, hits in sorted(by_member.items()):
+            if len(hits) > 1:
+                report['collisions'].append({'files': [i.filename for i, _ in hits], 'member_ids': [member_id], 'reason': 'several files for one member'})
+            else:
+                jobs.append((member_id, *hits[0]))
+
+        with tempfile.TemporaryDirectory(prefix='photo-import-') as workdir:
+            prepared = []
+            for n, (member_id, info, how) in enumerate(jobs):
+                src = os.path.join(workdir, f"{n}_src")
+                with zf.open(info) as fin, open(src, 'wb') as fout:
+                    for chunk in iter(lambda: fin.read(1 << 16), b''):
+                        fout.write(chunk)
+                prepared.append((member_id, info, how, src, os.path.join(workdir, f"{n}.jpg")))
+                # Keep the number of extracted-but-unprocessed files bounded
+                if len(prepared) >= 200:
+                    _store_import_photos(prepared, workers, report)
+                    prepared = []
+            if prepared:
+                _store_import_photos(prepared, workers, report)
+    report['saved'] = len(report['matched'])
+    return report
+
+
+def _store_import_photos(prepared: list[tuple], workers: int, report: dict) -> None:
+    if HAVE_PIL:
+        args = [(src, dest, PHOTO_IMPORT_MAX_SIDE) for _, _, _, src, dest in prepared]
+        if workers > 1 and len(args) > 1:
+            with _process_pool(workers) as pool:
+                errors = list(pool.map(_prepare_import_photo, *zip(*args)))
+        else:
+            errors = [_prepare_import_photo(*a) for a in args]
+    else:
+        errors = [None] * len(prepared)
+    members = {m.id: m for m in Member.query.filter(Member.id.in_([p[0] for p in prepared]))}
+    saved = []
+    for (member_id, info, how, src, dest), error in zip(prepared, errors):
+        m = members.get(member_id)
+        if error or m is None:
+            report['failed'].append({'file': info.filename, 'member_id': member_id, 'error': error or 'Member not found'})
+            continue
+        path = dest if HAVE_PIL else src
+        name = f"{member_id}.jpg" if HAVE_PIL else os.path.basename(info.filename)
+        with open(path, 'rb') as fh:
+            ok, msg = _save_member_image(m, FileStorage(stream=fh, filename=name))
+        if not ok:
+            report['failed'].append({'file': info.filename, 'member_id': member_id, 'error': msg})
+            continue
+        saved.append(m)
+        report['matched'].append({'file': info.filename, 'member_id': member_id, 'serial': 1000 + member_id, 'matched_by': how})
+    db.session.commit()
+    for m in saved:
+        submit_photo_derivatives(m.id, m.photo_key, m.photo_etag)
+        _invalidate_member_card(m.id)
+
+
+@app.route('/api/members/photos/import', methods=['POST'])
+@login_required
+def import_member_photos_zip():
+    """Bulk photos: a ZIP whose file names are member serials (1001.jpg), phones or names."""
+    f = request.files.get('archive') or request.files.get('file')
+    if not f or not (f.filename or '').lower().endswith('.zip'):
+        return jsonify({'ok': False, 'error': "Upload a .zip file in field 'archive'"}), 400
+    workers = int(os.getenv('PHOTO_IMPORT_WORKERS', str(min(4, os.cpu_count() or 1))))
+    try:
+        # Werkzeug spools large uploads to a temp file, so the archive is read from disk
+        report = import_member_photos(f.stream, workers=workers)
+    except zipfile.BadZipFile:
+        return jsonify({'ok': False, 'error': 'Not a valid ZIP archive'}), 400
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    append_audit('member.photos.import', {
+        'saved': report['saved'], 'unmatched': len(report['unmatched']),
+        'collisions': len(report['collisions']), 'failed': len(report['failed']),
+        'user_id': session.get('user_id'),
+    })
+    return jsonify({'ok': True, **report})
+
+
+@app.cli.command('build-photo-derivatives')
+def build_photo_derivatives_command():
+    """Create thumbnails for photos uploaded before the derivative pipeline existed."""
+    built = 0
+    for member in Member.query.filter(Member.photo_key.isnot(None)).order_by(Member.id).yield_per(200):
+        if build_photo_derivatives(member.id, member.photo_key, member.photo_etag):
+            built += 1
+    print(f"Built derivatives for {built} photo(s)")
+
+
+@app.cli.command('backfill-member-photos')
+def backfill_member_photos_command():
+    """Record photo_key/photo_etag for photos already in static/uploads."""
+    print(f"Backfilled {backfill_member_photos()} member photo(s)")
+
 # API: get member payments
 @app.route('/api/members/<int:member_id>/payments', methods=['GET'])
 @login_required
@@ -1301,21 +3279,399 @@ def update_payment(payment_id):
     p.status = status
     db.session.commit()
     append_audit('payment.update', {'payment_id': payment_id, 'status': status, 'user_id': session.get('user_id')})
+    publish_events([_payment_event(p)])
     return jsonify(p.to_dict())
 
 # Export member payments to excel
 @app.route('/api/members/<int:member_id>/export', methods=['GET'])
 @login_required
 def export_member(member_id):
+    from openpyxl import Workbook
     member = Member.query.get_or_404(member_id)
     payments = Payment.query.filter_by(member_id=member_id).order_by(Payment.year, Payment.month).all()
-    rows = []
+    amounts = dict(
+        ((y, mo), amt) for y, mo, amt in db.session.query(
+            PaymentTransaction.year, PaymentTransaction.month, func.sum(PaymentTransaction.amount)
+        ).filter(PaymentTransaction.member_id == member_id).group_by(PaymentTransaction.year, PaymentTransaction.month)
+    )
+    # Built in memory: per-request, nothing written next to the app
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Payments')
+    ws.append(['Year', 'Month', 'Status', 'Amount'])
     for p in payments:
-        rows.append({"Year": p.year, "Month": p.month, "Status": p.status})
-    df = pd.DataFrame(rows)
-    out_path = os.path.join(BASE_DIR, f"member_{member_id}_payments.xlsx")
-    df.to_excel(out_path, index=False)
-    return send_file(out_path, as_attachment=True)
+        amt = amounts.get((p.year, p.month))
+        ws.append([p.year, p.month, p.status, round(amt, 2) if amt is not None else None])
+    out = BytesIO()
+    wb.save(out)
+    out.seek(0)
+    return send_file(
+        out, as_attachment=True, download_name=f"member_{member.id}_payments.xlsx",
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
+
+
+MAX_EXPORT_MONTHS = 36
+EXPORT_BATCH_SIZE = 500
+
+
+def _export_months(start: tuple[int, int], end: tuple[int, int]) -> list[tuple[int, int]]:
+    months, (y, m) = [], start
+    while (y, m) <= end:
+        months.append((y, m))
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    return months
+
+
+def member_payment_grid_header(months: list[tuple[int, int]]) -> list[str]:
+    labels = [f"{y}-{m:02d}" for y, m in months]
+    return (['Member ID', 'Name', 'Phone', 'Admission Date', 'Plan', 'Active']
+            + labels + [f"{label} amount" for label in labels] + ['Total paid'])
+
+
+def iter_member_payment_grid(months: list[tuple[int, int]], active_only: bool = False, batch_size: int = EXPORT_BATCH_SIZE):
+    """One row per member: a status column per month, then the amounts.
+
+    Members are read with ``yield_per`` and their payments/transactions are
+    fetched per batch (members come in id order, so a batch is an id range),
+    so memory stays flat whatever the member count. Months without a
+    payment row read as N/A before admission and Unpaid after it. Yearly
+    plan transactions (no month) only count towards ``Total paid``.
+    """
+    years = sorted({y for y, _ in months})
+    first, last = months[0], months[-1]
+    stmt = db.select(
+        Member.id, Member.name, Member.phone, Member.admission_date, Member.plan_type, Member.is_active
+    ).order_by(Member.id)
+    if active_only:
+        stmt = stmt.where(Member.is_active.is_(True))
+    for part in db.session.execute(stmt.execution_options(yield_per=batch_size)).partitions():
+        lo, hi = part[0].id, part[-1].id
+        statuses = {
+            (mid, y, mo): st for mid, y, mo, st in db.session.execute(
+                db.select(Payment.member_id, Payment.year, Payment.month, Payment.status)
+                .where(Payment.member_id.between(lo, hi), Payment.year.in_(years))
+            )
+        }
+        amounts, totals = {}, {}
+        for mid, y, mo, amt in db.session.execute(
+            db.select(PaymentTransaction.member_id, PaymentTransaction.year, PaymentTransaction.month, func.sum(PaymentTransaction.amount))
+            .where(PaymentTransaction.member_id.between(lo, hi), PaymentTransaction.year.in_(years))
+            .group_by(PaymentTransaction.member_id, PaymentTransaction.year, PaymentTransaction.month)
+        ):
+            if mo is not None and not (first <= (y, mo) <= last):
+                continue
+            amounts[(mid, y, mo)] = amt or 0.0
+            totals[mid] = totals.get(mid, 0.0) + (amt or 0.0)
+        for r in part:
+            adm = (r.admission_date.year, r.admission_date.month) if r.admission_date else None
+            cells = [statuses.get((r.id, y, mo)) or ('N/A' if adm and (y, mo) < adm else 'Unpaid') for y, mo in months]
+            paid = [round(amounts[(r.id, y, mo)], 2) if (r.id, y, mo) in amounts else None for y, mo in months]
+            yield ([r.id, r.name, r.phone or '', r.admission_date.isoformat() if r.admission_date else '',
+                    r.plan_type or 'monthly', 'Yes' if r.is_active is not False else 'No']
+                   + cells + paid + [round(totals.get(r.id, 0.0), 2)])
+
+
+def _parse_export_months():
+    """``?year=YYYY`` or ``?from=YYYY-MM&to=YYYY-MM`` (default: this calendar year)."""
+    def ym(value):
+        y, m = str(value).split('-')
+        y, m = int(y), int(m)
+        if not 1 <= m <= 12:
+            raise ValueError
+        return y, m
+    if request.args.get('from') or request.args.get('to'):
+        start = ym(request.args.get('from') or request.args.get('to'))
+        end = ym(request.args.get('to') or request.args.get('from'))
+    else:
+        year = int(request.args.get('year') or datetime.now().year)
+        start, end = (year, 1), (year, 12)
+    months = _export_months(start, end)
+    if not months or len(months) > MAX_EXPORT_MONTHS:
+        raise ValueError
+    return months
+
+
+@app.route('/api/members/export.<fmt>', methods=['GET'])
+@login_required
+def export_members(fmt):
+    """Gym-wide payment grid as CSV (streamed) or XLSX (buffered).
+
+    Query: ``year`` or ``from``/``to`` (YYYY-MM, at most 36 months), ``active=1``.
+
+    CSV rows are sent as they are read. An XLSX file is a zip whose index is
+    written last, so it cannot go out until the whole workbook is done: it is
+    built with the write-only workbook into a spooled temp file (memory up to
+    8 MB, then disk) and the first byte is sent only after the last row.
+    """
+    if fmt not in ('csv', 'xlsx'):
+        return jsonify({'ok': False, 'error': 'Format must be csv or xlsx'}), 404
+    try:
+        months = _parse_export_months()
+    except ValueError:
+        return jsonify({'ok': False, 'error': f'Invalid month range (YYYY-MM, at most {MAX_EXPORT_MONTHS} months)'}), 400
+    active_only = request.args.get('active') in ('1', 'true', 'yes')
+    name = f"members_payments_{months[0][0]}-{months[0][1]:02d}_{months[-1][0]}-{months[-1][1]:02d}.{fmt}"
+    append_audit('members.export', {'format': fmt, 'from': f"{months[0][0]}-{months[0][1]:02d}",
+                                    'to': f"{months[-1][0]}-{months[-1][1]:02d}", 'user_id': session.get('user_id')})
+    if fmt == 'csv':
+        return Response(
+            stream_with_context(_iter_csv_lines(member_payment_grid_header(months), iter_member_payment_grid(months, active_only))),
+            mimetype='text/csv; charset=utf-8',
+            headers={'Content-Disposition': f'attachment; filename="{name}"'},
+        )
+    # Buffered: the zip is only valid once complete (see docstring)
+    out = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    write_member_payment_grid_xlsx(out, months, active_only)
+    out.seek(0)
+    return send_file(out, as_attachment=True, download_name=name,
+                     mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+
+def _iter_csv_lines(header: list, rows, flush_every: int = 200):
+    import csv
+    buf = StringIO()
+    writer = csv.writer(buf)
+    buf.write('\ufeff')  # BOM so Excel opens UTF-8 names correctly
+    writer.writerow(header)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % flush_every == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def write_member_payment_grid_xlsx(out, months: list[tuple[int, int]], active_only: bool = False) -> int:
+    """Write the grid with openpyxl's write-only mode (rows go to disk, not memory)."""
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Members')
+    ws.freeze_panes = 'C2'
+    ws.append(member_payment_grid_header(months))
+    count = 0
+    for row in iter_member_payment_grid(months, active_only):
+        ws.append(row)
+        count += 1
+    wb.save(out)
+    return count
+
+
+@app.cli.command('export-members')
+@click.option('--out', required=True, help='Destination .csv or .xlsx file')
+@click.option('--year', type=int, default=None, help='Calendar year (default: current)')
+@click.option('--active-only', is_flag=True, help='Skip inactive members')
+def export_members_command(out, year, active_only):
+    """Write the gym-wide member payment grid."""
+    year = year or datetime.now().year
+    months = _export_months((year, 1), (year, 12))
+    if out.lower().endswith('.xlsx'):
+        with open(out, 'wb') as fh:
+            count = write_member_payment_grid_xlsx(fh, months, active_only)
+        click.echo(f"Exported {count} members to {out}")
+        return
+    with open(out, 'w', encoding='utf-8', newline='') as fh:
+        for chunk in _iter_csv_lines(member_payment_grid_header(months), iter_member_payment_grid(months, active_only)):
+            fh.write(chunk)
+    click.echo(f"Exported to {out}")
+
+
+# Analytics export: typed Parquet files for accounting/BI, laid out as a
+# hive-partitioned dataset under ANALYTICS_DIR:
+#   members.parquet
+#   payments/year=YYYY/month=MM/part-0.parquet      (billing period)
+#   transactions/year=YYYY/month=MM/part-0.parquet  (created_at)
+# _manifest.json remembers each partition's row count and id sum plus the
+# ChangeLog position, so a run only rewrites partitions whose rows were
+# added, deleted or edited since the previous one.
+ANALYTICS_DIR = os.getenv('ANALYTICS_DIR') or os.path.join(BASE_DIR, 'exports', 'analytics')
+ANALYTICS_BATCH_SIZE = 5000
+_analytics_lock = threading.Lock()
+
+
+def _analytics_schemas() -> dict:
+    ts = pa.timestamp('us')
+    return {
+        'members': pa.schema([
+            ('id', pa.int64()), ('name', pa.string()), ('phone', pa.string()), ('email', pa.string()),
+            ('admission_date', pa.date32()), ('plan_type', pa.string()), ('access_tier', pa.string()),
+            ('training_type', pa.string()), ('monthly_fee', pa.float64()), ('is_active', pa.bool_()),
+            ('referred_by', pa.int64()), ('last_contact_at', ts),
+        ]),
+        'payments': pa.schema([
+            ('id', pa.int64()), ('member_id', pa.int64()), ('period', pa.date32()),
+            ('status', pa.string()), ('created_at', ts),
+        ]),
+        'transactions': pa.schema([
+            ('id', pa.int64()), ('member_id', pa.int64()), ('user_id', pa.int64()), ('plan_type', pa.string()),
+            ('billing_year', pa.int16()), ('billing_month', pa.int8()), ('amount', pa.float64()),
+            ('method', pa.string()), ('created_at', ts),
+        ]),
+    }
+
+
+def _analytics_sources() -> dict:
+    """Per partitioned dataset: (model, year expr, month expr, row select, row -> tuple)."""
+    tx_year = db.extract('year', PaymentTransaction.created_at)
+    tx_month = db.extract('month', PaymentTransaction.created_at)
+    return {
+        'payments': (
+            Payment, Payment.year, Payment.month, 'payment',
+            db.select(Payment.id, Payment.member_id, Payment.year, Payment.month, Payment.status, Payment.created_at),
+            lambda r: (r.id, r.member_id, datetime(r.year, r.month, 1).date(), r.status, r.created_at),
+        ),
+        'transactions': (
+            PaymentTransaction, tx_year, tx_month, 'transaction',
+            db.select(PaymentTransaction.id, PaymentTransaction.member_id, PaymentTransaction.user_id,
+                      PaymentTransaction.plan_type, PaymentTransaction.year, PaymentTransaction.month,
+                      PaymentTransaction.amount, PaymentTransaction.method, PaymentTransaction.created_at),
+            lambda r: tuple(r),
+        ),
+    }
+
+
+def _write_parquet(path: str, schema, batches) -> int:
+    """Write row-tuple batches as row groups; atomic replace, constant memory."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    rows = 0
+    try:
+        with pq.ParquetWriter(tmp, schema, compression='zstd') as writer:
+            for batch in batches:
+                if not batch:
+                    continue
+                columns = list(zip(*batch))
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(col, type=field.type) for col, field in zip(columns, schema)], schema=schema))
+                rows += len(batch)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return rows
+
+
+def _partition_path(root: str, dataset: str, year: int, month: int) -> str:
+    return os.path.join(root, dataset, f'year={year}', f'month={month:02d}', 'part-0.parquet')
+
+
+def export_analytics(full: bool = False, root: str | None = None) -> dict:
+    """Bring the Parquet dataset under ``root`` up to date; returns a report."""
+    if not HAVE_PYARROW:
+        raise RuntimeError('pyarrow is not installed')
+    root = root or ANALYTICS_DIR
+    started = time.monotonic()
+    with _analytics_lock:
+        os.makedirs(root, exist_ok=True)
+        manifest_path = os.path.join(root, '_manifest.json')
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as fh:
+                manifest = json.load(fh)
+        except (OSError, ValueError):
+            manifest = {}
+        head_seq = db.session.query(func.max(ChangeLog.seq)).scalar() or 0
+        since = int(manifest.get('change_seq') or 0)
+        last_reset = db.session.query(func.max(ChangeLog.seq)).filter(ChangeLog.op == 'reset').scalar() or 0
+        if full or manifest.get('format') != 1 or last_reset > since or head_seq < since:
+            manifest = {'format': 1, 'partitions': {}}
+        schemas = _analytics_schemas()
+        report = {'written': [], 'removed': [], 'rows': 0}
+
+        # Members: one small file, rewritten when the member table changed
+        members_version = get_data_versions(['member']).get('member', 0)
+        members_path = os.path.join(root, 'members.parquet')
+        if manifest.get('members_version') != members_version or not os.path.exists(members_path):
+            stmt = db.select(
+                Member.id, Member.name, Member.phone, Member.email, Member.admission_date, Member.plan_type,
+                Member.access_tier, Member.training_type, Member.monthly_fee, Member.is_active,
+                Member.referred_by, Member.last_contact_at,
+            ).order_by(Member.id).execution_options(yield_per=ANALYTICS_BATCH_SIZE)
+            report['rows'] += _write_parquet(members_path, schemas['members'],
+                                             ([tuple(r) for r in part] for part in db.session.execute(stmt).partitions()))
+            report['written'].append('members.parquet')
+            manifest['members_version'] = members_version
+
+        for dataset, (model, year_col, month_col, entity, select, to_row) in _analytics_sources().items():
+            known = manifest['partitions'].get(dataset, {})
+            year_col, month_col = db.cast(year_col, db.Integer), db.cast(month_col, db.Integer)
+            current = {
+                f"{int(y)}-{int(m):02d}": [int(n), int(id_sum or 0)]
+                for y, m, n, id_sum in db.session.query(year_col, month_col, func.count(model.id), func.sum(model.id))
+                .group_by(year_col, month_col)
+                if y is not None and m is not None
+            }
+            dirty = {k for k, fp in current.items()
+                     if known.get(k) != fp or not os.path.exists(_partition_path(root, dataset, *map(int, k.split('-'))))}
+            # In-place edits keep the fingerprint; find them through the change log
+            edited = [i for (i,) in db.session.query(ChangeLog.entity_id).filter(
+                ChangeLog.seq > since, ChangeLog.entity == entity, ChangeLog.op == 'upsert').distinct()]
+            for start in range(0, len(edited), 500):
+                ids = edited[start:start + 500]
+                dirty.update(f"{int(y)}-{int(m):02d}" for y, m in db.session.query(year_col, month_col)
+                             .filter(model.id.in_(ids)).distinct() if y is not None and m is not None)
+            for key in sorted(dirty):
+                y, m = map(int, key.split('-'))
+                stmt = select.where(year_col == y, month_col == m).order_by(model.id).execution_options(yield_per=ANALYTICS_BATCH_SIZE)
+                report['rows'] += _write_parquet(_partition_path(root, dataset, y, m), schemas[dataset],
+                                                 ([to_row(r) for r in part] for part in db.session.execute(stmt).partitions()))
+                report['written'].append(f"{dataset}/{key}")
+            for key in sorted(set(known) - set(current)):
+                y, m = map(int, key.split('-'))
+                shutil.rmtree(os.path.dirname(_partition_path(root, dataset, y, m)), ignore_errors=True)
+                report['removed'].append(f"{dataset}/{key}")
+            manifest['partitions'][dataset] = current
+
+        manifest['change_seq'] = head_seq
+        manifest['exported_at'] = datetime.now().isoformat(timespec='seconds')
+        tmp = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            json.dump(manifest, fh, indent=1, sort_keys=True)
+        os.replace(tmp, manifest_path)
+    report['seconds'] = round(time.monotonic() - started, 3)
+    return report
+
+
+@app.cli.command('export-analytics')
+@click.option('--full', is_flag=True, help='Rewrite every partition')
+@click.option('--out', default=None, help='Destination directory (default: ANALYTICS_DIR)')
+def export_analytics_command(full, out):
+    """Write members/payments/transactions as partitioned Parquet."""
+    report = export_analytics(full=full, root=out)
+    click.echo(f"Wrote {len(report['written'])} file(s), {report['rows']} rows, removed {len(report['removed'])} partition(s) in {report['seconds']}s")
+
+
+@app.route('/api/admin/analytics/export', methods=['GET', 'POST'])
+@admin_required
+def analytics_export():
+    """POST brings the Parquet export up to date; GET lists its files."""
+    if not HAVE_PYARROW:
+        return jsonify({'ok': False, 'error': 'pyarrow is not installed'}), 501
+    if request.method == 'POST':
+        payload = request.get_json(silent=True) or {}
+        report = export_analytics(full=bool(payload.get('full')))
+        append_audit('analytics.export', {k: (len(v) if isinstance(v, list) else v) for k, v in report.items()})
+        return jsonify({'ok': True, **report})
+    files = []
+    for dirpath, _, names in os.walk(ANALYTICS_DIR):
+        for name in names:
+            if name.endswith('.parquet'):
+                rel = os.path.relpath(os.path.join(dirpath, name), ANALYTICS_DIR).replace(os.sep, '/')
+                files.append({'path': rel, 'size': os.path.getsize(os.path.join(dirpath, name)),
+                              'url': url_for('analytics_file', path=rel)})
+    files.sort(key=lambda f: f['path'])
+    return jsonify({'ok': True, 'files': files})
+
+
+@app.route('/api/admin/analytics/files/<path:path>', methods=['GET'])
+@admin_required
+def analytics_file(path):
+    if not path.endswith('.parquet'):
+        return jsonify({'ok': False, 'error': 'Not found'}), 404
+    return send_from_directory(ANALYTICS_DIR, path, mimetype='application/vnd.apache.parquet', as_attachment=True)
+
 
 def ensure_payment_rows(member: Member, year: int):
     # Create payment rows for a year if missing
@@ -1372,6 +3728,7 @@ def record_payment(member_id):
         db.session.add(txn)
         db.session.commit()
         append_audit('payment.txn.monthly', {'member_id': m.id, 'year': year, 'month': month, 'amount': amount, 'method': method, 'user_id': session.get('user_id')})
+        publish_events([_payment_event(p), _transaction_event(txn)])
         return jsonify({'ok': True})
     else:
         # yearly: mark all months Paid for specified year
@@ -1385,6 +3742,7 @@ def record_payment(member_id):
         db.session.add(txn)
         db.session.commit()
         append_audit('payment.txn.yearly', {'member_id': m.id, 'year': year, 'amount': amount, 'method': method, 'user_id': session.get('user_id')})
+        publish_events([('payment.status', {'member_id': m.id, 'year': year, 'month': None, 'status': 'Paid'}), _transaction_event(txn)])
         return jsonify({'ok': True})
 
 @app.route('/api/members/<int:member_id>/message', methods=['POST'])
@@ -1432,6 +3790,7 @@ def get_upload(file_id):
         'content_hash': f.content_hash,
         'rows_count': f.rows_count,
         'uploaded_at': f.uploaded_at.isoformat(),
+        'download_url': storage_url('data_uploads', f.stored_name, filename=f.original_name),
     }
     # Provide rows snapshot (parsed) limited
     try:
@@ -1441,6 +3800,90 @@ def get_upload(file_id):
         detail['rows'] = []
     return jsonify(detail)
 
+UPLOAD_SNAPSHOT_ROWS = 50
+UPLOAD_CSV_CHUNK_ROWS = 50_000
+
+
+def _spool_upload(stream, spool_dir: str | None, suffix: str = '') -> tuple[str, int, str]:
+    """Copy an upload stream to a temp file in ``spool_dir``, hashing as it goes.
+
+    Returns ``(path, size, sha256)``; memory use is one chunk whatever the
+    file size. The temp name starts with ``.upload-`` so a half-written
+    spool file never shows up in storage listings.
+    """
+    limit = app.config.get('MAX_CONTENT_LENGTH')
+    reader = HashingReader(stream)
+    fd, path = tempfile.mkstemp(dir=spool_dir, prefix='.upload-', suffix=suffix)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in iter(lambda: reader.read(1 << 16), b''):
+                if limit and reader.count > limit:
+                    raise RequestEntityTooLarge()
+                out.write(chunk)
+    except BaseException:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise
+    return path, reader.count, reader.sha256.hexdigest()
+
+
+def _snapshot_rows(df) -> list[dict]:
+    rows = df.head(UPLOAD_SNAPSHOT_ROWS).to_dict(orient='records')
+    # Convert datetime objects to strings for JSON serialization
+    for row in rows:
+        for key, value in row.items():
+            if isinstance(value, (datetime, pd.Timestamp)):
+                row[key] = value.strftime('%Y-%m-%d') if value else None
+            elif pd.isna(value):
+                row[key] = None
+    return rows
+
+
+def _upload_snapshot(path: str, ext: str) -> tuple[int, list[dict]]:
+    """Row count and the first rows of a spooled CSV/Excel upload.
+
+    CSVs are counted in chunks and .xlsx sheets with openpyxl's read-only
+    reader, so neither is ever loaded whole.
+    """
+    if ext == '.csv':
+        rows_count, rows = 0, []
+        for chunk in pd.read_csv(path, chunksize=UPLOAD_CSV_CHUNK_ROWS, encoding_errors='ignore'):
+            if len(rows) < UPLOAD_SNAPSHOT_ROWS:
+                rows += _snapshot_rows(chunk)[:UPLOAD_SNAPSHOT_ROWS - len(rows)]
+            rows_count += len(chunk.index)
+        return rows_count, rows
+    if ext == '.xlsx':
+        from openpyxl import load_workbook
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            header, rows, last = None, [], 0
+            for i, values in enumerate(wb.worksheets[0].iter_rows(values_only=True)):
+                if header is None:
+                    header = [str(v) if v is not None else f'Unnamed: {j}' for j, v in enumerate(values)]
+                    continue
+                if len(rows) < UPLOAD_SNAPSHOT_ROWS:
+                    rows.append({
+                        k: v.strftime('%Y-%m-%d') if isinstance(v, datetime) else (None if v == '' else v)
+                        for k, v in zip(header, values)
+                    })
+                # Trailing blank rows do not count (same as pandas)
+                if any(v is not None and v != '' for v in values):
+                    last = i
+        finally:
+            wb.close()
+        return last, rows[:last]
+    if ext == '.xls':
+        df = pd.read_excel(path)
+        return len(df.index), _snapshot_rows(df)
+    return 0, []
+
+
+def _upload_payload(rec: 'UploadedFile') -> dict:
+    return {'id': rec.id, 'original_name': rec.original_name, 'rows_count': rec.rows_count}
+
+
 @app.route('/api/uploads', methods=['POST'])
 @login_required
 def upload_data_file():
@@ -1450,64 +3893,651 @@ def upload_data_file():
     if not f or not f.filename:
         return jsonify({'ok': False, 'error': 'empty filename'}), 400
     orig = f.filename
-    data = f.read()
-    if not data:
-        return jsonify({'ok': False, 'error': 'empty file'}), 400
-    digest = _hash_bytes(data)
-    # Duplicate content handling: return existing record instead of error
-    existing_upload = UploadedFile.query.filter_by(content_hash=digest).first()
-    if existing_upload:
-        return jsonify({
-            'ok': True,
-            'duplicate': True,
-            'file': {
-                'id': existing_upload.id,
-                'original_name': existing_upload.original_name,
-                'rows_count': existing_upload.rows_count
-            },
-            'message': 'Duplicate file detected; using previously uploaded file.'
-        })
-    # Determine extension and parse
     ext = os.path.splitext(orig)[1].lower()
-    parsed_rows = []
-    rows_count = 0
-    try:
-        import pandas as pd  # local import
-        if ext in ('.csv',):
-            from io import StringIO
-            df = pd.read_csv(StringIO(data.decode('utf-8', 'ignore')))
-        elif ext in ('.xlsx', '.xls'):
-            from io import BytesIO
-            df = pd.read_excel(BytesIO(data))
-        else:
-            df = None
-        if df is not None:
-            rows_count = len(df.index)
-            # snapshot max 50 rows
-            snap = df.head(50)
-            parsed_rows = snap.to_dict(orient='records')
-            # Convert datetime objects to strings for JSON serialization
-            for row in parsed_rows:
-                for key, value in row.items():
-                    if isinstance(value, (datetime, pd.Timestamp)):
-                        row[key] = value.strftime('%Y-%m-%d') if value else None
-                    elif pd.isna(value):
-                        row[key] = None
-    except Exception:
-        pass
-    stored_name = f"upload_{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}_{secrets.token_hex(4)}{ext or ''}"
-    storage_dir = os.path.join(BASE_DIR, 'data_uploads')
-    os.makedirs(storage_dir, exist_ok=True)
-    with open(os.path.join(storage_dir, stored_name), 'wb') as out:
-        out.write(data)
+    tmp_path, size, digest = _spool_upload(f.stream, data_store.spool_dir, suffix=ext)
+    try:
+        if not size:
+            return jsonify({'ok': False, 'error': 'empty file'}), 400
+        # Duplicate content handling: return existing record instead of error
+        existing_upload = UploadedFile.query.filter_by(content_hash=digest).first()
+        if existing_upload:
+            return jsonify({
+                'ok': True,
+                'duplicate': True,
+                'file': _upload_payload(existing_upload),
+                'message': 'Duplicate file detected; using previously uploaded file.'
+            })
+        try:
+            rows_count, parsed_rows = _upload_snapshot(tmp_path, ext)
+        except Exception:
+            rows_count, parsed_rows = 0, []
+        stored_name = f"upload_{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}_{secrets.token_hex(4)}{ext or ''}"
+        data_store.put_path(stored_name, tmp_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
     rec = UploadedFile(original_name=orig, stored_name=stored_name, content_hash=digest, rows_count=rows_count, rows_json=json.dumps(parsed_rows) if parsed_rows else None)
     db.session.add(rec)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Same file uploaded concurrently: keep the first one
+        db.session.rollback()
+        data_store.delete(stored_name)
+        existing_upload = UploadedFile.query.filter_by(content_hash=digest).first()
+        return jsonify({'ok': True, 'duplicate': True, 'file': _upload_payload(existing_upload),
+                        'message': 'Duplicate file detected; using previously uploaded file.'})
+    append_audit('data.upload', {'file_id': rec.id, 'original_name': orig, 'rows_count': rows_count, 'size': size, 'user_id': session.get('user_id')})
+    return jsonify({'ok': True, 'file': _upload_payload(rec)})
+
+
+# Uploaded CSV/Excel files are converted once into a per-upload SQLite file
+# (table "data", columns c0..cN; real header names in "meta") so they can be
+# filtered, grouped and paged without re-parsing the spreadsheet. The file
+# name carries the content hash, so a cache file always matches its upload.
+DATASET_CACHE_DIR = os.getenv('DATASET_CACHE_DIR') or os.path.join(BASE_DIR, 'cache', 'datasets')
+DATASET_BATCH_ROWS = 5000
+DATASET_FORMAT = 2  # bump when the cached layout or cell typing changes
+DATASET_QUERY_SECONDS = float(os.getenv('DATASET_QUERY_SECONDS', '5'))
+DATASET_MAX_LIMIT = 1000
+DATASET_OPS = {
+    'eq': '= ?', 'ne': '!= ?', 'lt': '< ?', 'lte': '<= ?', 'gt': '> ?', 'gte': '>= ?',
+    'contains': "LIKE ? ESCAPE '\\'", 'startswith': "LIKE ? ESCAPE '\\'",
+    'in': 'IN', 'isnull': 'IS NULL', 'notnull': 'IS NOT NULL',
+}
+DATASET_AGGS = {
+    'count': 'COUNT({})', 'sum': 'SUM({})', 'avg': 'AVG({})', 'min': 'MIN({})',
+    'max': 'MAX({})', 'count_distinct': 'COUNT(DISTINCT {})',
+}
+_dataset_lock = threading.Lock()
+
+
+def _dataset_value(v):
+    if v is None or v is pd.NaT:
+        return None
+    if hasattr(v, 'isoformat'):  # datetime, date, time, pd.Timestamp
+        return v.isoformat()
+    if hasattr(v, 'item'):  # numpy scalar
+        v = v.item()
+    if isinstance(v, float) and v != v:  # NaN
+        return None
+    if isinstance(v, (int, float, str, bytes)):
+        return v
+    return str(v)
+
+
+def _csv_cell(v):
+    """CSV cells are read as text. Plain numbers are stored as numbers; anything
+    else, ids and phones with leading zeros ("00123") included, stays text."""
+    if not isinstance(v, str):
+        return _dataset_value(v)
+    whole, dot, frac = (v[1:] if v.startswith('-') else v).partition('.')
+    if whole.isascii() and whole.isdigit() and (whole == '0' or whole[0] != '0'):
+        if not dot:
+            return int(v)
+        if frac.isascii() and frac.isdigit():
+            return float(v)
+    return v
+
+
+def _unique_headers(values) -> list[str]:
+    seen, out = {}, []
+    for j, v in enumerate(values):
+        name = str(v).strip() if v is not None and str(v).strip() else f'Unnamed: {j}'
+        if name in seen:
+            seen[name] += 1
+            name = f'{name}.{seen[name]}'
+        seen.setdefault(name, 0)
+        out.append(name)
+    return out
+
+
+def _iter_upload_batches(path: str, ext: str):
+    """Yield ``(headers, rows)`` batches of an uploaded sheet, never the whole file."""
+    if ext == '.csv':
+        for chunk in pd.read_csv(path, chunksize=DATASET_BATCH_ROWS, dtype=str, encoding_errors='ignore'):
+            yield [str(c) for c in chunk.columns], [tuple(_csv_cell(v) for v in row) for row in chunk.itertuples(index=False)]
+    elif ext == '.xlsx':
+        from openpyxl import load_workbook
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            headers, batch, pending_blank = None, [], []
+            for values in wb.worksheets[0].iter_rows(values_only=True):
+                if headers is None:
+                    headers = _unique_headers(values)
+                    continue
+                row = tuple(_dataset_value(v if v != '' else None) for v in values[:len(headers)])
+                row += (None,) * (len(headers) - len(row))
+                if all(v is None for v in row):
+                    pending_blank.append(row)  # kept only if data follows (pandas semantics)
+                    continue
+                batch.extend(pending_blank)
+                pending_blank = []
+                batch.append(row)
+                if len(batch) >= DATASET_BATCH_ROWS:
+                    yield headers, batch
+                    batch = []
+            if headers is not None:
+                yield headers, batch
+        finally:
+            wb.close()
+    elif ext == '.xls':
+        df = pd.read_excel(path)
+        yield [str(c) for c in df.columns], [tuple(_dataset_value(v) for v in row) for row in df.itertuples(index=False)]
+    else:
+        raise ValueError(f'unsupported file type: {ext or "none"}')
+
+
+def _build_upload_dataset(rec: 'UploadedFile', dest: str) -> None:
+    import sqlite3
+    ext = os.path.splitext(rec.stored_name)[1].lower()
+    tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+    conn = sqlite3.connect(tmp)
+    try:
+        conn.execute('PRAGMA journal_mode=OFF')
+        conn.execute('PRAGMA synchronous=OFF')
+        headers = None
+        with data_store.local_path(rec.stored_name) as src:
+            for cols, rows in _iter_upload_batches(src, ext):
+                if headers is None:
+                    headers = cols
+                    conn.execute('CREATE TABLE data ({})'.format(', '.join(f'c{i}' for i in range(len(headers))) or 'c0'))
+                if rows:
+                    conn.executemany(f"INSERT INTO data VALUES ({', '.join('?' * max(len(headers), 1))})", rows)
+        conn.execute('CREATE TABLE meta (columns TEXT NOT NULL)')
+        conn.execute('INSERT INTO meta VALUES (?)', (json.dumps(headers or []),))
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp, dest)
+
+
+def upload_dataset_path(rec: 'UploadedFile') -> str:
+    """Path of the SQLite cache for an upload, converting the file on first use."""
+    dest = os.path.join(DATASET_CACHE_DIR, f"upload_{rec.id}_{rec.content_hash[:16]}_v{DATASET_FORMAT}.sqlite")
+    if os.path.exists(dest):
+        return dest
+    with _dataset_lock:
+        if not os.path.exists(dest):
+            os.makedirs(DATASET_CACHE_DIR, exist_ok=True)
+            try:
+                _build_upload_dataset(rec, dest)
+            except BaseException:
+                for name in os.listdir(DATASET_CACHE_DIR):
+                    if name.startswith(os.path.basename(dest) + '.') and name.endswith('.tmp'):
+                        try:
+                            os.remove(os.path.join(DATASET_CACHE_DIR, name))
+                        except OSError:
+                            pass
+                raise
+    return dest
+
+
+def _split_arg(value) -> list:
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [p.strip() for p in str(value).split(',') if p.strip()]
+
+
+def _typed_filter(c: str, expr: str, values: list) -> tuple[str, list]:
+    """``c <expr>`` for cells of either type.
+
+    Query-string values arrive as text and are read like CSV cells: a plain
+    number is compared as a number against numeric cells and as text against
+    text cells, so ``amount:gte:2900`` compares numerically while
+    ``phone:eq:00123`` only matches the text '00123'.
+    """
+    numbers = [_csv_cell(v) if isinstance(v, str) else v for v in values]
+    if numbers == values:
+        return f'{c} {expr}', values
+    return (f"CASE WHEN typeof({c}) IN ('integer', 'real') THEN {c} {expr} ELSE {c} {expr} END",
+            numbers + values)
+
+
+def _dataset_query_spec() -> dict:
+    """Query parameters from a JSON body (POST) or the query string (GET).
+
+    GET form: ``columns=a,b``, ``filter=col:op:value`` (repeatable),
+    ``group_by=a``, ``agg=sum:Amount,count:*``, ``order_by=-Amount``,
+    ``limit``, ``offset``.
+    """
+    body = request.get_json(silent=True) if request.method == 'POST' else None
+    if body:
+        return body
+    filters = []
+    for raw in request.args.getlist('filter'):
+        col, _, rest = raw.partition(':')
+        op, _, value = rest.partition(':')
+        value = value.split('|') if op == 'in' else value
+        filters.append({'column': col, 'op': op, 'value': value})
+    aggs = []
+    for raw in _split_arg(request.args.get('agg')):
+        fn, _, col = raw.partition(':')
+        aggs.append({'fn': fn, 'column': col or '*'})
+    return {
+        'columns': _split_arg(request.args.get('columns')),
+        'filters': filters,
+        'group_by': _split_arg(request.args.get('group_by')),
+        'aggregates': aggs,
+        'order_by': _split_arg(request.args.get('order_by')),
+        'limit': request.args.get('limit'),
+        'offset': request.args.get('offset'),
+    }
+
+
+def query_upload_dataset(path: str, spec: dict) -> dict:
+    """Run a projection/filter/group-by query against an upload's SQLite cache.
+
+    Column names are mapped to c0..cN and every value is a bound parameter,
+    so nothing from the request is spliced into the SQL.
+    """
+    import sqlite3
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        headers = json.loads(conn.execute('SELECT columns FROM meta').fetchone()[0])
+        index = {name: f'c{i}' for i, name in enumerate(headers)}
+
+        def col(name):
+            if name not in index:
+                raise ValueError(f'unknown column: {name}')
+            return index[name]
+
+        where, params = [], []
+        for f in spec.get('filters') or []:
+            op = (f.get('op') or 'eq').lower()
+            if op not in DATASET_OPS:
+                raise ValueError(f'unknown filter op: {op}')
+            c, value = col(f.get('column')), f.get('value')
+            if op == 'in':
+                values = value if isinstance(value, list) else [value]
+                if not values:
+                    raise ValueError('in filter needs at least one value')
+                sql, args = _typed_filter(c, f"IN ({', '.join('?' * len(values))})", list(values))
+                where.append(sql)
+                params.extend(args)
+            elif op in ('isnull', 'notnull'):
+                where.append(f'{c} {DATASET_OPS[op]}')
+            else:
+                if op in ('contains', 'startswith'):
+                    value = str(value).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                    value = f'%{value}%' if op == 'contains' else f'{value}%'
+                    where.append(f'{c} {DATASET_OPS[op]}')
+                    params.append(value)
+                else:
+                    sql, args = _typed_filter(c, DATASET_OPS[op], [value])
+                    where.append(sql)
+                    params.extend(args)
+        where_sql = f" WHERE {' AND '.join(where)}" if where else ''
+
+        group_by = [col(g) for g in spec.get('group_by') or []]
+        aggregates = spec.get('aggregates') or []
+        if group_by or aggregates:
+            labels = list(spec.get('group_by') or [])
+            exprs = list(group_by)
+            for a in aggregates:
+                fn = (a.get('fn') or '').lower()
+                if fn not in DATASET_AGGS:
+                    raise ValueError(f'unknown aggregate: {fn}')
+                target = a.get('column') or '*'
+                if target == '*' and fn != 'count':
+                    raise ValueError(f'{fn} needs a column')
+                exprs.append(DATASET_AGGS[fn].format('*' if target == '*' else col(target)))
+                labels.append(f'{fn}({target})')
+            body_sql = f"SELECT {', '.join(exprs)} FROM data{where_sql}"
+            if group_by:
+                body_sql += f" GROUP BY {', '.join(group_by)}"
+        else:
+            labels = list(spec.get('columns') or headers)
+            exprs = [col(c) for c in labels] or ['NULL']
+            body_sql = f"SELECT {', '.join(exprs)} FROM data{where_sql}"
+        positions = {label: i + 1 for i, label in enumerate(labels)}
+
+        order = []
+        for o in _split_arg(spec.get('order_by')):
+            desc = o.startswith('-')
+            name = o[1:] if desc else o
+            if name not in positions:
+                raise ValueError(f'cannot order by: {name}')
+            order.append(f"{positions[name]}{' DESC' if desc else ''}")
+        if not order and not (group_by or aggregates):
+            order = ['rowid'] if 'rowid' not in labels else []
+        order_sql = f" ORDER BY {', '.join(order)}" if order else ''
+
+        try:
+            limit = min(max(int(spec.get('limit') or 100), 1), DATASET_MAX_LIMIT)
+            offset = max(int(spec.get('offset') or 0), 0)
+        except (TypeError, ValueError):
+            raise ValueError('limit and offset must be integers')
+
+        deadline = time.monotonic() + DATASET_QUERY_SECONDS
+        conn.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, 10000)
+        total = conn.execute(f'SELECT COUNT(*) FROM ({body_sql})', params).fetchone()[0]
+        rows = conn.execute(f'{body_sql}{order_sql} LIMIT ? OFFSET ?', params + [limit, offset]).fetchall()
+    finally:
+        conn.close()
+    return {'columns': labels, 'rows': [list(r) for r in rows], 'total': total,
+            'limit': limit, 'offset': offset, 'available_columns': headers}
+
+
+@app.route('/api/uploads/<int:file_id>/query', methods=['GET', 'POST'])
+@login_required
+def query_upload(file_id):
+    """Explore an uploaded sheet: projection, filters, group-by aggregates, paging."""
+    rec = UploadedFile.query.get_or_404(file_id)
+    try:
+        path = upload_dataset_path(rec)
+    except FileNotFoundError:
+        return jsonify({'ok': False, 'error': 'Uploaded file is missing from storage'}), 404
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 415
+    try:
+        result = query_upload_dataset(path, _dataset_query_spec())
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    except Exception as e:
+        if 'interrupted' in str(e):
+            return jsonify({'ok': False, 'error': 'Query took too long; add filters or reduce grouping'}), 400
+        raise
+    return jsonify({'ok': True, 'file_id': rec.id, **result})
+
+
+@app.route('/api/codes/allocate', methods=['POST'])
+@login_required
+def allocate_codes():
+    """Hand out a block of reserved codes, e.g. invoice numbers for a POS
+    that will go offline or referral codes for an external import.
+    Body: ``{"kind": "invoice"|"referral", "count": n}`` (n <= 1000)."""
+    data = request.get_json(silent=True) or {}
+    kind = (data.get('kind') or '').strip().lower()
+    try:
+        count = int(data.get('count') or 1)
+    except (TypeError, ValueError):
+        return jsonify({'ok': False, 'error': 'count must be an integer'}), 400
+    if not 1 <= count <= 1000:
+        return jsonify({'ok': False, 'error': 'count must be between 1 and 1000'}), 400
+    generators = {'invoice': invoice_numbers, 'referral': referral_codes}
+    if kind not in generators:
+        return jsonify({'ok': False, 'error': 'kind must be invoice or referral'}), 400
+    codes = generators[kind](count)
     db.session.commit()
-    append_audit('data.upload', {'file_id': rec.id, 'original_name': orig, 'rows_count': rows_count, 'user_id': session.get('user_id')})
-    return jsonify({'ok': True, 'file': {'id': rec.id, 'original_name': rec.original_name, 'rows_count': rec.rows_count}})
+    append_audit('codes.allocate', {'kind': kind, 'count': count, 'first': codes[0], 'last': codes[-1], 'user_id': session.get('user_id')})
+    return jsonify({'ok': True, 'kind': kind, 'codes': codes})
 
+# POS: checkout, offline sync and product catalogue
+MAX_OFFLINE_SYNC_ORDERS = 1000
+
+@app.route('/pos')
+@login_required
+def pos_dashboard():
+    products = Product.query.filter_by(is_active=True).order_by(Product.name).all()
+    return render_template(
+        'pos_dashboard.html',
+        gym_name=get_gym_name(),
+        currency_code=get_setting('currency_code') or 'PKR',
+        primary_color=get_setting('pos_primary_color') or '#16a34a',
+        products=[p.to_dict() for p in products],
+    )
+
+@app.route('/pos/products')
+@login_required
+def pos_products_page():
+    products = Product.query.order_by(Product.created_at.desc()).all()
+    categories = sorted({p.category for p in products if p.category})
+    return render_template(
+        'product_management.html',
+        gym_name=get_gym_name(),
+        products=[p.to_dict() for p in products],
+        categories=categories,
+    )
+
+@app.route('/api/checkout', methods=['POST'])
+@login_required
+def api_checkout():
+    payload = request.get_json(silent=True) or {}
+    try:
+        sale, backup = _persist_sale(payload, session.get('user_id'))
+    except InsufficientStockError as e:
+        return jsonify({'ok': False, 'error': str(e), 'product_id': e.product_id, 'available': e.available}), 409
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    return jsonify({'ok': True, 'sale': sale.to_dict(include_items=True), 'backup': backup, 'snapshot': _calculate_sales_snapshot()})
+
+@app.route('/api/pos/summary', methods=['GET'])
+@login_required
+def api_pos_summary():
+    """Sales per day and best sellers for the last ``days`` days (default 30), read from the rollups."""
+    days = request.args.get('days', type=int) or 30
+    limit = request.args.get('limit', type=int) or 5
+    days = max(1, min(days, 3660))
+    limit = max(1, min(limit, 100))
+    today = datetime.now(timezone.utc).date()
+    series = sales_by_day(today - timedelta(days=days - 1), today)
+    return jsonify({
+        'ok': True,
+        'days': days,
+        'daily': series,
+        'total': round(sum(d['total'] for d in series), 2),
+        'count': sum(d['count'] for d in series),
+        'best_sellers': _best_selling_products(limit, days=days),
+        'snapshot': _calculate_sales_snapshot(),
+    })
+
+@app.route('/api/offline-sync', methods=['POST'])
+@login_required
+def api_offline_sync():
+    """Ingest sales queued while the POS was offline.
+
+    Body: ``{"orders": [...]}`` with each order shaped like a checkout
+    payload plus a client-assigned ``invoice_number``. Re-sending a batch
+    is safe: known invoice numbers come back as ``duplicate``.
+    """
+    payload = request.get_json(silent=True) or {}
+    orders = payload.get('orders')
+    if not isinstance(orders, list):
+        return jsonify({'ok': False, 'error': 'orders list required'}), 400
+    if len(orders) > MAX_OFFLINE_SYNC_ORDERS:
+        return jsonify({'ok': False, 'error': f'at most {MAX_OFFLINE_SYNC_ORDERS} orders per sync'}), 413
+    results = _persist_sales_batch(orders, session.get('user_id'))
+    counts = {status: sum(1 for r in results if r['status'] == status) for status in ('created', 'duplicate', 'rejected')}
+    return jsonify({'ok': True, 'synced': counts['created'], **counts, 'results': results})
+
+def _product_fields(data: dict, partial: bool = False) -> dict:
+    """Coerce product form/JSON input. Raises ValueError on bad values."""
+    out = {}
+    if 'name' in data or not partial:
+        name = (data.get('name') or '').strip()
+        if not name:
+            raise ValueError('name required')
+        out['name'] = name[:140]
+    for key, cast in (('price', float), ('stock', int)):
+        if key in data and data.get(key) not in (None, ''):
+            try:
+                out[key] = cast(float(data.get(key))) if cast is int else cast(data.get(key))
+            except (TypeError, ValueError):
+                raise ValueError(f'{key} must be a number')
+            if out[key] < 0:
+                raise ValueError(f'{key} cannot be negative')
+    for key, size in (('category', 80), ('sku', 60)):
+        if key in data:
+            out[key] = (str(data.get(key) or '').strip() or None)
+            if out[key]:
+                out[key] = out[key][:size]
+    if 'is_active' in data:
+        raw = data.get('is_active')
+        out['is_active'] = raw if isinstance(raw, bool) else str(raw).strip().lower() in ('1', 'true', 'yes', 'on')
+    return out
+
+def _sku_taken(sku: str | None, exclude_id: int | None = None) -> bool:
+    if not sku:
+        return False
+    q = Product.query.filter(Product.sku == sku)
+    if exclude_id:
+        q = q.filter(Product.id != exclude_id)
+    return db.session.query(q.exists()).scalar()
+
+@app.route('/api/products', methods=['GET'])
+@login_required
+def list_products():
+    q = Product.query
+    if request.args.get('active') in ('1', 'true'):
+        q = q.filter(Product.is_active.is_(True))
+    category = (request.args.get('category') or '').strip()
+    if category:
+        q = q.filter(func.lower(Product.category) == category.lower())
+    return jsonify([p.to_dict() for p in q.order_by(Product.name).all()])
+
+@app.route('/api/products', methods=['POST'])
+@login_required
+def create_product():
+    data = request.get_json(silent=True) or request.form.to_dict()
+    try:
+        fields = _product_fields(data)
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    if _sku_taken(fields.get('sku')):
+        return jsonify({'ok': False, 'error': 'SKU already exists'}), 409
+    p = Product(**fields)
+    db.session.add(p)
+    db.session.flush()
+    if p.stock:
+        _record_stock_movements([{'product_id': p.id, 'sale_id': None, 'delta': p.stock, 'stock_after': p.stock, 'reason': 'create', 'user_id': session.get('user_id')}])
+    db.session.commit()
+    append_audit('pos.product.create', {'product_id': p.id, 'name': p.name, 'user_id': session.get('user_id')})
+    return jsonify({'ok': True, 'product': p.to_dict()}), 201
+
+@app.route('/api/products/<int:product_id>', methods=['PUT'])
+@login_required
+def update_product(product_id):
+    p = Product.query.get_or_404(product_id)
+    data = request.get_json(silent=True) or {}
+    try:
+        fields = _product_fields(data, partial=True)
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    if _sku_taken(fields.get('sku'), exclude_id=p.id):
+        return jsonify({'ok': False, 'error': 'SKU already exists'}), 409
+    old_stock = p.stock
+    for key, value in fields.items():
+        setattr(p, key, value)
+    if 'stock' in fields and fields['stock'] != old_stock:
+        _record_stock_movements([{'product_id': p.id, 'sale_id': None, 'delta': fields['stock'] - (old_stock or 0), 'stock_after': fields['stock'], 'reason': 'adjust', 'user_id': session.get('user_id')}])
+    db.session.commit()
+    append_audit('pos.product.update', {'product_id': p.id, 'fields': sorted(fields), 'user_id': session.get('user_id')})
+    return jsonify({'ok': True, 'product': p.to_dict()})
+
+@app.route('/api/products/<int:product_id>', methods=['DELETE'])
+@login_required
+def delete_product(product_id):
+    p = Product.query.get_or_404(product_id)
+    # Products with sales history are hidden rather than deleted so receipts keep their link
+    if db.session.query(SaleItem.query.filter_by(product_id=p.id).exists()).scalar():
+        p.is_active = False
+        deactivated = True
+    else:
+        db.session.delete(p)
+        deactivated = False
+    db.session.commit()
+    append_audit('pos.product.delete', {'product_id': product_id, 'deactivated': deactivated, 'user_id': session.get('user_id')})
+    return jsonify({'ok': True, 'deactivated': deactivated})
+
+@app.route('/api/products/low-stock', methods=['GET'])
+@login_required
+def low_stock_products():
+    """Active products at or below ``threshold`` (default: setting pos_low_stock_threshold or 5).
+    Served by ix_product_active_stock, so it reads only the matching rows."""
+    try:
+        threshold = int(request.args.get('threshold') or get_setting('pos_low_stock_threshold') or 5)
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'threshold must be an integer'}), 400
+    rows = (
+        Product.query.filter(Product.is_active.is_(True), Product.stock <= threshold)
+        .order_by(Product.stock, Product.id)
+        .all()
+    )
+    return jsonify({'ok': True, 'threshold': threshold, 'products': [p.to_dict() for p in rows]})
+
+@app.route('/api/products/<int:product_id>/movements', methods=['GET'])
+@login_required
+def product_stock_movements(product_id):
+    Product.query.get_or_404(product_id)
+    try:
+        limit = min(max(int(request.args.get('limit') or 100), 1), 1000)
+    except ValueError:
+        limit = 100
+    rows = (
+        StockMovement.query.filter_by(product_id=product_id)
+        .order_by(StockMovement.id.desc())
+        .limit(limit)
+        .all()
+    )
+    return jsonify({'ok': True, 'movements': [m.to_dict() for m in rows]})
+
+@app.route('/api/products/import', methods=['POST'])
+@login_required
+def import_products():
+    """Bulk create/update products from CSV or Excel (columns: name, price, stock, category, sku).
+    Rows with a known SKU update that product; others are created."""
+    if 'file' not in request.files:
+        return jsonify({'ok': False, 'error': 'No file uploaded'}), 400
+    f = request.files['file']
+    fname_lower = (f.filename or '').lower()
+    try:
+        if fname_lower.endswith('.csv'):
+            df = pd.read_csv(f)
+        elif fname_lower.endswith(('.xlsx', '.xls', '.xltm')):
+            df = pd.read_excel(f, engine='openpyxl' if fname_lower.endswith(('.xlsx', '.xltm')) else None)
+        else:
+            return jsonify({'ok': False, 'error': 'Supported formats: CSV, Excel (.xlsx, .xls, .xltm)'}), 400
+    except Exception as e:
+        return jsonify({'ok': False, 'error': f'Failed to parse file: {str(e)}'}), 400
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    if 'name' not in df.columns:
+        return jsonify({'ok': False, 'error': 'name column required'}), 400
+    df = df.astype(object).where(pd.notna(df), None)
+    rows = df.to_dict(orient='records')
+    for r in rows:
+        # Excel hands numeric SKUs back as floats (1001.0)
+        if isinstance(r.get('sku'), float) and r['sku'].is_integer():
+            r['sku'] = int(r['sku'])
+        if r.get('sku') not in (None, ''):
+            r['sku'] = str(r['sku']).strip()
+    skus = {r['sku'] for r in rows if r.get('sku')}
+    by_sku = {p.sku: p for p in Product.query.filter(Product.sku.in_(skus)).all()} if skus else {}
+    created = updated = skipped = 0
+    errors = []
+    touched: dict[int, tuple[Product, int]] = {}  # id(obj) -> (product, stock before import)
+    for idx, row in enumerate(rows, start=2):
+        try:
+            fields = _product_fields({k: v for k, v in row.items() if k in ('name', 'price', 'stock', 'category', 'sku', 'is_active')})
+        except ValueError as e:
+            skipped += 1
+            errors.append(f'row {idx}: {e}')
+            continue
+        existing = by_sku.get(fields.get('sku')) if fields.get('sku') else None
+        if existing:
+            touched.setdefault(id(existing), (existing, existing.stock or 0))
+            for key, value in fields.items():
+                setattr(existing, key, value)
+            updated += 1
+        else:
+            p = Product(**fields)
+            db.session.add(p)
+            touched[id(p)] = (p, 0)
+            if p.sku:
+                by_sku[p.sku] = p
+            created += 1
+    db.session.flush()
+    _record_stock_movements([
+        {'product_id': p.id, 'sale_id': None, 'delta': (p.stock or 0) - before, 'stock_after': p.stock, 'reason': 'import', 'user_id': session.get('user_id')}
+        for p, before in touched.values()
+        if (p.stock or 0) != before
+    ])
+    db.session.commit()
+    append_audit('pos.product.import', {'created': created, 'updated': updated, 'skipped': skipped, 'user_id': session.get('user_id')})
+    return jsonify({'ok': True, 'created': created, 'updated': updated, 'skipped': skipped, 'errors': errors[:50]})
 
-# POS features removed
 
 @app.route('/fees')
 @login_required
@@ -1528,6 +4558,7 @@ def fees_page():
 
 @app.route('/api/fees', methods=['GET'])
 @login_required
+@etag_versioned('member', 'payment', 'payment_transaction', 'setting')
 def fees_api():
     try:
         year = int(request.args.get('year') or datetime.now().year)
@@ -1559,31 +4590,201 @@ def fees_remind():
     result = send_bulk_text_reminders(year, month)
     return jsonify(result)
 
+FEE_UNPAID, FEE_PAID, FEE_NA = 2, 1, 3
+FEE_STATUS_CODES = {'Paid': FEE_PAID, 'Unpaid': FEE_UNPAID, 'N/A': FEE_NA}
+FEE_STATUS_NAMES = {code: name for name, code in FEE_STATUS_CODES.items()}
+MONTH_ABBR = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June',
+               'July', 'August', 'September', 'October', 'November', 'December']
+
+
+def _fee_period(year: int, month: int) -> int:
+    return year * 12 + month - 1
+
+
+class DuesSnapshot:
+    """Dues for every member x month at one data version, as NumPy arrays.
+
+    ``status`` is a members x months int8 matrix (0 = no payment row, then
+    FEE_PAID/FEE_UNPAID/FEE_NA) spanning ``first``..``last`` (periods are
+    ``year * 12 + month - 1``); ``fee`` is each member's monthly fee
+    (member.monthly_fee, else the monthly_price setting). A month counts
+    towards arrears when it is Unpaid and not in the future.
+    """
+
+    def __init__(self, current: int, default_fee: float):
+        self.current = current
+        self.default_fee = default_fee
+        members = db.session.query(
+            Member.id, Member.name, Member.phone, Member.email, Member.admission_date,
+            Member.is_active, Member.monthly_fee, Member.referred_by,
+        ).order_by(Member.id).all()
+        self.ids = np.array([m.id for m in members], dtype=np.int64)
+        self.members = members
+        self.fee = pd.to_numeric(pd.Series([m.monthly_fee for m in members], dtype=object), errors='coerce') \
+            .fillna(default_fee).to_numpy(dtype=float)
+
+        pay = pd.DataFrame(
+            db.session.query(Payment.member_id, Payment.year, Payment.month, Payment.status).all(),
+            columns=['member_id', 'year', 'month', 'status'],
+        )
+        pay['period'] = pay['year'] * 12 + pay['month'] - 1
+        pay['code'] = pay['status'].map(FEE_STATUS_CODES).fillna(FEE_UNPAID).astype(np.int8)
+        self.first = int(min(pay['period'].min(), current)) if len(pay) else current
+        self.last = int(max(pay['period'].max(), current)) if len(pay) else current
+        n, width = len(self.ids), self.last - self.first + 1
+        self.status = np.zeros((n, width), dtype=np.int8)
+        rows = np.searchsorted(self.ids, pay['member_id'].to_numpy(np.int64))
+        known = rows < n
+        known[known] = self.ids[rows[known]] == pay['member_id'].to_numpy(np.int64)[known]
+        # Duplicate rows for a month: assign highest codes first so Paid wins
+        order = np.argsort(-pay['code'].to_numpy(), kind='stable')
+        order = order[known[order]]
+        self.status[rows[order], pay['period'].to_numpy(np.int64)[order] - self.first] = pay['code'].to_numpy()[order]
+
+        tx = pd.DataFrame(
+            db.session.query(PaymentTransaction.member_id, PaymentTransaction.plan_type, PaymentTransaction.year,
+                             PaymentTransaction.month, PaymentTransaction.amount, PaymentTransaction.created_at).all(),
+            columns=['member_id', 'plan_type', 'year', 'month', 'amount', 'created_at'],
+        )
+        tx = tx[tx['month'].notna()].copy()
+        tx['amount'] = pd.to_numeric(tx['amount'], errors='coerce').fillna(0.0)
+        tx['period'] = (tx['year'] * 12 + tx['month'] - 1).astype(np.int64)
+        # Latest payment per member/month (amount summed) and collected revenue per month
+        per_month = tx.groupby(['member_id', 'period']).agg(amount=('amount', 'sum'), paid_at=('created_at', 'max'))
+        self.payments = {key: (float(v.amount), v.paid_at) for key, v in zip(per_month.index, per_month.itertuples())}
+        monthly = tx[tx['plan_type'] == 'monthly'].groupby('period')['amount'].sum()
+        self.collected = {int(p): float(v) for p, v in monthly.items()}
+
+        # Vector stats over months up to now
+        due = self.status[:, :current - self.first + 1] == FEE_UNPAID
+        self.arrears_months = due.sum(axis=1)
+        self.arrears_amount = self.arrears_months * self.fee
+        # Current streak: trailing run of unpaid months ending this month
+        self.streak = np.cumprod(due[:, ::-1], axis=1).sum(axis=1) if due.shape[1] else np.zeros(n, dtype=int)
+        # Longest run anywhere: running count minus the count at the last paid/other month
+        runs = np.cumsum(due, axis=1)
+        self.longest_streak = (runs - np.maximum.accumulate(np.where(due, 0, runs), axis=1)).max(axis=1) \
+            if due.shape[1] else np.zeros(n, dtype=int)
+        paid = self.status == FEE_PAID
+        self.last_paid = np.where(paid.any(axis=1), self.last - np.argmax(paid[:, ::-1], axis=1), -1)
+        unpaid = self.status == FEE_UNPAID
+        self.paid_count = paid.sum(axis=0)
+        self.unpaid_count = unpaid.sum(axis=0)
+        self.unpaid_value = (unpaid * self.fee[:, None]).sum(axis=0)
+        self.expected = ((paid | unpaid) * self.fee[:, None]).sum(axis=0)
+
+    def _col(self, year: int, month: int) -> int | None:
+        p = _fee_period(year, month)
+        return p - self.first if self.first <= p <= self.last else None
+
+    def row(self, member_id: int) -> int | None:
+        i = int(np.searchsorted(self.ids, member_id))
+        return i if i < len(self.ids) and self.ids[i] == member_id else None
+
+    @staticmethod
+    def period_label(period: int, names=MONTH_ABBR) -> str | None:
+        return f"{names[period % 12]} {period // 12}" if period >= 0 else None
+
+    def month_summary(self, year: int, month: int) -> dict:
+        col = self._col(year, month)
+        if col is None:
+            return {'paid_count': 0, 'unpaid_count': 0, 'expected': 0.0, 'unpaid_total': 0.0,
+                    'collected': self.collected.get(_fee_period(year, month), 0.0)}
+        return {
+            'paid_count': int(self.paid_count[col]),
+            'unpaid_count': int(self.unpaid_count[col]),
+            'expected': float(self.expected[col]),
+            'unpaid_total': float(self.unpaid_value[col]),
+            'collected': self.collected.get(_fee_period(year, month), 0.0),
+        }
+
+    def month_rows(self, year: int, month: int, status: int | None = None) -> list[int]:
+        """Member rows with a payment row for the month (optionally one status)."""
+        col = self._col(year, month)
+        if col is None:
+            return []
+        column = self.status[:, col]
+        return np.flatnonzero(column == status if status else column > 0).tolist()
+
+    def member_summary(self, i: int) -> dict:
+        return {
+            'monthly_fee': float(self.fee[i]),
+            'months_unpaid': int(self.arrears_months[i]),
+            'total_due': round(float(self.arrears_amount[i]), 2),
+            'consecutive_unpaid': int(self.streak[i]),
+            'longest_unpaid_streak': int(self.longest_streak[i]),
+            'last_paid_month': self.period_label(int(self.last_paid[i])),
+        }
+
+    def revenue(self, start: int, end: int) -> list[dict]:
+        out = []
+        for p in range(start, end + 1):
+            col = p - self.first
+            inside = 0 <= col < self.status.shape[1]
+            expected = float(self.expected[col]) if inside else 0.0
+            collected = self.collected.get(p, 0.0)
+            out.append({
+                'year': p // 12, 'month': p % 12 + 1,
+                'expected': round(expected, 2), 'collected': round(collected, 2),
+                'outstanding': round(float(self.unpaid_value[col]), 2) if inside and p <= self.current else 0.0,
+                'paid_count': int(self.paid_count[col]) if inside else 0,
+                'unpaid_count': int(self.unpaid_count[col]) if inside else 0,
+            })
+        return out
+
+
+class DuesEngine:
+    """Caches one DuesSnapshot per data version of the fee tables.
+
+    Every fee endpoint reads from the snapshot; it is rebuilt when a
+    member, payment, transaction or setting changes (or the month rolls
+    over), so the matrix is built once per change instead of per request.
+    The head of the change log is part of the key as well, so writers that
+    only append to it (older desktop/CLI copies) still invalidate it.
+    """
+    TABLES = ('member', 'payment', 'payment_transaction', 'setting')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._key = None
+
+    def snapshot(self) -> DuesSnapshot:
+        now = datetime.now()
+        head = db.session.query(func.max(ChangeLog.seq)).scalar() or 0
+        key = (get_data_versions(self.TABLES), head, _fee_period(now.year, now.month))
+        if self._snapshot is not None and self._key == key:
+            return self._snapshot
+        with self._lock:
+            if self._snapshot is None or self._key != key:
+                try:
+                    default_fee = float(get_setting('monthly_price') or '8')
+                except Exception:
+                    default_fee = 8.0
+                self._snapshot = DuesSnapshot(key[2], default_fee)
+                self._key = key
+            return self._snapshot
+
+    def invalidate(self) -> None:
+        self._key = None
+
+
+dues_engine = DuesEngine()
+
+
 @app.route('/api/fees/summary', methods=['GET'])
 @login_required
+@etag_versioned('member', 'payment', 'payment_transaction', 'setting')
 def fees_summary():
     try:
         year = int(request.args.get('year') or datetime.now().year)
         month = int(request.args.get('month') or datetime.now().month)
     except ValueError:
         return jsonify({"error": "invalid year/month"}), 400
-    paid_count = Payment.query.filter_by(year=year, month=month, status='Paid').count()
-    unpaid_count = Payment.query.filter_by(year=year, month=month, status='Unpaid').count()
+    summary = dues_engine.snapshot().month_summary(year, month)
+    paid_count, unpaid_count = summary['paid_count'], summary['unpaid_count']
     total_members = paid_count + unpaid_count
-    # Monthly price from settings
-    try:
-        monthly_price = float(get_setting('monthly_price') or '8')
-    except Exception:
-        monthly_price = 8.0
-    # Sum of recorded monthly transactions for the given month/year (no fallback)
-    tx_sum = db.session.query(func.coalesce(func.sum(PaymentTransaction.amount), 0.0)).filter(
-        PaymentTransaction.plan_type == 'monthly',
-        PaymentTransaction.year == year,
-        PaymentTransaction.month == month
-    ).scalar() or 0.0
-    # Use transactions only for paid_total (no fallback)
-    paid_total = float(tx_sum)
-    unpaid_total = float(unpaid_count * monthly_price)
     payment_percent = float((paid_count / total_members) * 100.0) if total_members else 0.0
     return jsonify({
         'ok': True,
@@ -1591,13 +4792,17 @@ def fees_summary():
         'month': month,
         'paid_count': paid_count,
         'unpaid_count': unpaid_count,
-        'paid_total': round(paid_total, 2),
-        'unpaid_total': round(unpaid_total, 2),
+        # Recorded monthly transactions only (no fallback)
+        'paid_total': round(summary['collected'], 2),
+        # Each unpaid member's own fee (monthly_fee, else the monthly_price setting)
+        'unpaid_total': round(summary['unpaid_total'], 2),
+        'expected_total': round(summary['expected'], 2),
         'payment_percent': round(payment_percent, 2),
     })
 
 @app.route('/api/fees/month', methods=['GET'])
 @login_required
+@etag_versioned('member', 'payment', 'payment_transaction', 'setting')
 def fees_month_detail():
     try:
         year = int(request.args.get('year') or datetime.now().year)
@@ -1605,37 +4810,30 @@ def fees_month_detail():
     except ValueError:
         return jsonify({"ok": False, "error": "invalid year/month"}), 400
     
-    payments = Payment.query.filter_by(year=year, month=month).all()
-    paid_count = sum(1 for p in payments if p.status == 'Paid')
-    unpaid_count = sum(1 for p in payments if p.status == 'Unpaid')
-    
     try:
         currency = get_setting('currency_code') or 'PKR'
     except Exception:
         currency = 'PKR'
     
+    snap = dues_engine.snapshot()
+    period = _fee_period(year, month)
+    col = period - snap.first
     collected = 0.0
     members_data = []
-    
-    for p in payments:
-        member = db.session.get(Member, p.member_id)
-        if not member:
-            continue
-        
-        amount = 0.0
-        paid_date = None
-        
-        if p.status == 'Paid':
-            tx = PaymentTransaction.query.filter_by(
-                member_id=member.id,
-                year=year,
-                month=month
-            ).order_by(PaymentTransaction.created_at.desc()).first()
-            if tx:
-                amount = tx.amount or 0.0
-                paid_date = tx.created_at.strftime('%Y-%m-%d') if tx.created_at else None
+    paid_count = unpaid_count = 0
+    for i in snap.month_rows(year, month):
+        member = snap.members[i]
+        status = FEE_STATUS_NAMES[int(snap.status[i, col])]
+        amount, paid_date = 0.0, None
+        if status == 'Paid':
+            paid_count += 1
+            amt, paid_at = snap.payments.get((member.id, period), (None, None))
+            if amt is not None:
+                amount = amt
+                paid_date = paid_at.strftime('%Y-%m-%d') if paid_at is not None else None
                 collected += amount
-        
+        elif status == 'Unpaid':
+            unpaid_count += 1
         members_data.append({
             'member_id': member.id,
             'name': member.name,
@@ -1643,7 +4841,7 @@ def fees_month_detail():
             'email': member.email,
             'admission_date': member.admission_date.strftime('%Y-%m-%d') if member.admission_date else None,
             'is_active': member.is_active,
-            'status': p.status,
+            'status': status,
             'amount': amount,
             'paid_date': paid_date
         })
@@ -1661,101 +4859,68 @@ def fees_month_detail():
 
 @app.route('/api/fees/unpaid-summary', methods=['GET'])
 @login_required
+@etag_versioned('member', 'payment', 'payment_transaction', 'setting')
 def fees_unpaid_summary():
-    now = datetime.now()
-    current_year = now.year
-    current_month = now.month
-    
-    try:
-        monthly_price = float(get_setting('monthly_price') or '8')
-    except Exception:
-        monthly_price = 8.0
-    
-    members = Member.query.all()
-    unpaid_members = []
-    
-    for member in members:
-        # Find all unpaid payments
-        unpaid_payments = Payment.query.filter_by(
-            member_id=member.id,
-            status='Unpaid'
-        ).order_by(Payment.year.desc(), Payment.month.desc()).all()
-        
-        if not unpaid_payments:
-            continue
-        
-        months_unpaid = len(unpaid_payments)
-        total_due = months_unpaid * monthly_price
-        
-        # Find last paid month
-        last_paid = Payment.query.filter_by(
-            member_id=member.id,
-            status='Paid'
-        ).order_by(Payment.year.desc(), Payment.month.desc()).first()
-        
-        last_paid_month = None
-        if last_paid:
-            month_names = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-            last_paid_month = f"{month_names[last_paid.month - 1]} {last_paid.year}"
-        
+    """Members in arrears: unpaid months up to the current one, due at each member's fee."""
+    snap = dues_engine.snapshot()
+    unpaid_members = []
+    for i in np.flatnonzero(snap.arrears_months > 0).tolist():
+        member = snap.members[i]
         unpaid_members.append({
             'id': member.id,
             'name': member.name,
             'phone': member.phone,
-            'last_paid_month': last_paid_month,
-            'months_unpaid': months_unpaid,
-            'total_due': round(total_due, 2)
+            'is_active': member.is_active,
+            **snap.member_summary(i),
         })
-    
     return jsonify({
         'ok': True,
-        'members': unpaid_members
+        'members': unpaid_members,
+        'total_due': round(float(snap.arrears_amount.sum()), 2),
+    })
+
+@app.route('/api/fees/revenue', methods=['GET'])
+@login_required
+@etag_versioned('member', 'payment', 'payment_transaction', 'setting')
+def fees_revenue():
+    """Expected vs collected revenue per month (``?months=12`` back from this month)."""
+    try:
+        months = min(max(int(request.args.get('months') or 12), 1), 120)
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'invalid months'}), 400
+    snap = dues_engine.snapshot()
+    rows = snap.revenue(snap.current - months + 1, snap.current)
+    return jsonify({
+        'ok': True,
+        'months': rows,
+        'expected_total': round(sum(r['expected'] for r in rows), 2),
+        'collected_total': round(sum(r['collected'] for r in rows), 2),
+        'outstanding_total': round(sum(r['outstanding'] for r in rows), 2),
     })
 
 @app.route('/api/member/<int:member_id>/payment-history', methods=['GET'])
 @login_required
 def member_payment_history(member_id):
-    member = db.session.get(Member, member_id)
-    if not member:
+    snap = dues_engine.snapshot()
+    i = snap.row(member_id)
+    if i is None:
         return jsonify({'ok': False, 'error': 'Member not found'}), 404
-    
-    payments = Payment.query.filter_by(member_id=member_id).order_by(
-        Payment.year.desc(),
-        Payment.month.desc()
-    ).all()
-    
-    # Find last paid month
-    last_paid = None
-    for p in payments:
-        if p.status == 'Paid':
-            month_names = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-            last_paid = f"{month_names[p.month - 1]} {p.year}"
-            break    
-    months_unpaid = sum(1 for p in payments if p.status == 'Unpaid')
+    member = snap.members[i]
+    summary = snap.member_summary(i)
     
     payment_list = []
-    month_names = ['January', 'February', 'March', 'April', 'May', 'June', 
-                   'July', 'August', 'September', 'October', 'November', 'December']
-    
-    for p in payments:
-        amount = None
-        paid_date = None
-        
-        if p.status == 'Paid':
-            tx = PaymentTransaction.query.filter_by(
-                member_id=member.id,
-                year=p.year,
-                month=p.month
-            ).order_by(PaymentTransaction.created_at.desc()).first()
-            if tx:
-                amount = tx.amount
-                paid_date = tx.created_at.strftime('%Y-%m-%d') if tx.created_at else None
-        
+    for col in np.flatnonzero(snap.status[i])[::-1].tolist():
+        period = snap.first + col
+        status = FEE_STATUS_NAMES[int(snap.status[i, col])]
+        amount, paid_date = None, None
+        if status == 'Paid':
+            amount, paid_at = snap.payments.get((member.id, period), (None, None))
+            paid_date = paid_at.strftime('%Y-%m-%d') if paid_at is not None else None
         payment_list.append({
-            'year': p.year,
-            'month': p.month,
-            'month_name': month_names[p.month - 1],
-            'status': p.status,
+            'year': period // 12,
+            'month': period % 12 + 1,
+            'month_name': MONTH_NAMES[period % 12],
+            'status': status,
             'amount': amount,
             'paid_date': paid_date
         })
@@ -1767,165 +4932,189 @@ def member_payment_history(member_id):
             'name': member.name,
             'phone': member.phone,
             'email': member.email,
-            'cnic': member.cnic,
-            'address': member.address,
-            'gender': member.gender,
-            'date_of_birth': member.date_of_birth.strftime('%Y-%m-%d') if member.date_of_birth else None,
             'admission_date': member.admission_date.strftime('%Y-%m-%d') if member.admission_date else None,
-            'monthly_price': float(member.monthly_price) if member.monthly_price else 0,
+            'monthly_price': summary['monthly_fee'],
             'referred_by': member.referred_by,
             'is_active': member.is_active,
-            'notes': member.notes
         },
-        'last_paid_month': last_paid,
-        'months_unpaid': months_unpaid,
+        'last_paid_month': summary['last_paid_month'],
+        'months_unpaid': summary['months_unpaid'],
+        'total_due': summary['total_due'],
+        'consecutive_unpaid': summary['consecutive_unpaid'],
         'payments': payment_list,
-        'currency': member.currency or 'PKR'
+        'currency': get_setting('currency_code') or 'PKR'
     })
 
-@app.route('/api/payment/pay-now', methods=['POST'])
-@login_required
-def api_payment_pay_now():
-    payload = request.get_json(silent=True) or {}
-    try:
-        member_id = int(payload.get('member_id') or 0)
-    except Exception:
-        return jsonify({'ok': False, 'error': 'member_id required'}), 400
-    year = int(payload.get('year') or datetime.now().year)
-    month = int(payload.get('month') or datetime.now().month)
-    method = (payload.get('method') or 'cash').strip()
-
-    member = db.session.get(Member, member_id)
-    if not member:
-        return jsonify({'ok': False, 'error': 'Member not found'}), 404
-
-    # Derive amount
-    amount = None
-    if payload.get('amount') is not None:
-        try:
-            amount = float(payload['amount'])
-        except Exception:
-            amount = None
-    if amount is None:
-        try:
-            mf = getattr(member, 'monthly_fee', None)
-            amount = float(mf) if mf not in (None, '') else None
-        except Exception:
-            amount = None
-    if amount is None:
+def _resolve_fee_amount(member: Member, raw) -> float:
+    # Amount resolve: explicit -> member.monthly_fee -> global monthly_price
+    if raw is not None:
         try:
-            amount = float(get_setting('monthly_price') or 0)
+            return float(raw)
         except Exception:
-            amount = 0.0
+            pass
+    try:
+        mf = getattr(member, 'monthly_fee', None)
+        if mf not in (None, ''):
+            return float(mf)
+    except Exception:
+        pass
+    try:
+        return float(get_setting('monthly_price') or 0)
+    except Exception:
+        return 0.0
 
-    # Ensure monthly Payment exists
-    p = Payment.query.filter_by(member_id=member_id, year=year, month=month).first()
+def _pay_month(member: Member, year: int, month: int, method: str, amount, user_id=None):
+    """Mark a month Paid and record its transaction. Flushes, does not commit."""
+    p = Payment.query.filter_by(member_id=member.id, year=year, month=month).first()
     if not p:
-        p = Payment(member_id=member_id, year=year, month=month, status='Unpaid')
+        p = Payment(member_id=member.id, year=year, month=month, status='Unpaid')
         db.session.add(p)
-        db.session.flush()
-
-    # Create transaction
-    try:
-        user_id = session.get('user_id')
-    except Exception:
-        user_id = None
     tx = PaymentTransaction(
-        member_id=member_id,
+        member_id=member.id,
         user_id=user_id,
         plan_type=getattr(member, 'plan_type', 'monthly') or 'monthly',
         year=year,
         month=month,
-        amount=amount,
+        amount=_resolve_fee_amount(member, amount),
         method=method,
     )
     db.session.add(tx)
     p.status = 'Paid'
-    db.session.commit()
-
-    currency = get_setting('currency_code') or 'PKR'
-    return jsonify({
-        'ok': True,
-        'transaction_id': tx.id,
-        'receipt_url': url_for('receipt_view', tx_id=tx.id),
-        'amount': amount,
-        'currency': currency,
-    })
-
+    db.session.flush()
+    return p, tx
 
-@app.route('/api/fees/mark-paid', methods=['POST'])
-@login_required
-def api_fees_mark_paid():
-    """Compatibility endpoint that records payment and returns a receipt URL.
-    Accepts JSON: { member_id, month, year, method?, amount? }
-    """
-    payload = request.get_json(silent=True) or {}
+def _parse_pay_payload(payload: dict):
+    """Validate a pay-now/mark-paid body. Returns (member, year, month, method) or an error string."""
     try:
         member_id = int(payload.get('member_id') or 0)
+        year = int(payload.get('year') or datetime.now().year)
+        month = int(payload.get('month') or datetime.now().month)
     except Exception:
-        return jsonify({'ok': False, 'error': 'member_id required'}), 400
-    year = int(payload.get('year') or datetime.now().year)
-    month = int(payload.get('month') or datetime.now().month)
-    method = (payload.get('method') or 'cash').strip()
-
+        return 'member_id required'
+    if not 1 <= month <= 12:
+        return 'month must be 1-12'
     member = db.session.get(Member, member_id)
     if not member:
-        return jsonify({'ok': False, 'error': 'Member not found'}), 404
-
-    # Amount resolve: explicit -> member.monthly_fee -> global monthly_price
-    amount = None
-    if payload.get('amount') is not None:
-        try:
-            amount = float(payload['amount'])
-        except Exception:
-            amount = None
-    if amount is None:
-        try:
-            mf = getattr(member, 'monthly_fee', None)
-            amount = float(mf) if mf not in (None, '') else None
-        except Exception:
-            amount = None
-    if amount is None:
-        try:
-            amount = float(get_setting('monthly_price') or 0)
-        except Exception:
-            amount = 0.0
-
-    # Ensure monthly Payment exists
-    p = Payment.query.filter_by(member_id=member_id, year=year, month=month).first()
-    if not p:
-        p = Payment(member_id=member_id, year=year, month=month, status='Unpaid')
-        db.session.add(p)
-        db.session.flush()
+        return 'Member not found'
+    method = (payload.get('method') or 'cash').strip()
+    return member, year, month, method
 
-    # Create transaction
+def _pay_now_response(payload: dict, **extra):
+    parsed = _parse_pay_payload(payload)
+    if isinstance(parsed, str):
+        return jsonify({'ok': False, 'error': parsed}), (404 if parsed == 'Member not found' else 400)
+    member, year, month, method = parsed
     try:
         user_id = session.get('user_id')
     except Exception:
         user_id = None
-    tx = PaymentTransaction(
-        member_id=member_id,
-        user_id=user_id,
-        plan_type=getattr(member, 'plan_type', 'monthly') or 'monthly',
-        year=year,
-        month=month,
-        amount=amount,
-        method=method,
-    )
-    db.session.add(tx)
-    p.status = 'Paid'
+    p, tx = _pay_month(member, year, month, method, payload.get('amount'), user_id)
     db.session.commit()
+    publish_events([_payment_event(p), _transaction_event(tx)])
 
     currency = get_setting('currency_code') or 'PKR'
     return jsonify({
         'ok': True,
-        'message': 'Payment processed and receipt generated.',
+        **extra,
         'transaction_id': tx.id,
         'receipt_url': url_for('receipt_view', tx_id=tx.id),
-        'amount': amount,
+        'amount': tx.amount,
         'currency': currency,
     })
 
+@app.route('/api/payment/pay-now', methods=['POST'])
+@login_required
+def api_payment_pay_now():
+    return _pay_now_response(request.get_json(silent=True) or {})
+
+
+@app.route('/api/fees/mark-paid', methods=['POST'])
+@login_required
+def api_fees_mark_paid():
+    """Compatibility endpoint that records payment and returns a receipt URL.
+    Accepts JSON: { member_id, month, year, method?, amount? }
+    """
+    return _pay_now_response(request.get_json(silent=True) or {}, message='Payment processed and receipt generated.')
+
+MAX_BATCH_OPS = 1000
+
+def _apply_queued_op(kind: str, payload: dict, user_id, events: list) -> dict:
+    """Apply one outbox op inside the caller's transaction. Raises ValueError to reject."""
+    if kind == 'payment.pay':
+        parsed = _parse_pay_payload(payload)
+        if isinstance(parsed, str):
+            raise ValueError(parsed)
+        member, year, month, method = parsed
+        p, tx = _pay_month(member, year, month, method, payload.get('amount'), user_id)
+        append_audit('payment.txn.monthly', {'member_id': member.id, 'year': year, 'month': month, 'amount': tx.amount, 'method': method, 'user_id': user_id, 'queued': True}, commit=False)
+        events.extend([_payment_event(p), _transaction_event(tx)])
+        return {'transaction_id': tx.id, 'receipt_url': url_for('receipt_view', tx_id=tx.id)}
+    if kind == 'payment.update':
+        status = payload.get('status')
+        if status not in ('Paid', 'Unpaid', 'N/A'):
+            raise ValueError('status must be Paid, Unpaid or N/A')
+        p = db.session.get(Payment, int(payload.get('payment_id') or 0))
+        if not p:
+            raise ValueError('Payment not found')
+        p.status = status
+        db.session.flush()
+        append_audit('payment.update', {'payment_id': p.id, 'status': status, 'user_id': user_id, 'queued': True}, commit=False)
+        events.append(_payment_event(p))
+        return {'payment_id': p.id}
+    raise ValueError(f'unsupported op type: {kind}')
+
+@app.route('/api/ops/batch', methods=['POST'])
+@login_required
+def api_ops_batch():
+    """Ingest operations queued offline by the PWA.
+
+    Body: ``{"ops": [{"op_id", "type", "payload"}, ...]}`` in the order they
+    were made. Ops are applied in order in a single transaction; each runs
+    in a savepoint so a rejected op (e.g. member since deleted) is reported
+    without undoing the rest. Every op_id is remembered, so replays after a
+    dropped response return ``duplicate`` instead of paying twice.
+    """
+    body = request.get_json(silent=True) or {}
+    ops = body.get('ops')
+    if not isinstance(ops, list):
+        return jsonify({'ok': False, 'error': 'ops list required'}), 400
+    if len(ops) > MAX_BATCH_OPS:
+        return jsonify({'ok': False, 'error': f'at most {MAX_BATCH_OPS} ops per batch'}), 413
+    for op in ops:
+        if not isinstance(op, dict) or not str(op.get('op_id') or '').strip() or len(str(op['op_id'])) > 64:
+            return jsonify({'ok': False, 'error': 'every op needs an op_id (max 64 chars)'}), 400
+    op_ids = [str(op['op_id']) for op in ops]
+    seen = {
+        row.op_id: row
+        for row in AppliedOp.query.filter(AppliedOp.op_id.in_(set(op_ids))).all()
+    } if op_ids else {}
+    user_id = session.get('user_id')
+    results, events = [], []
+    for op, op_id in zip(ops, op_ids):
+        kind = str(op.get('type') or '')
+        if op_id in seen:
+            prior = seen[op_id]
+            results.append({'op_id': op_id, 'status': 'duplicate', 'ok': bool(prior.ok), **json.loads(prior.result_json or '{}')})
+            continue
+        pending = []
+        try:
+            # The op and its replay guard are released (or rolled back) together
+            with db.session.begin_nested():
+                result = _apply_queued_op(kind, op.get('payload') or {}, user_id, pending)
+                rec = AppliedOp(op_id=op_id, kind=kind[:40] or 'unknown', ok=True, result_json=json.dumps(result))
+                db.session.add(rec)
+            ok = True
+            events.extend(pending)
+        except (ValueError, TypeError) as e:
+            result, ok = {'error': str(e)}, False
+            rec = AppliedOp(op_id=op_id, kind=kind[:40] or 'unknown', ok=False, result_json=json.dumps(result))
+            db.session.add(rec)
+        seen[op_id] = rec
+        results.append({'op_id': op_id, 'status': 'applied' if ok else 'rejected', 'ok': ok, **result})
+    db.session.commit()
+    publish_events(events)
+    return jsonify({'ok': True, 'results': results})
+
 
 def _render_receipt_context(tx: PaymentTransaction):
     member = db.session.get(Member, tx.member_id)
@@ -2028,12 +5217,10 @@ def send_bulk_template_reminders(year: int, month: int) -> dict:
     lang = os.getenv('WHATSAPP_TEMPLATE_LANG', 'en')
     if not template_name:
         return {"ok": False, "error": "WHATSAPP_TEMPLATE_FEE_REMINDER_NAME not set"}
-    unpaid = Payment.query.filter_by(year=year, month=month, status='Unpaid').all()
+    snap = dues_engine.snapshot()
     sent, failed = 0, 0
-    for p in unpaid:
-        m = db.session.get(Member, p.member_id)
-        if not m:
-            continue
+    for i in snap.month_rows(year, month, FEE_UNPAID):
+        m = snap.members[i]
         phone = _normalize_phone(m.phone or '')
         if not phone:
             failed += 1
@@ -2161,6 +5348,11 @@ def upload_members_csv():
     skipped = 0
     errors = []
     
+    # One counter bump for the whole file instead of one per new member,
+    # committed on its own so a failing row cannot roll the reservation back
+    # while later rows (or other writers) still hand out the same codes
+    new_referral_codes = deque(referral_codes(len(df))) if len(df) else deque()
+    db.session.commit()
     for idx, row in df.iterrows():
         try:
             # Extract data using smart mapping
@@ -2267,7 +5459,7 @@ def upload_members_csv():
                 'admission_date': admission_date,
                 'plan_type': plan_type,
                 'access_tier': access_tier,
-                'referral_code': _gen_referral_code()
+                'referral_code': new_referral_codes.popleft()
             }
             
             # Add is_active if Member model has this field
@@ -2277,6 +5469,7 @@ def upload_members_csv():
             m = Member(**member_data)
             db.session.add(m)
             db.session.commit()
+            member_suggest_index.upsert(m.id, m.name, m.phone)
 
             # Create payment records
             for mm in range(1, 12 + 1):
@@ -2286,6 +5479,7 @@ def upload_members_csv():
             created += 1
             
         except Exception as e:
+            db.session.rollback()
             errors.append(f"Row {idx + 2}: {str(e)}")
             skipped += 1
             continue
@@ -2312,14 +5506,17 @@ def upload_members_csv():
     return jsonify(response)
 
 # WhatsApp Cloud API helper
-def _normalize_phone(phone: str) -> str:
+def _default_country_code() -> str:
+    # Prefer DB setting, fallback to env, default Pakistan '92'
+    return (get_setting('whatsapp_default_country_code') or os.getenv('WHATSAPP_DEFAULT_COUNTRY_CODE') or '92')
+
+def _normalize_phone(phone: str, country_code: str | None = None) -> str:
     if not phone:
         return ''
     phone = phone.strip()
     if phone.startswith('+'):
         return phone
-    # Prefer DB setting, fallback to env, default Pakistan '92'
-    cc = (get_setting('whatsapp_default_country_code') or os.getenv('WHATSAPP_DEFAULT_COUNTRY_CODE') or '92')
+    cc = country_code if country_code is not None else _default_country_code()
     if cc and not phone.startswith(cc):
         if not cc.startswith('+'):
             cc = '+' + cc
@@ -2354,21 +5551,20 @@ def send_whatsapp_message(to_phone: str, text: str) -> tuple[bool, str]:
     return ok, (data if ok else f"{r.status_code}: {data}")
 
 def send_bulk_text_reminders(year: int, month: int) -> dict:
-    unpaid = Payment.query.filter_by(year=year, month=month, status='Unpaid').all()
+    snap = dues_engine.snapshot()
     sent, failed = 0, 0
-    price = (get_setting('monthly_price') or '8')
     currency = (get_setting('currency_code') or 'USD')
     gym = get_gym_name()
-    default_msg = f"Hi {member.name}, your {gym} fee ({price} {currency}) for {month}/{year} may be due. Please pay if pending."
-    for p in unpaid:
-        member = db.session.get(Member, p.member_id)
-        if not member:
-            continue
+    for i in snap.month_rows(year, month, FEE_UNPAID):
+        member = snap.members[i]
         phone = _normalize_phone(member.phone or '')
         if not phone:
             failed += 1
             continue
+        price = f"{snap.fee[i]:g}"
         msg = f"Hi {member.name}, your {gym} fee ({price} {currency}) for {month}/{year} is pending. Please pay to stay active."
+        if snap.arrears_months[i] > 1:
+            msg += f" Total outstanding: {snap.arrears_amount[i]:g} {currency} for {int(snap.arrears_months[i])} months."
         ok, _ = send_whatsapp_message(phone, msg)
         if ok:
             sent += 1
@@ -2575,10 +5771,8 @@ def _build_backup_zip_bytes() -> tuple[bool, bytes, str]:
 def _save_backup_local(content: bytes, ts: str) -> tuple[bool, str]:
     try:
         fname = f"backup_{ts}.zip"
-        path = os.path.join(BACKUP_DIR, fname)
-        with open(path, 'wb') as f:
-            f.write(content)
-        return True, path
+        backup_store.put_bytes(fname, content, 'application/zip')
+        return True, backup_store.describe(fname)
     except Exception as e:
         return False, str(e)
 
@@ -2639,20 +5833,19 @@ def perform_automatic_backup() -> dict:
 def cleanup_old_backups(keep_count: int = 30) -> None:
     """Remove old backups, keeping only the most recent ones."""
     try:
-        backups = []
-        for fname in os.listdir(BACKUP_DIR):
-            if fname.startswith('backup_') and fname.endswith('.zip'):
-                fpath = os.path.join(BACKUP_DIR, fname)
-                backups.append((os.path.getmtime(fpath), fpath))
+        backups = [
+            (obj.modified, obj.key) for obj in backup_store.list('backup_')
+            if '/' not in obj.key and obj.key.endswith('.zip')
+        ]
         
         # Sort by modification time (oldest first)
         backups.sort()
         
         # Remove old backups
         if len(backups) > keep_count:
-            for _, fpath in backups[:-keep_count]:
+            for _, key in backups[:-keep_count]:
                 try:
-                    os.remove(fpath)
+                    backup_store.delete(key)
                 except Exception:
                     pass
     except Exception:
@@ -2669,11 +5862,11 @@ def _upload_backup_to_gdrive(content: bytes, filename: str, mime: str = 'applica
     if not folder_id:
         return False, 'DRIVE_FOLDER_ID not set'
     try:
-        creds = service_account.Credentials.from_service_account_file(sa_file, scopes=['https://www.googleapis.com/auth/drive.file'])
-        drive = build('drive', 'v3', credentials=creds)
+        drive = _google_client('drive', 'v3', 'https://www.googleapis.com/auth/drive.file', sa_file)
         media = MediaIoBaseUpload(BytesIO(content), mimetype=mime, resumable=False)
         metadata = {'name': filename, 'parents': [folder_id]}
-        file = drive.files().create(body=metadata, media_body=media, fields='id,webViewLink,webContentLink').execute()
+        with _google_client_lock:
+            file = drive.files().create(body=metadata, media_body=media, fields='id,webViewLink,webContentLink').execute()
         return True, file
     except Exception as e:
         return False, str(e)
@@ -2722,15 +5915,14 @@ def list_backups():
     """List all available backups."""
     try:
         backups = []
-        for fname in os.listdir(BACKUP_DIR):
-            if fname.startswith('backup_') and fname.endswith('.zip'):
-                fpath = os.path.join(BACKUP_DIR, fname)
-                stat = os.stat(fpath)
+        for obj in backup_store.list('backup_'):
+            if '/' not in obj.key and obj.key.endswith('.zip'):
+                ts = obj.modified.timestamp()
                 backups.append({
-                    'filename': fname,
-                    'size': stat.st_size,
-                    'created': datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                    'timestamp': stat.st_mtime
+                    'filename': obj.key,
+                    'size': obj.size,
+                    'created': datetime.fromtimestamp(ts).isoformat(),
+                    'timestamp': ts
                 })
         
         # Sort by timestamp (newest first)
@@ -2751,17 +5943,15 @@ def list_backups():
 def restore_backup(filename):
     """Restore from a specific backup file."""
     try:
-        fpath = os.path.join(BACKUP_DIR, filename)
-        if not os.path.exists(fpath) or not filename.startswith('backup_'):
+        if not filename.startswith('backup_') or not backup_store.exists(filename):
             return jsonify({'ok': False, 'error': 'Invalid backup file'}), 404
         
         # Extract and restore database
-        with zipfile.ZipFile(fpath, 'r') as z:
+        with backup_store.local_path(filename) as fpath, zipfile.ZipFile(fpath, 'r') as z:
             if 'gym.db' in z.namelist():
                 # Backup current DB first
                 current_backup = db_path + '.before_restore'
                 if os.path.exists(db_path):
-                    import shutil
                     shutil.copy2(db_path, current_backup)
                 
                 # Extract and replace
@@ -2788,11 +5978,10 @@ def restore_backup(filename):
 def delete_backup(filename):
     """Delete a specific backup file."""
     try:
-        fpath = os.path.join(BACKUP_DIR, filename)
-        if not os.path.exists(fpath) or not filename.startswith('backup_'):
+        if not filename.startswith('backup_') or not backup_store.exists(filename):
             return jsonify({'ok': False, 'error': 'Invalid backup file'}), 404
         
-        os.remove(fpath)
+        backup_store.delete(filename)
         append_audit('backup.deleted', {'filename': filename})
         
         return jsonify({'ok': True, 'message': f'Backup {filename} deleted'})
@@ -2805,16 +5994,10 @@ def delete_backup(filename):
 def download_specific_backup(filename):
     """Download a specific backup file."""
     try:
-        fpath = os.path.join(BACKUP_DIR, filename)
-        if not os.path.exists(fpath) or not filename.startswith('backup_'):
+        if not filename.startswith('backup_') or not backup_store.exists(filename):
             return jsonify({'ok': False, 'error': 'Invalid backup file'}), 404
         
-        return send_file(
-            fpath,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=filename
-        )
+        return send_stored(backup_store, filename, download_name=filename, mimetype='application/zip')
     except Exception as e:
         return jsonify({'ok': False, 'error': str(e)}), 500
 
@@ -2885,6 +6068,19 @@ def admin_login_logs():
     return jsonify(logs)
 
 
+@app.route('/api/admin/sales/verify', methods=['GET', 'POST'])
+@admin_required
+def admin_verify_sales():
+    """GET returns the last verification report; POST runs one (``{"full": bool}``)."""
+    if request.method == 'GET':
+        report = get_setting_json(SALES_VERIFY_REPORT_SETTING)
+        return jsonify({'ok': True, 'report': report, 'verified_through_id': int(get_setting(SALES_VERIFIED_SETTING, '0') or 0)})
+    data = request.get_json(silent=True) or {}
+    full = str(data.get('full', request.args.get('full', ''))).lower() in ('1', 'true', 'yes')
+    report = verify_sales(full=full)
+    return jsonify({'ok': report['mismatch_count'] == 0, 'report': report})
+
+
 @app.route('/api/admin/staff', methods=['POST'])
 @admin_required
 def admin_add_staff():
@@ -3103,6 +6299,7 @@ def referral_register(code):
             db.session.add(Payment(member_id=m.id, year=admission_date.year, month=mm, status=status))
         db.session.commit()
         append_audit('member.create.referral', {'member_id': m.id, 'referred_by': ref.id})
+        member_suggest_index.upsert(m.id, m.name, m.phone)
         return render_template('referral_register.html', success=True, referrer=ref, gym_name=get_gym_name())
     return render_template('referral_register.html', referrer=ref, gym_name=get_gym_name())
 
@@ -3111,11 +6308,49 @@ def referral_register(code):
 @login_required
 def member_card_download(member_id):
     m = Member.query.get_or_404(member_id)
-    ok, pdf_bytes, fname = _build_member_card_pdf_bytes(m)
+    ok, pdf_bytes, fname = _member_card_pdf(m)
     if not ok:
         return jsonify({'ok': False, 'error': fname or 'Failed to build PDF'}), 500
     return send_file(BytesIO(pdf_bytes), mimetype='application/pdf', as_attachment=True, download_name=fname)
 
+MAX_CARD_SHEET_MEMBERS = 2000
+
+# Member cards: many per A4 page in one PDF, e.g. ?month=2024-05 for that month's new members
+@app.route('/api/members/cards.pdf', methods=['GET'])
+@login_required
+def member_card_sheet():
+    if not HAVE_PDF:
+        return jsonify({'ok': False, 'error': 'PDF generation library not installed'}), 500
+    q = Member.query
+    ids = [t for t in (request.args.get('ids') or '').split(',') if t.strip()]
+    try:
+        if ids:
+            q = q.filter(Member.id.in_([int(t) for t in ids]))
+        month = (request.args.get('month') or '').strip()
+        if month:
+            start = datetime.strptime(month, '%Y-%m').date()
+            end = (start + timedelta(days=32)).replace(day=1)
+            q = q.filter(Member.admission_date >= start, Member.admission_date < end)
+        since = (request.args.get('admitted_from') or '').strip()
+        if since:
+            q = q.filter(Member.admission_date >= datetime.fromisoformat(since).date())
+        until = (request.args.get('admitted_to') or '').strip()
+        if until:
+            q = q.filter(Member.admission_date <= datetime.fromisoformat(until).date())
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'ids must be integers; month YYYY-MM; dates YYYY-MM-DD'}), 400
+    if not (ids or month or since or until):
+        return jsonify({'ok': False, 'error': 'Provide ids, month, admitted_from or admitted_to'}), 400
+    if q.count() > MAX_CARD_SHEET_MEMBERS:
+        return jsonify({'ok': False, 'error': f'At most {MAX_CARD_SHEET_MEMBERS} cards per sheet'}), 400
+    # Spool to a temp file (disk once large) and let send_file stream it in chunks
+    out = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    count = _write_member_card_sheet(q.order_by(Member.admission_date, Member.id).yield_per(200), out)
+    out.seek(0)
+    resp = send_file(out, mimetype='application/pdf', as_attachment=True, download_name=f"member_cards_{datetime.now().strftime('%Y%m%d')}.pdf")
+    resp.headers['X-Card-Count'] = str(count)
+    return resp
+
 # Member card: send via email and/or WhatsApp
 @app.route('/api/members/<int:member_id>/card/send', methods=['POST'])
 @login_required
@@ -3126,7 +6361,7 @@ def member_card_send(member_id):
     whatsapp_to = _normalize_phone((payload.get('whatsapp') or '').strip())
     if not email_to and not whatsapp_to:
         return jsonify({'ok': False, 'error': 'Provide email and/or whatsapp'}), 400
-    ok, pdf_bytes, fname = _build_member_card_pdf_bytes(m)
+    ok, pdf_bytes, fname = _member_card_pdf(m)
     if not ok:
         return jsonify({'ok': False, 'error': fname or 'Failed to build PDF'}), 500
     results = {}
@@ -3145,26 +6380,427 @@ def member_card_send(member_id):
     status = 200 if overall_ok else 207  # multi-status style
     return jsonify({'ok': overall_ok, 'results': results}), status
 
+
+class CheckinStatusCache:
+    """Current-month access status per member, held in memory for scanners.
+
+    Lookups touch the database at most once every ``check_seconds`` to read
+    the member/payment data versions, and rebuild only when those changed
+    (or the month rolled over).
+    """
+
+    def __init__(self, check_seconds: float):
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._entries: dict[int, tuple] = {}  # id -> (name, is_active, access_tier, status)
+        self._versions = None
+        self._month = None
+        self._checked_at = 0.0
+
+    def _load(self, year: int, month: int) -> dict[int, tuple]:
+        statuses = dict(
+            db.session.query(Payment.member_id, Payment.status).filter(Payment.year == year, Payment.month == month)
+        )
+        return {
+            mid: (name, is_active is None or bool(is_active), tier or 'standard', statuses.get(mid, 'Unpaid'))
+            for mid, name, is_active, tier in db.session.query(Member.id, Member.name, Member.is_active, Member.access_tier)
+        }
+
+    def _refresh(self) -> None:
+        now = datetime.now()
+        month = (now.year, now.month)
+        versions = get_data_versions(('member', 'payment'))
+        if versions != self._versions or month != self._month:
+            entries = self._load(*month)
+            with self._lock:
+                self._entries, self._versions, self._month = entries, versions, month
+        self._checked_at = time.monotonic()
+
+    def invalidate(self) -> None:
+        self._checked_at = 0.0
+        self._versions = None
+
+    def lookup(self, member_id: int) -> dict | None:
+        if time.monotonic() - self._checked_at > self.check_seconds:
+            self._refresh()
+        with self._lock:
+            entry = self._entries.get(member_id)
+        if entry is None:
+            return None
+        name, active, tier, status = entry
+        allowed = active and status in ('Paid', 'N/A')
+        return {
+            'member_id': member_id,
+            'serial': 1000 + member_id,
+            'name': name,
+            'access_tier': tier,
+            'status': status if active else 'Inactive',
+            'allowed': allowed,
+        }
+
+
+checkin_cache = CheckinStatusCache(float(os.getenv('CHECKIN_CACHE_SECONDS', '5')))
+
+
+class CheckinWriter:
+    """Write-behind buffer for scanner events.
+
+    Scans only append to an in-memory deque, so a burst never waits on
+    SQLite's writer lock. A daemon thread inserts the buffered rows every
+    ``interval`` seconds (sooner once ``batch_size`` are waiting) together
+    with the hourly/daily rollups, in one transaction per batch. Batches that
+    fail on the database itself (locked, disk full) go back to the front of
+    the queue; any other failure means a bad row, so the batch is retried row
+    by row and rows the database still refuses are set aside in ``rejected``
+    instead of blocking every scan behind them. Leftovers are flushed at exit.
+    """
+
+    def __init__(self, interval: float, batch_size: int):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._pending: deque[dict] = deque()
+        self._cond = threading.Condition()
+        self._worker = None
+        self.last_error: str | None = None
+        self.rejected: deque[dict] = deque(maxlen=1000)
+
+    def enqueue(self, event: dict) -> None:
+        with self._cond:
+            self._pending.append(event)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+        self._ensure_worker()
+
+    def pending_count(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def _ensure_worker(self) -> None:
+        with self._cond:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run, name='checkin-writer', daemon=True)
+            self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if len(self._pending) < self.batch_size:
+                    self._cond.wait(self.interval)
+            try:
+                self.flush()
+            except Exception as exc:
+                self.last_error = str(exc)
+
+    def flush(self) -> int:
+        """Write everything queued so far. Returns the number of rows written."""
+        written = 0
+        while True:
+            with self._cond:
+                batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            if not batch:
+                break
+            try:
+                self._write(batch)
+            except OperationalError:
+                self._requeue(batch)
+                raise
+            except Exception:
+                written += self._write_rows(batch)
+                continue
+            written += len(batch)
+        return written
+
+    def _requeue(self, events: list[dict]) -> None:
+        with self._cond:
+            self._pending.extendleft(reversed(events))
+
+    def _write_rows(self, batch: list[dict]) -> int:
+        written = 0
+        for i, ev in enumerate(batch):
+            try:
+                self._write([ev])
+            except OperationalError:
+                self._requeue(batch[i:])
+                raise
+            except Exception as exc:
+                self.last_error = str(exc)
+                self.rejected.append({**ev, 'error': str(exc)})
+                app.logger.warning('dropped check-in for member %s: %s', ev.get('member_id'), exc)
+            else:
+                written += 1
+        return written
+
+    @staticmethod
+    def _write(batch: list[dict]) -> None:
+        hourly: dict = {}
+        daily: dict = {}
+        for ev in batch:
+            at = ev['created_at']
+            if not ev['allowed']:
+                field = 'denied'
+            else:
+                field = 'entries' if ev['direction'] == 'in' else 'exits'
+            for bucket, key in ((hourly, at.replace(minute=0, second=0, microsecond=0)), (daily, at.date())):
+                counts = bucket.setdefault(key, {'entries': 0, 'exits': 0, 'denied': 0})
+                counts[field] += 1
+        with app.app_context():
+            try:
+                db.session.execute(CheckIn.__table__.insert(), batch)
+                for hour, counts in sorted(hourly.items()):
+                    _upsert_add(CheckinHourly, {'hour': hour}, counts)
+                for day, counts in sorted(daily.items()):
+                    _upsert_add(CheckinDaily, {'day': day}, counts)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+
+checkin_writer = CheckinWriter(
+    interval=float(os.getenv('CHECKIN_FLUSH_SECONDS', '1')),
+    batch_size=int(os.getenv('CHECKIN_BATCH_SIZE', '200')),
+)
+
+@atexit.register
+def _flush_checkins() -> None:
+    if checkin_writer.pending_count():
+        try:
+            checkin_writer.flush()
+        except Exception:
+            pass
+
+
+def currently_inside(stay_minutes: int | None = None) -> int:
+    """Members whose latest allowed scan within the stay window is an entry.
+
+    Gyms often only scan on the way in, so an entry older than
+    CHECKIN_STAY_MINUTES counts as having left.
+    """
+    stay = stay_minutes or int(os.getenv('CHECKIN_STAY_MINUTES', '120'))
+    since = datetime.now() - timedelta(minutes=stay)
+    # By scan time, not id: a batch retried after a failure is inserted after newer scans
+    latest = (
+        db.session.query(
+            CheckIn.direction,
+            func.row_number().over(
+                partition_by=CheckIn.member_id, order_by=(CheckIn.created_at.desc(), CheckIn.id.desc())
+            ).label('rn'),
+        )
+        .filter(CheckIn.created_at >= since, CheckIn.allowed == True)  # noqa: E712
+        .subquery()
+    )
+    return db.session.query(func.count()).select_from(latest).filter(latest.c.rn == 1, latest.c.direction == 'in').scalar() or 0
+
+
+def _checkin_authorized() -> bool:
+    """Logged-in staff, or a scanner sending the shared CHECKIN_KIOSK_KEY."""
+    if session.get('user_id'):
+        return True
+    kiosk_key = os.getenv('CHECKIN_KIOSK_KEY') or ''
+    sent = request.headers.get('X-Kiosk-Key') or ''
+    return bool(kiosk_key) and hmac.compare_digest(kiosk_key, sent)
+
+
+# Scan-to-check-in: resolve a card QR token to the member's access status
+@app.route('/api/checkin/<token>', methods=['GET', 'POST'])
+def checkin_scan(token):
+    if not _checkin_authorized():
+        return jsonify({'ok': False, 'error': 'Unauthorized'}), 401
+    member_id = parse_checkin_token(token)
+    if member_id is None:
+        return jsonify({'ok': False, 'allowed': False, 'error': 'Invalid card'}), 400
+    info = checkin_cache.lookup(member_id)
+    if info is None:
+        return jsonify({'ok': False, 'allowed': False, 'error': 'Member not found'}), 404
+    data = request.get_json(silent=True) or {}
+    direction = (data.get('direction') or request.args.get('direction') or 'in').strip().lower()
+    if direction not in ('in', 'out'):
+        return jsonify({'ok': False, 'error': 'direction must be in or out'}), 400
+    if request.method == 'POST':
+        # GET is a status lookup only; POST records the scan
+        checkin_writer.enqueue({
+            'member_id': member_id,
+            'direction': direction,
+            'allowed': info['allowed'] or direction == 'out',
+            'access_tier': info['access_tier'],
+            'source': 'staff' if session.get('user_id') else 'kiosk',
+            'created_at': datetime.now(),
+        })
+    return jsonify({'ok': True, 'recorded': request.method == 'POST', 'direction': direction, **info})
+
+
+@app.route('/api/checkins/occupancy', methods=['GET'])
+@login_required
+def checkin_occupancy():
+    """Live counter plus today's totals and hourly entries."""
+    today = datetime.now().date()
+    start = datetime.combine(today, datetime.min.time())
+    day = db.session.get(CheckinDaily, today)
+    hours = (
+        CheckinHourly.query.filter(CheckinHourly.hour >= start, CheckinHourly.hour < start + timedelta(days=1))
+        .order_by(CheckinHourly.hour)
+        .all()
+    )
+    return jsonify({
+        'ok': True,
+        'inside': currently_inside(),
+        'today': {
+            'entries': day.entries if day else 0,
+            'exits': day.exits if day else 0,
+            'denied': day.denied if day else 0,
+        },
+        'hourly': [{'hour': h.hour.hour, 'entries': h.entries, 'exits': h.exits} for h in hours],
+        'pending': checkin_writer.pending_count(),
+        'rejected': len(checkin_writer.rejected),
+    })
+
+
+@app.route('/api/checkins/peak-hours', methods=['GET'])
+@login_required
+def checkin_peak_hours():
+    """Average entries per hour of day over the last ``days`` (default 30), from the hourly rollup."""
+    days = max(1, min(request.args.get('days', type=int) or 30, 366))
+    since = datetime.combine(datetime.now().date() - timedelta(days=days - 1), datetime.min.time())
+    totals = [0] * 24
+    for hour, entries in db.session.query(CheckinHourly.hour, CheckinHourly.entries).filter(CheckinHourly.hour >= since):
+        totals[hour.hour] += entries or 0
+    by_hour = [{'hour': h, 'entries': totals[h], 'avg_per_day': round(totals[h] / days, 2)} for h in range(24)]
+    daily = CheckinDaily.query.filter(CheckinDaily.day >= since.date()).order_by(CheckinDaily.day).all()
+    return jsonify({
+        'ok': True,
+        'days': days,
+        'by_hour': by_hour,
+        'peak': sorted(by_hour, key=lambda r: -r['entries'])[:3],
+        'daily': [{'day': d.day.isoformat(), 'entries': d.entries, 'exits': d.exits, 'denied': d.denied} for d in daily],
+    })
+
+
+@app.route('/api/members/<int:member_id>/checkins', methods=['GET'])
+@login_required
+def member_checkins(member_id):
+    _ = Member.query.get_or_404(member_id)
+    limit = max(1, min(request.args.get('limit', type=int) or 50, 500))
+    rows = CheckIn.query.filter_by(member_id=member_id).order_by(CheckIn.created_at.desc()).limit(limit).all()
+    return jsonify([r.to_dict() for r in rows])
+
 # API: list payment transactions for a member
 @app.route('/api/members/<int:member_id>/transactions', methods=['GET'])
 @login_required
 def member_transactions(member_id):
     _ = Member.query.get_or_404(member_id)
     txns = PaymentTransaction.query.filter_by(member_id=member_id).order_by(PaymentTransaction.created_at.desc()).all()
-    out = []
-    for t in txns:
-        out.append({
-            'id': t.id,
-            'member_id': t.member_id,
-            'user_id': t.user_id,
-            'plan_type': t.plan_type,
-            'year': t.year,
-            'month': t.month,
-            'amount': t.amount,
-            'method': t.method,
-            'created_at': t.created_at.isoformat(),
-        })
-    return jsonify(out)
+    return jsonify([t.to_dict() for t in txns])
+
+# Snapshot page order for /api/sync; the keyset token walks these in turn
+_SNAPSHOT_MODELS = {'member': Member, 'payment': Payment, 'transaction': PaymentTransaction}
+
+
+def _sync_snapshot_page(cursor: int, after: tuple[str, int] | None, limit: int, reset: bool):
+    entities = list(_SNAPSHOT_MODELS)
+    start = entities.index(after[0]) if after else 0
+    rows = {entity: [] for entity in entities}
+    budget, last, has_more = limit, after, False
+    for entity in entities[start:]:
+        model = _SNAPSHOT_MODELS[entity]
+        q = model.query
+        if after and entity == after[0]:
+            q = q.filter(model.id > after[1])
+        page = q.order_by(model.id).limit(budget + 1).all()
+        if len(page) > budget:
+            page, has_more = page[:budget], True
+        rows[entity] = page
+        if page:
+            last = (entity, page[-1].id)
+        budget -= len(page)
+        if has_more:
+            break
+    return jsonify({
+        'ok': True,
+        'reset': reset,
+        'cursor': cursor,
+        'has_more': has_more,
+        'after': f'{last[0]}:{last[1]}' if has_more else None,
+        'members': _members_to_dicts(rows['member']),
+        'payments': [p.to_dict() for p in rows['payment']],
+        'transactions': [t.to_dict() for t in rows['transaction']],
+        'deleted': {'member': [], 'payment': [], 'transaction': []},
+    })
+
+@app.route('/api/sync', methods=['GET'])
+@login_required
+def sync_changes():
+    """Delta feed for offline replicas (PWA, desktop).
+
+    ``since`` is the ``cursor`` from the previous call. Returns members,
+    payments and transactions touched after it plus tombstones in
+    ``deleted``. ``reset: true`` means the replica must be dropped and
+    rebuilt from this response (first sync, or a system reset happened).
+    Keep calling while ``has_more`` is true.
+
+    Snapshots are paged too: while one is in progress the response carries
+    an ``after`` keyset token (``<entity>:<id>``) to send back along with
+    ``since``; it is null once the snapshot is complete.
+    """
+    try:
+        since = max(int(request.args.get('since') or 0), 0)
+        limit = min(max(int(request.args.get('limit') or 500), 1), 5000)
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'since and limit must be integers'}), 400
+    after = request.args.get('after') or None
+    if after is not None:
+        entity, _, after_id = after.partition(':')
+        if entity not in _SNAPSHOT_MODELS or not after_id.isdigit():
+            return jsonify({'ok': False, 'error': 'after must be <entity>:<id>'}), 400
+        after = (entity, int(after_id))
+    last_reset = db.session.query(func.max(ChangeLog.seq)).filter(ChangeLog.op == 'reset').scalar() or 0
+    if since == 0 or last_reset > since:
+        # New snapshot. The cursor is read first so writes racing the
+        # snapshot pages are replayed afterwards (upserts are idempotent).
+        cursor = db.session.query(func.max(ChangeLog.seq)).scalar() or 0
+        return _sync_snapshot_page(cursor, None, limit, reset=True)
+    if after is not None:
+        return _sync_snapshot_page(since, after, limit, reset=False)
+
+    changes = (
+        db.session.query(ChangeLog.seq, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.op)
+        .filter(ChangeLog.seq > since)
+        .order_by(ChangeLog.seq)
+        .limit(limit + 1)
+        .all()
+    )
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    # Last write wins per row inside the window
+    latest: dict[tuple[str, int], str] = {}
+    for _, entity, entity_id, op in changes:
+        latest[(entity, entity_id)] = op
+    wanted = {'member': set(), 'payment': set(), 'transaction': set()}
+    deleted = {'member': [], 'payment': [], 'transaction': []}
+    for (entity, entity_id), op in latest.items():
+        if entity not in wanted:
+            continue
+        if op == 'delete':
+            deleted[entity].append(entity_id)
+        else:
+            wanted[entity].add(entity_id)
+    members = Member.query.filter(Member.id.in_(wanted['member'])).order_by(Member.id).all() if wanted['member'] else []
+    payments = Payment.query.filter(Payment.id.in_(wanted['payment'])).order_by(Payment.id).all() if wanted['payment'] else []
+    txns = PaymentTransaction.query.filter(PaymentTransaction.id.in_(wanted['transaction'])).order_by(PaymentTransaction.id).all() if wanted['transaction'] else []
+    # Rows removed without a logged delete (raw SQL) still surface as tombstones
+    for entity, rows in (('member', members), ('payment', payments), ('transaction', txns)):
+        deleted[entity].extend(sorted(wanted[entity] - {r.id for r in rows}))
+    return jsonify({
+        'ok': True,
+        'reset': False,
+        'cursor': changes[-1][0] if changes else since,
+        'has_more': has_more,
+        'after': None,
+        'members': _members_to_dicts(members),
+        'payments': [p.to_dict() for p in payments],
+        'transactions': [t.to_dict() for t in txns],
+        'deleted': deleted,
+    })
 
 # ADMIN: Complete System Reset
 @app.route('/admin/system/reset', methods=['POST'])
@@ -3177,7 +6813,7 @@ def system_reset():
     - All users (except default admin)
     - All payment transactions
     - All audit logs
-    - All products and sales (POS data)
+    - All products and sales (POS data), including the stock ledger
     - All uploaded files and member photos
     - All settings (reset to defaults)
     
@@ -3194,11 +6830,17 @@ def system_reset():
     
     try:
         # 1. Delete all database records
+        db.session.query(StockMovement).delete()
         db.session.query(SaleItem).delete()
+        db.session.query(ProductSalesDaily).delete()
+        db.session.query(SalesDaily).delete()
         db.session.query(Sale).delete()
         db.session.query(Product).delete()
         db.session.query(PaymentTransaction).delete()
         db.session.query(Payment).delete()
+        db.session.query(CheckIn).delete()
+        db.session.query(CheckinHourly).delete()
+        db.session.query(CheckinDaily).delete()
         db.session.query(Member).delete()
         db.session.query(AuditLog).delete()
         db.session.query(UploadedFile).delete()
@@ -3208,9 +6850,12 @@ def system_reset():
         
         # 2. Delete all users except recreate admin
         db.session.query(User).delete()
+        mark_tables_changed(*VERSIONED_TABLES)
+        db.session.add(ChangeLog(entity='*', op='reset'))
         
         # 3. Commit deletions
         db.session.commit()
+        member_suggest_index.invalidate()
         
         # 4. Recreate default admin user
         admin_username = os.getenv('ADMIN_USERNAME', 'admin')
@@ -3231,34 +6876,14 @@ def system_reset():
         
         db.session.commit()
         
-        # 6. Delete all uploaded files from filesystem
-        try:
-            for filename in os.listdir(UPLOAD_FOLDER):
-                filepath = os.path.join(UPLOAD_FOLDER, filename)
-                if os.path.isfile(filepath):
-                    os.remove(filepath)
-        except Exception:
-            pass
-        
-        # 7. Delete all backup files
-        try:
-            for filename in os.listdir(BACKUP_DIR):
-                filepath = os.path.join(BACKUP_DIR, filename)
-                if os.path.isfile(filepath):
-                    os.remove(filepath)
-        except Exception:
-            pass
-        
-        # 8. Delete all data uploads
-        try:
-            data_uploads_dir = os.path.join(BASE_DIR, 'data_uploads')
-            if os.path.exists(data_uploads_dir):
-                for filename in os.listdir(data_uploads_dir):
-                    filepath = os.path.join(data_uploads_dir, filename)
-                    if os.path.isfile(filepath):
-                        os.remove(filepath)
-        except Exception:
-            pass
+        # 6-8. Delete uploaded photos, backup files and data uploads
+        for store in (photo_store, backup_store, data_store):
+            try:
+                for obj in list(store.list()):
+                    store.delete(obj.key)
+            except Exception:
+                pass
+        shutil.rmtree(DATASET_CACHE_DIR, ignore_errors=True)
         
         # 9. Log out current session
         session.clear()
@@ -3300,23 +6925,91 @@ def excel_dashboard():
     """Excel-based auto-updating dashboard"""
     return render_template('excel_dashboard.html', gym_name=get_gym_name())
 
+_excel_cache = {'key': None, 'columns': [], 'records': []}
+_excel_cache_lock = threading.Lock()
+
+
+def _excel_stat_key(path: str):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (path, st.st_mtime_ns, st.st_size)
+
+
+def load_excel_data(path: str | None = None) -> tuple[tuple, list[str], list[dict]]:
+    """Parsed rows of the dashboard workbook, cached by (path, mtime, size).
+
+    Each worker parses the file once per change on disk instead of once per
+    request. Returns ``(key, columns, records)``; raises FileNotFoundError
+    when the file is missing.
+    """
+    path = path or EXCEL_DATA_FILE
+    key = _excel_stat_key(path)
+    if key is None:
+        raise FileNotFoundError(path)
+    with _excel_cache_lock:
+        if _excel_cache['key'] == key:
+            return key, _excel_cache['columns'], _excel_cache['records']
+        columns, records = [], []
+        for headers, rows in _iter_upload_batches(path, os.path.splitext(path)[1].lower()):
+            columns = headers
+            records.extend(dict(zip(headers, row)) for row in rows)
+        # Only cache a consistent read: the file may be mid-save
+        if _excel_stat_key(path) == key:
+            _excel_cache.update(key=key, columns=columns, records=records)
+        return key, columns, records
+
+
 @app.route('/api/excel/data')
 @login_required
 def excel_data_endpoint():
-    """API endpoint for Excel data with auto-update support"""
-    EXCEL_FILE_PATH = os.path.join(BASE_DIR, 'data_file.xlsx')
-    
-    if not os.path.exists(EXCEL_FILE_PATH):
+    """Rows of data_file.xlsx as JSON, parsed once per file change.
+
+    ``?columns=a,b`` projects, ``?limit=``/``?offset=`` page (the total is in
+    ``X-Total-Count``). The ETag comes from the file's mtime/size, so a
+    matching ``If-None-Match`` is a 304 without touching the workbook.
+    Changes are pushed as ``excel.changed`` on /api/events.
+
+    Cells go through the upload-dataset reader: dates are ISO 8601 strings
+    and blank cells are null (the old pandas path sent RFC 822 dates and
+    NaN, which is not valid JSON). Blank and repeated headers are named the
+    way pandas named them (``Unnamed: 2``, ``Amount.1``).
+    """
+    key = _excel_stat_key(EXCEL_DATA_FILE)
+    if key is None:
         # Return sample data if file doesn't exist
         return jsonify([{'Category': 'No Data', 'Value': 0}])
-    
+    etag = hashlib.sha1(f"{key[1]}:{key[2]}|{request.full_path}".encode('utf-8')).hexdigest()[:24]
+    if request.if_none_match.contains(etag):
+        resp = app.response_class(status=304)
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = 'private, no-cache'
+        return resp
     try:
-        df = pd.read_excel(EXCEL_FILE_PATH)
-        # Convert to JSON format
-        data = df.to_dict(orient='records')
-        return jsonify(data)
+        key, columns, records = load_excel_data()
+    except FileNotFoundError:
+        return jsonify([{'Category': 'No Data', 'Value': 0}])
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    wanted = _split_arg(request.args.get('columns'))
+    unknown = [c for c in wanted if c not in columns]
+    if unknown:
+        return jsonify({'error': f"unknown column(s): {', '.join(unknown)}"}), 400
+    try:
+        offset = max(int(request.args.get('offset') or 0), 0)
+        limit = max(int(request.args['limit']), 0) if request.args.get('limit') else None
+    except ValueError:
+        return jsonify({'error': 'limit and offset must be integers'}), 400
+    rows = records[offset:offset + limit] if limit is not None else records[offset:]
+    if wanted:
+        rows = [{c: r.get(c) for c in wanted} for r in rows]
+    resp = jsonify(rows)
+    resp.headers['X-Total-Count'] = str(len(records))
+    if _excel_stat_key(EXCEL_DATA_FILE) == key:
+        resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp
 
 # Initialize automatic backup scheduler
 def init_backup_scheduler():
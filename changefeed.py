@@ -0,0 +1,30 @@
+"""Change feed shared by the web app and the standalone sqlite tools.
+
+``SYNC_ENTITIES`` maps each replicated table to the entity name written to
+``change_log`` and served by ``/api/sync``. ``log_change`` is the raw-sqlite
+writer used by cli.py and desktop_app.py: it appends to the feed and bumps
+the table's ``data_version`` row so the web app's ETags and caches notice.
+
+Kept free of Flask/SQLAlchemy imports so the tools can use it on their own.
+"""
+import sqlite3
+from datetime import datetime
+
+# Replicated tables -> entity names used by /api/sync
+SYNC_ENTITIES = {'member': 'member', 'payment': 'payment', 'payment_transaction': 'transaction'}
+
+# change_log entity -> table whose data_version the web app's ETags and caches watch
+VERSIONED_ENTITIES = {entity: table for table, entity in SYNC_ENTITIES.items()}
+
+
+def log_change(cur, entity, entity_id, op='upsert'):
+    # Feed the web app's /api/sync replicas and bump its per-table data version in
+    # the same transaction; both tables only exist once the web app has run
+    try:
+        cur.execute("INSERT INTO change_log (entity, entity_id, op, changed_at) VALUES (?, ?, ?, ?)",
+                    (entity, entity_id, op, datetime.utcnow().isoformat(' ')))
+        cur.execute("INSERT INTO data_version (table_name, version) VALUES (?, 1) "
+                    "ON CONFLICT(table_name) DO UPDATE SET version = version + 1",
+                    (VERSIONED_ENTITIES[entity],))
+    except sqlite3.OperationalError:
+        pass
@@ -2,7 +2,8 @@
 import sqlite3
 import argparse
 from datetime import datetime
-import pandas as pd
+
+from changefeed import log_change
 
 DB = 'gym.db'
 
@@ -13,19 +14,40 @@ def add_member(name, phone, admission):
     c = conn(); cur = c.cursor()
     cur.execute("INSERT INTO member (name, phone, admission_date) VALUES (?, ?, ?)", (name, phone, admission))
     member_id = cur.lastrowid
+    log_change(cur, 'member', member_id)
     year = datetime.fromisoformat(admission).year
     for m in range(1,13):
         status = 'N/A' if datetime(year,m,1).date() < datetime.fromisoformat(admission).date() else 'Unpaid'
         cur.execute("INSERT INTO payment (member_id, year, month, status) VALUES (?, ?, ?, ?)", (member_id, year, m, status))
+        log_change(cur, 'payment', cur.lastrowid)
     c.commit(); c.close()
     print('Added', name, 'id=', member_id)
 
 def export_member(member_id, out):
+    from openpyxl import Workbook
     c = conn(); cur = c.cursor()
     cur.execute("SELECT year, month, status FROM payment WHERE member_id=? ORDER BY year, month", (member_id,))
-    rows = cur.fetchall()
-    df = pd.DataFrame(rows, columns=['Year','Month','Status'])
-    df.to_excel(out, index=False)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Payments')
+    ws.append(['Year', 'Month', 'Status'])
+    for row in cur:
+        ws.append(list(row))
+    wb.save(out)
+    c.close()
+    print('Exported to', out)
+
+def export_all(out, year=None, active_only=False):
+    # Same grid as the web app's /api/members/export.<fmt> (streamed, constant memory)
+    from app import app, _export_months, member_payment_grid_header, iter_member_payment_grid, _iter_csv_lines, write_member_payment_grid_xlsx
+    year = year or datetime.now().year
+    months = _export_months((year, 1), (year, 12))
+    with app.app_context():
+        if out.lower().endswith('.xlsx'):
+            with open(out, 'wb') as fh:
+                write_member_payment_grid_xlsx(fh, months, active_only)
+        else:
+            with open(out, 'w', encoding='utf-8', newline='') as fh:
+                fh.writelines(_iter_csv_lines(member_payment_grid_header(months), iter_member_payment_grid(months, active_only)))
     print('Exported to', out)
 
 if __name__ == '__main__':
@@ -33,10 +55,13 @@ if __name__ == '__main__':
     sub = parser.add_subparsers(dest='cmd')
     a = sub.add_parser('add'); a.add_argument('--name'); a.add_argument('--phone', default=''); a.add_argument('--admission')
     e = sub.add_parser('export'); e.add_argument('--id', type=int); e.add_argument('--out', default='member.xlsx')
+    ea = sub.add_parser('export-all'); ea.add_argument('--out', default='members.csv'); ea.add_argument('--year', type=int); ea.add_argument('--active-only', action='store_true')
     args = parser.parse_args()
     if args.cmd=='add':
         add_member(args.name, args.phone, args.admission)
     elif args.cmd=='export':
         export_member(args.id, args.out)
+    elif args.cmd=='export-all':
+        export_all(args.out, args.year, args.active_only)
     else:
         parser.print_help()
@@ -4,18 +4,40 @@ from tkinter import ttk, messagebox
 import sqlite3
 from datetime import datetime
 
+from changefeed import log_change
+
 DB = 'gym.db'
 
 def get_conn():
     return sqlite3.connect(DB)
 
+def changes_since(cur, seq):
+    """Return (new_seq, member_ids) changed after seq, or (new_seq, None) when a full reload is needed."""
+    try:
+        if seq is None:
+            cur.execute("SELECT MAX(seq) FROM change_log")
+            return cur.fetchone()[0] or 0, None
+        cur.execute("SELECT seq, entity, entity_id, op FROM change_log WHERE seq > ? ORDER BY seq", (seq,))
+        rows = cur.fetchall()
+    except sqlite3.OperationalError:
+        return None, None
+    if not rows:
+        return seq, set()
+    if any(op == 'reset' for _, _, _, op in rows):
+        return rows[-1][0], None
+    return rows[-1][0], {eid for _, entity, eid, _ in rows if entity == 'member'}
+
+POLL_MS = 5000
+
 class App(tk.Tk):
     def __init__(self):
         super().__init__()
         self.title("Gym Fee Desktop")
         self.geometry("700x500")
+        self.change_seq = None
         self.create_widgets()
         self.refresh_members()
+        self.after(POLL_MS, self.poll_changes)
 
     def create_widgets(self):
         frame = ttk.Frame(self)
@@ -46,26 +68,48 @@ class App(tk.Tk):
         cur = conn.cursor()
         cur.execute("INSERT INTO member (name, phone, admission_date) VALUES (?, ?, ?)", (name, phone, adm))
         member_id = cur.lastrowid
+        log_change(cur, 'member', member_id)
         # initialize payments
         year = ad.year
         for m in range(1,13):
             status = 'N/A' if datetime(year, m, 1).date() < ad else 'Unpaid'
             cur.execute("INSERT INTO payment (member_id, year, month, status) VALUES (?, ?, ?, ?)", (member_id, year, m, status))
+            log_change(cur, 'payment', cur.lastrowid)
         conn.commit()
         conn.close()
         self.name.delete(0,'end'); self.phone.delete(0,'end'); self.adm.delete(0,'end')
         self.refresh_members()
 
     def refresh_members(self):
-        for i in self.tree.get_children():
-            self.tree.delete(i)
         conn = get_conn()
         cur = conn.cursor()
-        cur.execute("SELECT id, name, admission_date FROM member")
-        for r in cur.fetchall():
-            self.tree.insert('', 'end', values=r)
+        self.change_seq, changed = changes_since(cur, self.change_seq)
+        if changed is None:
+            for i in self.tree.get_children():
+                self.tree.delete(i)
+            cur.execute("SELECT id, name, admission_date FROM member")
+            for r in cur.fetchall():
+                self.tree.insert('', 'end', iid=str(r[0]), values=r)
+        elif changed:
+            # Only touch rows named in change_log instead of reloading the table
+            marks = ','.join('?' * len(changed))
+            cur.execute(f"SELECT id, name, admission_date FROM member WHERE id IN ({marks})", tuple(changed))
+            found = {r[0]: r for r in cur.fetchall()}
+            for mid in changed:
+                iid = str(mid)
+                if mid not in found:
+                    if self.tree.exists(iid):
+                        self.tree.delete(iid)
+                elif self.tree.exists(iid):
+                    self.tree.item(iid, values=found[mid])
+                else:
+                    self.tree.insert('', 'end', iid=iid, values=found[mid])
         conn.close()
 
+    def poll_changes(self):
+        self.refresh_members()
+        self.after(POLL_MS, self.poll_changes)
+
     def on_member_select(self, event):
         item = self.tree.selection()[0]
         member_id = self.tree.item(item)['values'][0]
@@ -104,6 +148,7 @@ class PaymentsWindow(tk.Toplevel):
         pid = self.tree.item(sel[0])['values'][0]
         conn = get_conn(); cur = conn.cursor()
         cur.execute("UPDATE payment SET status=? WHERE id=?", (status, pid))
+        log_change(cur, 'payment', pid)
         conn.commit(); conn.close()
         self.refresh()
 
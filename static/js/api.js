@@ -0,0 +1,82 @@
+// Shared fetch helpers for the dashboard, fees and members pages.
+(function (global) {
+  // Conditional GET: remember the last ETag/body per URL and send the
+  // validator back. A 304 reuses the remembered body without re-parsing.
+  const etagCache = new Map();
+
+  async function fetchJSON(url, options = {}) {
+    const cached = etagCache.get(url);
+    const headers = new Headers(options.headers || {});
+    if (cached) headers.set("If-None-Match", cached.etag);
+    const res = await fetch(url, { ...options, headers, cache: "no-store" });
+    if (res.status === 304 && cached) {
+      return cached.data;
+    }
+    if (!res.ok) {
+      const err = new Error(`Request failed: ${res.status}`);
+      err.status = res.status;
+      throw err;
+    }
+    const data = await res.json();
+    const etag = res.headers.get("ETag");
+    if (etag) etagCache.set(url, { etag, data });
+    return data;
+  }
+
+  // Live updates from /api/events. `onChange` is debounced so a burst of
+  // deltas (e.g. a yearly payment) triggers a single refresh. `onDown` runs
+  // when the browser has no EventSource or the stream is rejected, so pages
+  // can fall back to their polling timers.
+  function subscribeEvents(topics, onChange, { debounce = 400, onDown } = {}) {
+    if (!("EventSource" in global)) {
+      if (onDown) onDown();
+      return null;
+    }
+    const source = new EventSource(`/api/events?topics=${encodeURIComponent(topics.join(","))}`);
+    const pending = [];
+    let timer = null;
+    const flush = () => {
+      timer = null;
+      onChange(pending.splice(0));
+    };
+    const handle = (ev) => {
+      let data = null;
+      try {
+        data = JSON.parse(ev.data);
+      } catch (_) {}
+      pending.push({ type: ev.type, data });
+      clearTimeout(timer);
+      timer = setTimeout(flush, debounce);
+    };
+    const kinds = {
+      payment: ["payment.status"],
+      transaction: ["transaction.created"],
+      member: ["member.created"],
+      excel: ["excel.changed"],
+    };
+    topics.forEach((t) => (kinds[t] || []).forEach((k) => source.addEventListener(k, handle)));
+    source.addEventListener("error", () => {
+      // CLOSED means the server refused (e.g. logged out); CONNECTING is a
+      // normal reconnect that EventSource handles by itself.
+      if (source.readyState === EventSource.CLOSED && onDown) onDown();
+    });
+    return source;
+  }
+
+  // Offline write queue lives in the service worker. Ask it to drain on
+  // load and on reconnect; `onFlushed({flushed, rejected})` reports results.
+  function watchOutbox(onFlushed) {
+    if (!("serviceWorker" in navigator)) return;
+    const flush = () =>
+      navigator.serviceWorker.ready.then((reg) => reg.active && reg.active.postMessage({ type: "outbox-flush" }));
+    navigator.serviceWorker.addEventListener("message", (ev) => {
+      if (ev.data && ev.data.type === "outbox-flushed" && onFlushed) onFlushed(ev.data);
+    });
+    global.addEventListener("online", flush);
+    flush();
+  }
+
+  global.fetchJSON = fetchJSON;
+  global.watchOutbox = watchOutbox;
+  global.subscribeEvents = subscribeEvents;
+})(window);
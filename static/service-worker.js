@@ -1,5 +1,5 @@
 // Service Worker for Offline Support
-const CACHE_NAME = 'gym-app-v1';
+const CACHE_NAME = 'gym-app-v4';
 const urlsToCache = [
   '/',
   '/dashboard',
@@ -25,8 +25,249 @@ self.addEventListener('install', event => {
   );
 });
 
+// Offline replica of members/payments/transactions kept in IndexedDB.
+// /api/sync returns only rows changed since the stored cursor, so staying
+// current costs a few bytes when nothing happened.
+const REPLICA_DB = 'gym-replica';
+const REPLICA_STORES = { member: 'members', payment: 'payments', transaction: 'transactions' };
+
+function openReplica() {
+  return new Promise((resolve, reject) => {
+    const req = indexedDB.open(REPLICA_DB, 2);
+    req.onupgradeneeded = event => {
+      const db = req.result;
+      if (event.oldVersion < 1) {
+        Object.values(REPLICA_STORES).forEach(name => db.createObjectStore(name, { keyPath: 'id' }));
+        db.createObjectStore('meta');
+      }
+      if (event.oldVersion < 2) {
+        // Outbound write queue, drained in insertion order by flushOutbox()
+        db.createObjectStore('outbox', { keyPath: 'seq', autoIncrement: true });
+      }
+    };
+    req.onsuccess = () => resolve(req.result);
+    req.onerror = () => reject(req.error);
+  });
+}
+
+function txDone(tx) {
+  return new Promise((resolve, reject) => {
+    tx.oncomplete = () => resolve();
+    tx.onerror = tx.onabort = () => reject(tx.error);
+  });
+}
+
+async function readCursor(db) {
+  const tx = db.transaction('meta');
+  const cursor = tx.objectStore('meta').get('cursor');
+  const after = tx.objectStore('meta').get('after');
+  await txDone(tx);
+  return { since: cursor.result || 0, after: after.result || null };
+}
+
+async function applyDelta(db, delta) {
+  const names = [...Object.values(REPLICA_STORES), 'meta'];
+  const tx = db.transaction(names, 'readwrite');
+  if (delta.reset) {
+    Object.values(REPLICA_STORES).forEach(name => tx.objectStore(name).clear());
+  }
+  delta.members.forEach(row => tx.objectStore('members').put(row));
+  delta.payments.forEach(row => tx.objectStore('payments').put(row));
+  delta.transactions.forEach(row => tx.objectStore('transactions').put(row));
+  Object.entries(delta.deleted || {}).forEach(([entity, ids]) => {
+    const store = REPLICA_STORES[entity];
+    if (store) ids.forEach(id => tx.objectStore(store).delete(id));
+  });
+  tx.objectStore('meta').put(delta.cursor, 'cursor');
+  // Resume point of a paged snapshot; survives a reload mid-snapshot
+  if (delta.after) tx.objectStore('meta').put(delta.after, 'after');
+  else tx.objectStore('meta').delete('after');
+  await txDone(tx);
+}
+
+let replicaSync = null;
+function syncReplica() {
+  // One sync at a time; callers during a run share its promise
+  if (!replicaSync) {
+    replicaSync = (async () => {
+      const db = await openReplica();
+      let more = true;
+      while (more) {
+        const { since, after } = await readCursor(db);
+        const query = after ? `since=${since}&after=${encodeURIComponent(after)}` : `since=${since}`;
+        const res = await fetch(`/api/sync?${query}`, { credentials: 'same-origin', cache: 'no-store' });
+        if (!res.ok) break;
+        const delta = await res.json();
+        await applyDelta(db, delta);
+        more = delta.has_more;
+      }
+    })().catch(err => console.log('Replica sync failed:', err))
+      .finally(() => { replicaSync = null; });
+  }
+  return replicaSync;
+}
+
+async function replicaMembersResponse(url) {
+  const db = await openReplica();
+  const tx = db.transaction('members');
+  const req = tx.objectStore('members').getAll();
+  await txDone(tx);
+  const members = req.result.sort((a, b) => b.id - a.id);
+  // Mirror the online shapes: paged requests get the envelope, legacy ones the bare list
+  const paged = url.searchParams.has('limit') || url.searchParams.has('cursor');
+  const body = paged ? { ok: true, members, next_cursor: null, offline: true } : members;
+  return new Response(JSON.stringify(body), { headers: { 'Content-Type': 'application/json' } });
+}
+
+// Offline write queue. Pay-now / mark-paid / payment status writes that
+// cannot reach the server are stored with a client op_id and replayed via
+// /api/ops/batch, which applies them in order and ignores op_ids it has
+// already seen, so a retry after a lost response never pays twice.
+const OUTBOX_BATCH = 500;
+const QUEUEABLE = [
+  { pattern: /^\/api\/payment\/pay-now$/, method: 'POST', type: 'payment.pay' },
+  { pattern: /^\/api\/fees\/mark-paid$/, method: 'POST', type: 'payment.pay' },
+  { pattern: /^\/api\/payments\/(\d+)$/, method: 'PUT', type: 'payment.update', idKey: 'payment_id' },
+];
+
+function queueableOp(request, url) {
+  for (const rule of QUEUEABLE) {
+    const match = request.method === rule.method && url.pathname.match(rule.pattern);
+    if (match) return { rule, match };
+  }
+  return null;
+}
+
+async function enqueueOp(type, payload) {
+  const db = await openReplica();
+  const op = { op_id: self.crypto.randomUUID(), type, payload, queued_at: Date.now() };
+  const tx = db.transaction('outbox', 'readwrite');
+  tx.objectStore('outbox').add(op);
+  await txDone(tx);
+  try {
+    await self.registration.sync.register('outbox-flush');
+  } catch (_) {
+    // No Background Sync (Safari/Firefox): pages ask for a flush when back online
+  }
+  return op;
+}
+
+async function outboxSize() {
+  const db = await openReplica();
+  const tx = db.transaction('outbox');
+  const req = tx.objectStore('outbox').count();
+  await txDone(tx);
+  return req.result;
+}
+
+async function handleQueueable(request, found) {
+  const body = await request.clone().text();
+  try {
+    // Earlier queued writes go first so the server sees them in order
+    if (await outboxSize()) {
+      await flushOutbox();
+    }
+    return await fetch(request);
+  } catch (err) {
+    // Only an unreachable network (fetch rejects with TypeError) queues the
+    // write; a batch the server refused (401 after logout, 500) goes back to
+    // the page instead of piling more ops behind it
+    if (err.status) {
+      return new Response(err.body, { status: err.status, headers: { 'Content-Type': err.contentType } });
+    }
+    if (!(err instanceof TypeError)) throw err;
+    let payload = {};
+    try { payload = JSON.parse(body || '{}'); } catch (_) {}
+    if (found.rule.idKey) payload[found.rule.idKey] = Number(found.match[1]);
+    const op = await enqueueOp(found.rule.type, payload);
+    return new Response(JSON.stringify({ ok: true, queued: true, op_id: op.op_id }), {
+      status: 202,
+      headers: { 'Content-Type': 'application/json' },
+    });
+  }
+}
+
+let outboxFlush = null;
+function flushOutbox() {
+  if (!outboxFlush) {
+    outboxFlush = (async () => {
+      const db = await openReplica();
+      const rejected = [];
+      let flushed = 0;
+      for (;;) {
+        const readTx = db.transaction('outbox');
+        const req = readTx.objectStore('outbox').getAll(null, OUTBOX_BATCH);
+        await txDone(readTx);
+        const queued = req.result;
+        if (!queued.length) break;
+        const res = await fetch('/api/ops/batch', {
+          method: 'POST',
+          credentials: 'same-origin',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ ops: queued.map(({ op_id, type, payload }) => ({ op_id, type, payload })) }),
+        });
+        if (!res.ok) {
+          const err = new Error(`batch failed: ${res.status}`);
+          err.status = res.status;
+          err.contentType = res.headers.get('Content-Type') || 'application/json';
+          err.body = await res.text();
+          throw err;
+        }
+        const { results } = await res.json();
+        const done = new Set(results.map(r => r.op_id));
+        results.filter(r => r.status === 'rejected').forEach(r => rejected.push(r));
+        const delTx = db.transaction('outbox', 'readwrite');
+        queued.filter(op => done.has(op.op_id)).forEach(op => delTx.objectStore('outbox').delete(op.seq));
+        await txDone(delTx);
+        flushed += done.size;
+      }
+      if (flushed) {
+        const clients = await self.clients.matchAll();
+        clients.forEach(c => c.postMessage({ type: 'outbox-flushed', flushed, rejected }));
+        syncReplica();
+      }
+    })().finally(() => { outboxFlush = null; });
+  }
+  return outboxFlush;
+}
+
+self.addEventListener('message', event => {
+  if (event.data && event.data.type === 'replica-sync') {
+    event.waitUntil(syncReplica());
+  }
+  if (event.data && event.data.type === 'outbox-flush') {
+    event.waitUntil(flushOutbox().catch(err => console.log('Outbox flush failed:', err)));
+  }
+});
+
+self.addEventListener('sync', event => {
+  if (event.tag === 'replica-sync') {
+    event.waitUntil(syncReplica());
+  }
+  if (event.tag === 'outbox-flush') {
+    // Rejecting lets the browser retry the sync later with backoff
+    event.waitUntil(flushOutbox());
+  }
+});
+
 // Fetch - Cache First, then Network
 self.addEventListener('fetch', event => {
+  const url = new URL(event.request.url);
+  const queueable = url.origin === self.location.origin && queueableOp(event.request, url);
+  if (queueable) {
+    event.respondWith(handleQueueable(event.request, queueable));
+    return;
+  }
+  // Offline fallback for the member list, answered from the replica
+  if (event.request.method === 'GET' && url.pathname === '/api/members') {
+    event.respondWith(fetch(event.request).catch(() => replicaMembersResponse(url)));
+    return;
+  }
+  // Other API responses are revalidated with ETags by the pages; never
+  // serve them from the offline cache.
+  if (url.pathname.startsWith('/api/')) {
+    return;
+  }
   event.respondWith(
     caches.match(event.request)
       .then(response => {
@@ -0,0 +1,312 @@
+"""Object storage for member photos, backups and raw data uploads.
+
+Two interchangeable backends:
+
+- ``LocalStorage``: a directory on disk (the default; the same folders the
+  app always used).
+- ``S3Storage``: any S3-compatible service (AWS S3, MinIO, R2, B2), so
+  several app instances can share the same files.
+
+``storage_from_env(area, local_root)`` picks the backend from the
+environment::
+
+    STORAGE_BACKEND=s3          # default: local
+    S3_BUCKET=gym-files
+    S3_PREFIX=prod              # optional; objects live at <prefix>/<area>/<key>
+    S3_ENDPOINT_URL=http://127.0.0.1:9000   # MinIO or another S3-compatible host
+    S3_REGION=us-east-1
+    S3_ACCESS_KEY_ID=... / S3_SECRET_ACCESS_KEY=...  (or the usual AWS_* variables)
+
+Keys are relative, ``/``-separated paths such as ``member_12.jpg`` or
+``derived/member_12_ab12_thumb.webp``.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import IO, Iterator
+
+try:
+    import boto3
+    from botocore.config import Config as _BotoConfig
+    from botocore.exceptions import ClientError as _BotoClientError
+    HAVE_BOTO3 = True
+except Exception:
+    HAVE_BOTO3 = False
+
+    class _BotoClientError(Exception):
+        response: dict = {}
+
+CHUNK_SIZE = 1 << 16
+
+
+@dataclass
+class ObjectInfo:
+    key: str
+    size: int
+    modified: datetime
+
+
+def _clean_key(key: str) -> str:
+    parts = [p for p in (key or '').replace('\\', '/').split('/') if p not in ('', '.')]
+    if not parts or '..' in parts:
+        raise ValueError(f'invalid storage key: {key!r}')
+    return '/'.join(parts)
+
+
+class LocalStorage:
+    backend = 'local'
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        # Spool uploads next to their destination so put_path is a rename
+        self.spool_dir = self.root
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, *_clean_key(key).split('/'))
+
+    def describe(self, key: str) -> str:
+        return self.path(key)
+
+    def put_file(self, key: str, fileobj: IO[bytes], content_type: str | None = None) -> int:
+        """Stream ``fileobj`` into ``key`` (temp file + atomic rename). Returns bytes written."""
+        dest = self.path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest), prefix='.upload-')
+        written = 0
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b''):
+                    out.write(chunk)
+                    written += len(chunk)
+            os.replace(tmp, dest)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        return written
+
+    def put_bytes(self, key: str, data: bytes, content_type: str | None = None) -> int:
+        from io import BytesIO
+        return self.put_file(key, BytesIO(data), content_type)
+
+    def put_path(self, key: str, src: str, content_type: str | None = None) -> None:
+        """Move the local file ``src`` into ``key`` (atomic rename on the same filesystem)."""
+        dest = self.path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        try:
+            os.replace(src, dest)
+        except OSError:
+            with open(src, 'rb') as fh:
+                self.put_file(key, fh, content_type)
+            os.remove(src)
+
+    def open(self, key: str) -> IO[bytes]:
+        """Binary stream of the object. Raises FileNotFoundError."""
+        return open(self.path(key), 'rb')
+
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        with self.open(key) as fh:
+            fh.seek(start)
+            return fh.read(length)
+
+    def stat(self, key: str) -> ObjectInfo | None:
+        try:
+            st = os.stat(self.path(key))
+        except (OSError, ValueError):
+            return None
+        return ObjectInfo(_clean_key(key), st.st_size, datetime.fromtimestamp(st.st_mtime, timezone.utc))
+
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+
+    def delete(self, key: str) -> bool:
+        try:
+            os.remove(self.path(key))
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def list(self, prefix: str = '') -> Iterator[ObjectInfo]:
+        """Objects whose key starts with ``prefix`` (recursive, temp files skipped)."""
+        for dirpath, _, files in os.walk(self.root):
+            rel_dir = os.path.relpath(dirpath, self.root).replace(os.sep, '/')
+            rel_dir = '' if rel_dir == '.' else rel_dir + '/'
+            for name in files:
+                key = rel_dir + name
+                if name.startswith('.upload-') or not key.startswith(prefix):
+                    continue
+                try:
+                    st = os.stat(os.path.join(dirpath, name))
+                except OSError:
+                    continue
+                yield ObjectInfo(key, st.st_size, datetime.fromtimestamp(st.st_mtime, timezone.utc))
+
+    @contextmanager
+    def local_path(self, key: str) -> Iterator[str]:
+        """A filesystem path for libraries that need one (no copy for local storage)."""
+        path = self.path(key)
+        if not os.path.exists(path):
+            raise FileNotFoundError(key)
+        yield path
+
+    def presigned_url(self, key: str, expires: int = 3600, filename: str | None = None) -> str | None:
+        # Served by the app itself (see the app's signed /files route)
+        return None
+
+
+class S3Storage:
+    backend = 's3'
+
+    def __init__(self, bucket: str, prefix: str = '', client=None, **client_kwargs):
+        if client is None:
+            if not HAVE_BOTO3:
+                raise RuntimeError('boto3 is required for STORAGE_BACKEND=s3')
+            client_kwargs.setdefault('config', _BotoConfig(signature_version='s3v4', retries={'max_attempts': 5, 'mode': 'standard'}))
+            client = boto3.client('s3', **{k: v for k, v in client_kwargs.items() if v is not None})
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.spool_dir = None  # system temp dir
+
+    def _key(self, key: str) -> str:
+        key = _clean_key(key)
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _rel(self, full_key: str) -> str:
+        return full_key[len(self.prefix) + 1:] if self.prefix else full_key
+
+    def describe(self, key: str) -> str:
+        return f"s3://{self.bucket}/{self._key(key)}"
+
+    def put_file(self, key: str, fileobj: IO[bytes], content_type: str | None = None) -> int:
+        """Stream ``fileobj`` to the bucket; large bodies go up as a multipart upload."""
+        counter = HashingReader(fileobj)
+        extra = {'ContentType': content_type} if content_type else None
+        self.client.upload_fileobj(counter, self.bucket, self._key(key), ExtraArgs=extra)
+        return counter.count
+
+    def put_bytes(self, key: str, data: bytes, content_type: str | None = None) -> int:
+        args = {'Bucket': self.bucket, 'Key': self._key(key), 'Body': data}
+        if content_type:
+            args['ContentType'] = content_type
+        self.client.put_object(**args)
+        return len(data)
+
+    def put_path(self, key: str, src: str, content_type: str | None = None) -> None:
+        """Upload the local file ``src`` (multipart when large), then remove it."""
+        extra = {'ContentType': content_type} if content_type else None
+        self.client.upload_file(src, self.bucket, self._key(key), ExtraArgs=extra)
+        os.remove(src)
+
+    def open(self, key: str) -> IO[bytes]:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._key(key))['Body']
+        except _BotoClientError as exc:
+            if _is_missing(exc):
+                raise FileNotFoundError(key) from exc
+            raise
+
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        if length <= 0:
+            return b''
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=self._key(key), Range=f"bytes={start}-{start + length - 1}")['Body']
+        except _BotoClientError as exc:
+            if _is_missing(exc):
+                raise FileNotFoundError(key) from exc
+            if exc.response.get('Error', {}).get('Code') == 'InvalidRange':
+                return b''
+            raise
+        with body:
+            return body.read()
+
+    def stat(self, key: str) -> ObjectInfo | None:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except _BotoClientError as exc:
+            if _is_missing(exc):
+                return None
+            raise
+        return ObjectInfo(_clean_key(key), int(head.get('ContentLength') or 0), head.get('LastModified'))
+
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+
+    def delete(self, key: str) -> bool:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+        return True
+
+    def list(self, prefix: str = '') -> Iterator[ObjectInfo]:
+        full_prefix = f"{self.prefix}/{prefix}" if self.prefix else prefix
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=full_prefix):
+            for obj in page.get('Contents') or ():
+                yield ObjectInfo(self._rel(obj['Key']), int(obj.get('Size') or 0), obj.get('LastModified'))
+
+    @contextmanager
+    def local_path(self, key: str) -> Iterator[str]:
+        """Download to a temp file for libraries that need a path; removed afterwards."""
+        suffix = os.path.splitext(key)[1]
+        fd, tmp = tempfile.mkstemp(suffix=suffix, prefix='s3-')
+        try:
+            with os.fdopen(fd, 'wb') as out, self.open(key) as body:
+                shutil.copyfileobj(body, out, CHUNK_SIZE)
+            yield tmp
+        finally:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def presigned_url(self, key: str, expires: int = 3600, filename: str | None = None) -> str | None:
+        params = {'Bucket': self.bucket, 'Key': self._key(key)}
+        if filename:
+            params['ResponseContentDisposition'] = f'attachment; filename="{filename}"'
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=int(expires))
+
+
+class HashingReader:
+    """Wraps a binary stream and tracks the bytes read and their SHA-256."""
+
+    def __init__(self, fileobj):
+        self._f = fileobj
+        self.count = 0
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self._f.read(size)
+        self.count += len(data)
+        self.sha256.update(data)
+        return data
+
+
+def _is_missing(exc) -> bool:
+    code = str(exc.response.get('Error', {}).get('Code', ''))
+    return code in ('404', 'NoSuchKey', 'NotFound')
+
+
+def storage_from_env(area: str, local_root: str):
+    """Storage for one area (``uploads``, ``backups``, ``data_uploads``)."""
+    if (os.getenv('STORAGE_BACKEND') or 'local').strip().lower() != 's3':
+        return LocalStorage(local_root)
+    bucket = os.getenv('S3_BUCKET')
+    if not bucket:
+        raise RuntimeError('S3_BUCKET must be set when STORAGE_BACKEND=s3')
+    prefix = '/'.join(p for p in ((os.getenv('S3_PREFIX') or '').strip('/'), area) if p)
+    return S3Storage(
+        bucket,
+        prefix,
+        endpoint_url=os.getenv('S3_ENDPOINT_URL') or None,
+        region_name=os.getenv('S3_REGION') or os.getenv('AWS_DEFAULT_REGION') or None,
+        aws_access_key_id=os.getenv('S3_ACCESS_KEY_ID') or None,
+        aws_secret_access_key=os.getenv('S3_SECRET_ACCESS_KEY') or None,
+    )
@@ -0,0 +1,38 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# Point the database, caches and storage roots at a scratch directory before
+# app.py is imported, so the suite never touches gym.db or the working tree.
+TEST_ROOT = tempfile.mkdtemp(prefix='gym-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(TEST_ROOT, 'gym.db')
+for _name, _sub in (
+    ('UPLOAD_FOLDER', 'uploads'),
+    ('BACKUP_DIR', 'backups'),
+    ('DATA_UPLOAD_DIR', 'data_uploads'),
+    ('CARD_CACHE_DIR', os.path.join('cache', 'cards')),
+    ('DATASET_CACHE_DIR', os.path.join('cache', 'datasets')),
+    ('ANALYTICS_DIR', os.path.join('exports', 'analytics')),
+):
+    os.environ[_name] = os.path.join(TEST_ROOT, _sub)
+os.environ['STORAGE_BACKEND'] = 'local'
+
+from app import app, _ensure_schema  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def test_client():
+    app.config['TESTING'] = True
+    with app.test_client() as c:
+        with app.app_context():
+            _ensure_schema()
+            with c.session_transaction() as sess:
+                sess['user_id'] = 1
+                sess['username'] = 'tester'
+        yield c
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(TEST_ROOT, ignore_errors=True)
@@ -0,0 +1,38 @@
+from datetime import datetime
+
+import pytest
+from app import app, export_analytics
+
+pa_ds = pytest.importorskip('pyarrow.dataset')
+
+
+def _export(root, **kwargs):
+    with app.app_context():
+        return export_analytics(root=str(root), **kwargs)
+
+
+def test_partitions_are_typed_and_rewritten_incrementally(test_client, tmp_path):
+    m = test_client.post('/api/members', json={'name': 'Parquet User', 'admission_date': '2033-01-01'}).get_json()
+    first = _export(tmp_path)
+    assert 'members.parquet' in first['written'] and 'payments/2033-05' in first['written']
+    assert _export(tmp_path)['written'] == []
+
+    # Paying May edits one payment row in place and adds a transaction
+    test_client.post('/api/payment/pay-now', json={'member_id': m['id'], 'year': 2033, 'month': 5, 'amount': 2500})
+    now = datetime.now()
+    second = _export(tmp_path)
+    assert sorted(second['written']) == ['payments/2033-05', f'transactions/{now.year}-{now.month:02d}']
+
+    payments = pa_ds.dataset(str(tmp_path / 'payments'), partitioning='hive').to_table(
+        filter=(pa_ds.field('member_id') == m['id'])).to_pylist()
+    may = next(p for p in payments if p['month'] == 5 and p['year'] == 2033)
+    assert may['status'] == 'Paid' and str(may['period']) == '2033-05-01'
+    tx = pa_ds.dataset(str(tmp_path / 'transactions'), partitioning='hive').to_table(
+        filter=(pa_ds.field('member_id') == m['id']))
+    assert str(tx.schema.field('amount').type) == 'double' and tx.column('amount').to_pylist() == [2500.0]
+
+    # Deleting the member removes its rows from every partition it touched
+    test_client.delete(f"/api/members/{m['id']}")
+    third = _export(tmp_path)
+    assert 'members.parquet' in third['written'] and 'payments/2033-01' in third['removed']
+    assert not (tmp_path / 'payments' / 'year=2033').exists() or not any((tmp_path / 'payments' / 'year=2033').iterdir())
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+from app import app, checkin_cache, member_checkin_token
+
+
+def test_scan_resolves_status_from_cache(test_client, monkeypatch):
+    monkeypatch.setattr(checkin_cache, 'check_seconds', 0)
+    now = datetime.now()
+    m = test_client.post('/api/members', json={'name': 'Scan User', 'admission_date': f'{now.year}-01-01'}).get_json()
+    with app.app_context():
+        token = member_checkin_token(m['id'])
+    res = test_client.get(f'/api/checkin/{token}').get_json()
+    assert res['member_id'] == m['id'] and res['allowed'] is False and res['status'] == 'Unpaid'
+
+    test_client.post('/api/payment/pay-now', json={'member_id': m['id'], 'year': now.year, 'month': now.month, 'amount': 1000})
+    res = test_client.get(f'/api/checkin/{token.lower()}').get_json()
+    assert res['allowed'] is True and res['status'] == 'Paid'
+
+    forged = token[:-1] + ('0' if token[-1] != '0' else '1')
+    assert test_client.get(f'/api/checkin/{forged}').status_code == 400
+    assert test_client.get('/api/checkin/999999999-AAAAAAAAAAAAAAAA').status_code == 400
+
+
+def test_kiosk_key_without_session(monkeypatch):
+    monkeypatch.setenv('CHECKIN_KIOSK_KEY', 'k1')
+    with app.app_context():
+        token = member_checkin_token(1)
+    with app.test_client() as anon:
+        assert anon.get(f'/api/checkin/{token}').status_code == 401
+        assert anon.get(f'/api/checkin/{token}', headers={'X-Kiosk-Key': 'k1'}).status_code in (200, 404)
+
+
+def test_scans_are_batched_into_log_and_rollups(test_client, monkeypatch):
+    from app import checkin_writer
+    monkeypatch.setattr(checkin_cache, 'check_seconds', 0)
+    now = datetime.now()
+    m = test_client.post('/api/members', json={'name': 'Visit User', 'admission_date': f'{now.year}-01-01'}).get_json()
+    test_client.post('/api/payment/pay-now', json={'member_id': m['id'], 'year': now.year, 'month': now.month, 'amount': 1000})
+    with app.app_context():
+        token = member_checkin_token(m['id'])
+    checkin_writer.flush()
+    before = test_client.get('/api/checkins/occupancy').get_json()
+
+    assert test_client.post(f'/api/checkin/{token}').get_json()['recorded'] is True
+    checkin_writer.flush()
+    assert checkin_writer.pending_count() == 0
+    after = test_client.get('/api/checkins/occupancy').get_json()
+    assert after['today']['entries'] == before['today']['entries'] + 1
+    assert after['inside'] == before['inside'] + 1
+
+    test_client.post(f'/api/checkin/{token}', json={'direction': 'out'})
+    checkin_writer.flush()
+    assert test_client.get('/api/checkins/occupancy').get_json()['inside'] == before['inside']
+    visits = test_client.get(f"/api/members/{m['id']}/checkins").get_json()
+    assert [v['direction'] for v in visits] == ['out', 'in']
+
+    peak = test_client.get('/api/checkins/peak-hours?days=7').get_json()
+    assert peak['by_hour'][now.hour]['entries'] >= 1
+
+
+def test_bad_row_does_not_block_the_queue(test_client):
+    from app import checkin_writer, currently_inside
+    m = test_client.post('/api/members', json={'name': 'Poison User', 'admission_date': f'{datetime.now().year}-01-01'}).get_json()
+    checkin_writer.flush()
+    with app.app_context():
+        before = currently_inside()
+    now = datetime.now()
+    good = {'member_id': m['id'], 'direction': 'in', 'allowed': True, 'access_tier': 'standard', 'source': 'kiosk'}
+    checkin_writer.enqueue({**good, 'created_at': now})
+    checkin_writer.enqueue({**good, 'member_id': None, 'created_at': now})
+    # Written after the exit, but scanned before it
+    checkin_writer.enqueue({**good, 'created_at': now - timedelta(minutes=5)})
+    checkin_writer.enqueue({**good, 'direction': 'out', 'created_at': now - timedelta(minutes=1)})
+    rejected = len(checkin_writer.rejected)
+    checkin_writer.flush()
+    assert checkin_writer.pending_count() == 0
+    assert len(checkin_writer.rejected) == rejected + 1 and checkin_writer.rejected[-1]['member_id'] is None
+    with app.app_context():
+        assert currently_inside() == before + 1
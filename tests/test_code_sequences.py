@@ -0,0 +1,68 @@
+import re
+
+from app import app, allocate_sequence, encode_base32, referral_codes, db
+
+
+def test_encode_base32():
+    assert encode_base32(0, 4) == '0000'
+    assert encode_base32(31) == 'Z'
+    assert encode_base32(32) == '10'
+    assert not set(encode_base32(10 ** 12)) & set('ILOU')
+
+
+def test_sequence_blocks_are_contiguous_and_disjoint(test_client):
+    with app.app_context():
+        first = allocate_sequence('test_seq', 5)
+        second = allocate_sequence('test_seq', 3)
+        db.session.commit()
+    assert len(first) == 5 and second.start == first.stop
+    with app.app_context():
+        codes = referral_codes(50)
+        db.session.commit()
+    assert len(set(codes)) == 50
+    assert all(re.fullmatch(r'M[0-9A-HJKMNP-TV-Z]{7}', c) for c in codes)
+
+
+def test_allocate_endpoint_and_new_member_codes(test_client):
+    res = test_client.post('/api/codes/allocate', json={'kind': 'invoice', 'count': 3}).get_json()
+    assert res['ok'] and len(set(res['codes'])) == 3
+    assert all(re.fullmatch(r'INV\d{8}-[0-9A-Z]{6}', c) for c in res['codes'])
+    assert test_client.post('/api/codes/allocate', json={'kind': 'bogus'}).status_code == 400
+    assert test_client.post('/api/codes/allocate', json={'kind': 'invoice', 'count': 5000}).status_code == 400
+
+    a = test_client.post('/api/members', json={'name': 'Seq A', 'admission_date': '2026-01-01'}).get_json()
+    b = test_client.post('/api/members', json={'name': 'Seq B', 'admission_date': '2026-01-01'}).get_json()
+    assert a['referral_code'] != b['referral_code'] and len(a['referral_code']) == 8
+
+
+def test_first_use_rolls_back_with_the_caller(test_client):
+    with app.app_context():
+        assert list(allocate_sequence('test_seq_rollback', 4)) == [1, 2, 3, 4]
+        db.session.rollback()
+        assert list(allocate_sequence('test_seq_rollback', 2)) == [1, 2]
+        db.session.rollback()
+
+
+def test_import_keeps_its_referral_reservation_when_rows_fail(test_client, monkeypatch):
+    import io
+    from app import Counter, Member
+
+    def counter():
+        with app.app_context():
+            return db.session.get(Counter, 'referral_code').value
+    test_client.post('/api/members', json={'name': 'Seq Seed', 'admission_date': '2026-01-01'})
+    before = counter()
+    real_commit = db.session.commit
+
+    def commit():
+        # Every member row fails to commit
+        if any(isinstance(obj, Member) for obj in db.session.new):
+            raise RuntimeError('disk full')
+        real_commit()
+    monkeypatch.setattr(db.session, 'commit', commit)
+    csv = b'name,phone\nSeq Import A,03001112221\nSeq Import B,03001112222\n'
+    res = test_client.post('/admin/members/upload', data={'file': (io.BytesIO(csv), 'members.csv')},
+                           content_type='multipart/form-data').get_json()
+    monkeypatch.undo()
+    assert res['created'] == 0 and len(res['errors']) == 2
+    assert counter() == before + 2
@@ -0,0 +1,34 @@
+from datetime import datetime
+
+
+def test_fees_summary_etag_roundtrip(test_client):
+    res = test_client.get('/api/fees/summary')
+    assert res.status_code == 200
+    etag = res.headers['ETag']
+    again = test_client.get('/api/fees/summary', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+
+
+def test_write_invalidates_etag(test_client):
+    first = test_client.get('/api/members?limit=5')
+    etag = first.headers['ETag']
+    assert test_client.get('/api/members?limit=5', headers={'If-None-Match': etag}).status_code == 304
+    res = test_client.post('/api/members', json={'name': 'Etag User', 'admission_date': datetime.now().date().isoformat()})
+    assert res.status_code == 201
+    changed = test_client.get('/api/members?limit=5', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    # Different query strings never share a validator
+    other = test_client.get('/api/members?limit=6')
+    assert other.headers['ETag'] != changed.headers['ETag']
+
+
+def test_cli_write_invalidates_etag(test_client, monkeypatch):
+    import cli
+    from app import db
+    monkeypatch.setattr(cli, 'DB', db.engine.url.database)
+    etag = test_client.get('/api/fees/summary').headers['ETag']
+    cli.add_member('Cli User', '03000000000', datetime.now().date().isoformat())
+    changed = test_client.get('/api/fees/summary', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
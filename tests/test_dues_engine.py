@@ -0,0 +1,74 @@
+from datetime import datetime
+
+import app as app_module
+from app import app, dues_engine, send_bulk_text_reminders
+
+
+def test_arrears_streaks_and_revenue(test_client, monkeypatch):
+    now = datetime.now()
+    dec = test_client.get(f'/api/fees/summary?year={now.year}&month=12').get_json()
+    m = test_client.post('/api/members', json={
+        'name': 'Dues Engine', 'phone': '03001234567', 'admission_date': f'{now.year}-01-01', 'monthly_fee': 1500,
+    }).get_json()
+    test_client.post('/api/payment/pay-now', json={'member_id': m['id'], 'year': now.year, 'month': now.month, 'amount': 1500})
+
+    # Per-member fee, not the flat monthly_price setting
+    dec_after = test_client.get(f'/api/fees/summary?year={now.year}&month=12').get_json()
+    assert dec_after['unpaid_count'] == dec['unpaid_count'] + (1 if now.month < 12 else 0)
+    assert dec_after['unpaid_total'] == round(dec['unpaid_total'] + (1500 if now.month < 12 else 0), 2)
+
+    # Future months are not arrears; this month is paid so the current streak is 0
+    overdue = now.month - 1
+    row = next((x for x in test_client.get('/api/fees/unpaid-summary').get_json()['members'] if x['id'] == m['id']), None)
+    if overdue:
+        assert (row['months_unpaid'], row['total_due'], row['consecutive_unpaid'], row['longest_unpaid_streak']) == (overdue, 1500.0 * overdue, 0, overdue)
+        assert row['last_paid_month'] == f"{app_module.MONTH_ABBR[now.month - 1]} {now.year}"
+    else:
+        assert row is None
+
+    hist = test_client.get(f"/api/member/{m['id']}/payment-history").get_json()
+    assert hist['ok'] and hist['member']['monthly_price'] == 1500.0 and hist['months_unpaid'] == overdue
+    assert len(hist['payments']) == 12 and hist['payments'][0]['month'] == 12
+    paid = [p for p in hist['payments'] if p['status'] == 'Paid']
+    assert [(p['month'], p['amount']) for p in paid] == [(now.month, 1500.0)]
+
+    rev = test_client.get('/api/fees/revenue?months=1').get_json()
+    assert rev['months'][0]['collected'] >= 1500 and rev['months'][0]['month'] == now.month
+
+    sent = []
+    monkeypatch.setattr(app_module, 'send_whatsapp_message', lambda phone, msg: sent.append(msg) or (True, {}))
+    with app.app_context():
+        send_bulk_text_reminders(now.year, 12 if now.month < 12 else now.month)
+    mine = [s for s in sent if s.startswith('Hi Dues Engine,')]
+    assert now.month == 12 or (mine and '(1500 ' in mine[-1])
+
+
+def test_snapshot_is_reused_until_data_changes(test_client):
+    with app.app_context():
+        first = dues_engine.snapshot()
+        assert dues_engine.snapshot() is first
+    test_client.post('/api/members', json={'name': 'Dues Bump', 'admission_date': f'{datetime.now().year}-01-01'})
+    with app.app_context():
+        assert dues_engine.snapshot() is not first
+
+
+def test_snapshot_follows_change_log_only_writers(test_client):
+    import sqlite3
+    from app import db
+    now = datetime.now()
+    m = test_client.post('/api/members', json={'name': 'Raw Writer', 'admission_date': f'{now.year}-01-01'}).get_json()
+    with app.app_context():
+        before = dues_engine.snapshot()
+        pid = db.session.execute(db.text('SELECT id FROM payment WHERE member_id = :m AND year = :y AND month = :mo'),
+                                 {'m': m['id'], 'y': now.year, 'mo': now.month}).scalar()
+    # An older desktop/CLI copy: updates the row and the change log, not data_version
+    conn = sqlite3.connect(db.engine.url.database)
+    conn.execute("UPDATE payment SET status = 'Paid' WHERE id = ?", (pid,))
+    conn.execute("INSERT INTO change_log (entity, entity_id, op, changed_at) VALUES ('payment', ?, 'upsert', ?)",
+                 (pid, now.isoformat(' ')))
+    conn.commit()
+    conn.close()
+    with app.app_context():
+        after = dues_engine.snapshot()
+    assert after is not before
+    assert after.status[after.row(m['id']), after.current - after.first] == app_module.FEE_PAID
@@ -0,0 +1,58 @@
+import os
+
+import app as app_module
+from app import app
+
+
+def _write_book(path, rows):
+    from openpyxl import Workbook
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['Category', 'Value'])
+    for row in rows:
+        ws.append(row)
+    wb.save(path)
+
+
+def test_excel_data_is_cached_paged_and_etagged(test_client, tmp_path, monkeypatch):
+    path = str(tmp_path / 'data_file.xlsx')
+    _write_book(path, [[f'C{i}', i] for i in range(10)])
+    monkeypatch.setattr(app_module, 'EXCEL_DATA_FILE', path)
+    parses = []
+    real = app_module._iter_upload_batches
+    monkeypatch.setattr(app_module, '_iter_upload_batches', lambda *a: parses.append(a) or real(*a))
+
+    res = test_client.get('/api/excel/data?columns=Value&limit=3&offset=2')
+    assert res.get_json() == [{'Value': 2}, {'Value': 3}, {'Value': 4}]
+    assert res.headers['X-Total-Count'] == '10'
+    etag = res.headers['ETag'].strip('"')
+    assert test_client.get('/api/excel/data?columns=Value&limit=3&offset=2', headers={'If-None-Match': etag}).status_code == 304
+    assert len(test_client.get('/api/excel/data').get_json()) == 10
+    assert len(parses) == 1
+    assert test_client.get('/api/excel/data?columns=Nope').status_code == 400
+
+    # A save on disk changes the key: parsed again, old ETag no longer matches
+    _write_book(path, [['Only', 1]])
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 5_000_000_000))
+    fresh = test_client.get('/api/excel/data?columns=Value&limit=3&offset=2', headers={'If-None-Match': etag})
+    assert fresh.status_code == 200 and fresh.get_json() == []
+    assert test_client.get('/api/excel/data').get_json() == [{'Category': 'Only', 'Value': 1}]
+    assert len(parses) == 2
+
+
+def test_excel_data_cells_and_negative_limit(test_client, tmp_path, monkeypatch):
+    from datetime import datetime
+    from openpyxl import Workbook
+    path = str(tmp_path / 'data_file.xlsx')
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['Category', 'Value', 'Value', 'Day'])
+    ws.append(['A', 1, None, datetime(2024, 1, 2)])
+    ws.append(['B', 2, 3, None])
+    wb.save(path)
+    monkeypatch.setattr(app_module, 'EXCEL_DATA_FILE', path)
+    rows = test_client.get('/api/excel/data').get_json()
+    assert rows[0] == {'Category': 'A', 'Value': 1, 'Value.1': None, 'Day': '2024-01-02T00:00:00'}
+    res = test_client.get('/api/excel/data?limit=-1')
+    assert res.get_json() == [] and res.headers['X-Total-Count'] == '2'
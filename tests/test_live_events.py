@@ -0,0 +1,37 @@
+from datetime import datetime
+
+
+def _read_events(body):
+    events = []
+    for block in body.split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if line and not line.startswith(':'))
+        if 'event' in fields:
+            events.append(fields)
+    return events
+
+
+def test_fresh_subscriber_starts_at_now(test_client):
+    res = test_client.get('/api/events')
+    assert res.status_code == 200
+    assert res.mimetype == 'text/event-stream'
+    body = res.get_data(as_text=True)
+    assert body.startswith('retry: ')
+    assert _read_events(body) == []
+
+
+def test_write_paths_publish_deltas(test_client):
+    idle = test_client.get('/api/events').get_data(as_text=True)
+    cursor = [line[4:] for line in idle.splitlines() if line.startswith('id: ')][-1]
+    created = test_client.post('/api/members', json={'name': 'Live User', 'admission_date': datetime.now().date().isoformat()}).get_json()
+    now = datetime.now()
+    res = test_client.post(f"/api/members/{created['id']}/pay", json={'year': now.year, 'month': now.month, 'amount': 1500})
+    assert res.get_json()['ok']
+
+    body = test_client.get('/api/events', headers={'Last-Event-ID': cursor}).get_data(as_text=True)
+    kinds = [e['event'] for e in _read_events(body)]
+    assert kinds == ['member.created', 'payment.status', 'transaction.created']
+
+    only_payments = test_client.get('/api/events?topics=payment', headers={'Last-Event-ID': cursor}).get_data(as_text=True)
+    events = _read_events(only_payments)
+    assert [e['event'] for e in events] == ['payment.status']
+    assert f'"member_id":{created["id"]}' in events[0]['data']
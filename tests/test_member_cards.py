@@ -0,0 +1,50 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+import app as app_module
+from app import app
+
+pytestmark = pytest.mark.skipif(not app_module.HAVE_PDF, reason='reportlab not installed')
+
+
+def test_card_is_cached_until_member_changes(test_client, tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, 'CARD_CACHE_DIR', str(tmp_path))
+    m = test_client.post('/api/members', json={'name': 'Card User', 'admission_date': datetime.now().date().isoformat()}).get_json()
+    first = test_client.get(f"/api/members/{m['id']}/card")
+    assert first.status_code == 200 and first.data.startswith(b'%PDF')
+    cached = os.listdir(tmp_path)
+    assert len(cached) == 1
+
+    calls = []
+    monkeypatch.setattr(app_module, '_build_member_card_pdf_bytes', lambda member, issued=None: calls.append(member.id) or (True, b'%PDF-x', ''))
+    assert test_client.get(f"/api/members/{m['id']}/card").data == first.data
+    assert calls == []
+
+    test_client.put(f"/api/members/{m['id']}", json={'phone': '03001234567'})
+    assert os.listdir(tmp_path) == []
+    test_client.get(f"/api/members/{m['id']}/card")
+    assert calls == [m['id']]
+
+    # The card prints its issue date, so the next day renders a fresh one
+    class Tomorrow(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.now(tz) + timedelta(days=1)
+    monkeypatch.setattr(app_module, 'datetime', Tomorrow)
+    test_client.get(f"/api/members/{m['id']}/card")
+    assert calls == [m['id'], m['id']]
+
+
+def test_bulk_sheet(test_client):
+    month = datetime.now().strftime('%Y-%m')
+    ids = [
+        test_client.post('/api/members', json={'name': f'Sheet {i}', 'admission_date': f'{month}-01'}).get_json()['id']
+        for i in range(3)
+    ]
+    res = test_client.get(f"/api/members/cards.pdf?ids={','.join(map(str, ids))}")
+    assert res.status_code == 200 and res.data.startswith(b'%PDF')
+    assert res.headers['X-Card-Count'] == '3'
+    assert int(test_client.get(f'/api/members/cards.pdf?month={month}').headers['X-Card-Count']) >= 3
+    assert test_client.get('/api/members/cards.pdf').status_code == 400
+    assert test_client.get('/api/members/cards.pdf?month=nope').status_code == 400
@@ -0,0 +1,38 @@
+import csv
+import io
+import os
+
+import app as app_module
+from app import app, BASE_DIR
+
+
+def test_member_grid_csv_and_xlsx(test_client, monkeypatch):
+    monkeypatch.setattr(app_module, 'EXPORT_BATCH_SIZE', 3)
+    m = test_client.post('/api/members', json={'name': 'Grid Export', 'admission_date': '2031-03-10'}).get_json()
+    test_client.post('/api/payment/pay-now', json={'member_id': m['id'], 'year': 2031, 'month': 4, 'amount': 1500})
+
+    res = test_client.get('/api/members/export.csv?from=2031-02&to=2031-05')
+    assert res.status_code == 200 and res.mimetype == 'text/csv'
+    rows = list(csv.reader(io.StringIO(res.get_data(as_text=True).lstrip('﻿'))))
+    assert rows[0][6:] == ['2031-02', '2031-03', '2031-04', '2031-05',
+                           '2031-02 amount', '2031-03 amount', '2031-04 amount', '2031-05 amount', 'Total paid']
+    mine = next(r for r in rows[1:] if r[0] == str(m['id']))
+    assert mine[1] == 'Grid Export' and mine[6:10] == ['N/A', 'N/A', 'Paid', 'Unpaid']
+    assert mine[10:] == ['', '', '1500.0', '', '1500.0']
+    assert [int(r[0]) for r in rows[1:]] == sorted(int(r[0]) for r in rows[1:])
+
+    from openpyxl import load_workbook
+    xlsx = test_client.get('/api/members/export.xlsx?year=2031')
+    ws = load_workbook(io.BytesIO(xlsx.data), read_only=True).active
+    grid = {r[0]: r for r in ws.iter_rows(min_row=2, values_only=True)}
+    assert grid[m['id']][6 + 3] == 'Paid' and grid[m['id']][-1] == 1500
+
+    assert test_client.get('/api/members/export.pdf').status_code == 404
+    assert test_client.get('/api/members/export.csv?from=2020-01&to=2031-01').status_code == 400
+
+
+def test_single_member_export_writes_nothing_to_disk(test_client):
+    m = test_client.post('/api/members', json={'name': 'One Export', 'admission_date': '2031-01-01'}).get_json()
+    res = test_client.get(f"/api/members/{m['id']}/export")
+    assert res.status_code == 200 and res.data[:2] == b'PK'
+    assert not os.path.exists(os.path.join(BASE_DIR, f"member_{m['id']}_payments.xlsx"))
@@ -0,0 +1,34 @@
+from datetime import datetime
+
+
+def _create(client, **kwargs):
+    payload = {'name': 'Paging User', 'phone': '03110000000', 'admission_date': datetime.now().date().isoformat()}
+    payload.update(kwargs)
+    res = client.post('/api/members', json=payload)
+    assert res.status_code == 201, res.data
+    return res.get_json()
+
+
+def test_keyset_pages_do_not_overlap(test_client):
+    for _ in range(3):
+        _create(test_client)
+    first = test_client.get('/api/members?limit=2&with_counts=1').get_json()
+    assert first['ok'] and len(first['members']) == 2
+    assert first['counts']['total'] >= 3
+    assert first['next_cursor'] == str(first['members'][-1]['id'])
+    second = test_client.get(f"/api/members?limit=2&cursor={first['next_cursor']}").get_json()
+    first_ids = [m['id'] for m in first['members']]
+    second_ids = [m['id'] for m in second['members']]
+    assert first_ids == sorted(first_ids, reverse=True)
+    assert max(second_ids) < min(first_ids)
+
+
+def test_sparse_fields_and_sql_filters(test_client):
+    special = _create(test_client, special_tag=True, training_type='cardio')
+    res = test_client.get('/api/members?limit=200&fields=name,serial&special_tag=1&training_type=cardio')
+    members = res.get_json()['members']
+    assert members and all(set(m) == {'id', 'name', 'serial'} for m in members)
+    assert special['id'] in [m['id'] for m in members]
+    plain = test_client.get('/api/members?limit=200&fields=name&special_tag=0').get_json()['members']
+    assert special['id'] not in [m['id'] for m in plain]
+    assert test_client.get('/api/members?fields=bogus').status_code == 400
@@ -0,0 +1,112 @@
+import io
+import os
+from datetime import datetime
+
+import pytest
+from app import app, db, Member, UPLOAD_FOLDER, backfill_member_photos
+
+PIL = pytest.importorskip('PIL.Image')
+
+
+def _rotated_jpeg() -> bytes:
+    # 400x200 landscape pixels with EXIF orientation 6 (display rotated 90 degrees)
+    img = PIL.new('RGB', (400, 200), (200, 30, 30))
+    exif = PIL.Exif()
+    exif[0x0112] = 6
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', exif=exif)
+    return buf.getvalue()
+
+
+def _member(client, name):
+    return client.post('/api/members', json={'name': name, 'admission_date': datetime.now().date().isoformat()}).get_json()
+
+
+def test_upload_records_key_and_serves_derivatives(test_client, monkeypatch):
+    m = _member(test_client, 'Photo User')
+    res = test_client.post(f"/api/members/{m['id']}/photo", data={'photo': (io.BytesIO(_rotated_jpeg()), 'me.jpg')}, content_type='multipart/form-data').get_json()
+    assert res['ok'] and res['image_url'] == f"/static/uploads/member_{m['id']}.jpg"
+    assert res['thumb_url'].startswith(f"/media/members/member_{m['id']}_") and res['thumb_url'].endswith('_thumb.webp')
+
+    # Serialization reads the row only
+    def no_probe(path):
+        raise AssertionError(f'filesystem probe: {path}')
+    monkeypatch.setattr(os.path, 'exists', no_probe)
+    listed = test_client.get('/api/members?fields=image_url,thumb_url,photo_url&limit=500').get_json()['members']
+    monkeypatch.undo()
+    member = next(x for x in listed if x['id'] == m['id'])
+    assert member['thumb_url'] == res['thumb_url']
+
+    thumb = test_client.get(member['thumb_url'])
+    assert 'immutable' in thumb.headers['Cache-Control']
+    img = PIL.open(io.BytesIO(thumb.data))
+    assert img.format == 'WEBP' and img.size == (160, 160)
+    md = PIL.open(io.BytesIO(test_client.get(member['photo_url']).data))
+    assert md.size == (200, 400)  # orientation applied
+    assert not md.getexif()
+
+    test_client.delete(f"/api/members/{m['id']}")
+    assert test_client.get(member['thumb_url']).status_code == 404
+    assert not os.path.exists(os.path.join(UPLOAD_FOLDER, f"member_{m['id']}.jpg"))
+
+
+def test_backfill_scans_uploads(test_client):
+    m = _member(test_client, 'Legacy Photo')
+    path = os.path.join(UPLOAD_FOLDER, f"member_{m['id']}.png")
+    PIL.new('RGB', (50, 50)).save(path)
+    try:
+        with app.app_context():
+            assert backfill_member_photos() >= 1
+            row = db.session.get(Member, m['id'])
+            assert row.photo_key == f"member_{m['id']}.png" and len(row.photo_etag) == 16
+    finally:
+        test_client.delete(f"/api/members/{m['id']}")
+    assert not os.path.exists(path)
+
+
+def _png(color=(0, 120, 0), size=(300, 300)) -> bytes:
+    buf = io.BytesIO()
+    PIL.new('RGB', size, color).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_zip_import_matches_by_serial_phone_and_name(test_client, workers, monkeypatch):
+    import zipfile
+    import app as app_module
+    monkeypatch.setenv('PHOTO_IMPORT_WORKERS', str(workers))
+    tag = datetime.now().strftime('%H%M%S%f')
+    by_serial = _member(test_client, f'Zip Serial {tag}')
+    by_phone = test_client.post('/api/members', json={'name': f'Zip Phone {tag}', 'phone': f'0300{tag[-7:]}', 'admission_date': '2024-01-01'}).get_json()
+    by_name = _member(test_client, f'Zip Name {tag}')
+    twice = _member(test_client, f'Zip Twice {tag}')
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        zf.writestr(f"photos/{by_serial['serial']}.png", _png())
+        zf.writestr(f"photos/300{tag[-7:]}.jpg", _png(size=(3000, 2000)))
+        zf.writestr(f"photos/zip_name_{tag}.png", _png())
+        zf.writestr(f"{twice['serial']}.png", _png())
+        zf.writestr(f"zip twice {tag}.png", _png())
+        zf.writestr("nobody-at-all.png", _png())
+        zf.writestr("notes.txt", b"hello")
+        zf.writestr(f"zip_serial_{tag}.jpg", b"not really a jpeg")
+    buf.seek(0)
+    res = test_client.post('/api/members/photos/import', data={'archive': (buf, 'photos.zip')}, content_type='multipart/form-data').get_json()
+    try:
+        assert res['ok']
+        matched = {r['member_id']: r['matched_by'] for r in res['matched']}
+        assert matched == {by_phone['id']: 'phone', by_name['id']: 'name'}
+        collided = sorted(c['member_ids'][0] for c in res['collisions'])
+        assert collided == sorted([by_serial['id'], twice['id']])
+        assert {u['file'] for u in res['unmatched']} == {'nobody-at-all.png', 'notes.txt'}
+
+        with app.app_context():
+            m = db.session.get(Member, by_phone['id'])
+            path = os.path.join(UPLOAD_FOLDER, m.photo_key)
+        assert max(PIL.open(path).size) == app_module.PHOTO_IMPORT_MAX_SIDE
+    finally:
+        for m in (by_serial, by_phone, by_name, twice):
+            test_client.delete(f"/api/members/{m['id']}")
+    bad = test_client.post('/api/members/photos/import', data={'archive': (io.BytesIO(b'junk'), 'x.zip')}, content_type='multipart/form-data')
+    assert bad.status_code == 400
@@ -0,0 +1,63 @@
+import random
+import uuid
+from datetime import datetime
+
+
+def _create(client, name, phone):
+    res = client.post('/api/members', json={
+        'name': name,
+        'phone': phone,
+        'admission_date': datetime.now().date().isoformat(),
+    })
+    assert res.status_code == 201, res.data
+    return res.get_json()
+
+
+def test_suggest_by_name_phone_and_serial(test_client):
+    token = 'q' + uuid.uuid4().hex[:8]
+    m = _create(test_client, f'Zara {token} Khan', '0300' + str(random.randint(1000000, 9999999)))
+    res = test_client.get(f'/api/members/suggest?q={token[:6]}')
+    assert res.status_code == 200
+    items = res.get_json()
+    assert {'id': m['id'], 'name': m['name'], 'serial': m['serial']} in items
+    assert set(items[0].keys()) == {'id', 'name', 'serial'}
+    by_serial = test_client.get(f"/api/members/suggest?q=%23{m['serial']}").get_json()
+    assert any(x['id'] == m['id'] for x in by_serial)
+    digits = ''.join(ch for ch in m['phone'] if ch.isdigit())
+    by_phone = test_client.get(f'/api/members/suggest?q={digits[:9]}&limit=25').get_json()
+    assert any(x['id'] == m['id'] for x in by_phone)
+
+
+def test_suggest_tracks_rename_and_delete(test_client):
+    token = uuid.uuid4().hex[:8]
+    m = _create(test_client, f'Before{token}', '')
+    test_client.get(f'/api/members/suggest?q=before{token}')
+    test_client.put(f"/api/members/{m['id']}", json={'name': f'After{token}'})
+    assert test_client.get(f'/api/members/suggest?q=before{token}').get_json() == []
+    assert test_client.get(f'/api/members/suggest?q=after{token}').get_json()[0]['id'] == m['id']
+    test_client.delete(f"/api/members/{m['id']}")
+    assert test_client.get(f'/api/members/suggest?q=after{token}').get_json() == []
+
+
+def test_suggest_sees_out_of_process_writes(test_client, monkeypatch):
+    import cli
+    from app import db, member_suggest_index
+    monkeypatch.setattr(cli, 'DB', db.engine.url.database)
+    monkeypatch.setattr(member_suggest_index, 'check_seconds', 0)
+    token = uuid.uuid4().hex[:8]
+    test_client.get('/api/members/suggest?q=cli')
+    cli.add_member(f'Cli{token}', '', datetime.now().date().isoformat())
+    items = test_client.get(f'/api/members/suggest?q=cli{token}').get_json()
+    assert [x['name'] for x in items] == [f'Cli{token}']
+
+
+def test_suggest_prunes_emptied_branches(test_client):
+    from app import member_suggest_index
+    token = 'prune' + uuid.uuid4().hex[:8]
+    m = _create(test_client, token, '')
+    test_client.get(f'/api/members/suggest?q={token}')
+    member_suggest_index.remove(m['id'])
+    node = member_suggest_index._root
+    for ch in token[:5]:
+        node = node.children.get(ch) if node else None
+    assert node is None or token[5] not in node.children
@@ -0,0 +1,65 @@
+import uuid
+from datetime import datetime
+
+import pytest
+from app import app, db, AppliedOp, PaymentTransaction
+
+
+def _member(client):
+    res = client.post('/api/members', json={'name': 'Outbox User', 'admission_date': f'{datetime.now().year}-01-01'})
+    return res.get_json()
+
+
+def _tx_count(member_id):
+    with app.app_context():
+        return PaymentTransaction.query.filter_by(member_id=member_id).count()
+
+
+def test_batch_applies_in_order_and_is_idempotent(test_client):
+    m = _member(test_client)
+    year = datetime.now().year
+    ops = [
+        {'op_id': str(uuid.uuid4()), 'type': 'payment.pay', 'payload': {'member_id': m['id'], 'year': year, 'month': 3, 'amount': 1000}},
+        {'op_id': str(uuid.uuid4()), 'type': 'payment.pay', 'payload': {'member_id': 999999, 'year': year, 'month': 3}},
+        {'op_id': str(uuid.uuid4()), 'type': 'payment.pay', 'payload': {'member_id': m['id'], 'year': year, 'month': 4}},
+    ]
+    res = test_client.post('/api/ops/batch', json={'ops': ops})
+    assert res.status_code == 200
+    results = res.get_json()['results']
+    assert [r['status'] for r in results] == ['applied', 'rejected', 'applied']
+    assert results[1]['error'] == 'Member not found'
+    assert results[0]['receipt_url'].startswith('/receipt')
+    assert _tx_count(m['id']) == 2
+
+    # Replaying the same batch (lost response) must not pay twice
+    replay = test_client.post('/api/ops/batch', json={'ops': ops}).get_json()['results']
+    assert [r['status'] for r in replay] == ['duplicate'] * 3
+    assert replay[0]['transaction_id'] == results[0]['transaction_id']
+    assert _tx_count(m['id']) == 2
+
+    payments = test_client.get(f"/api/members/{m['id']}/payments").get_json()
+    paid = {p['month'] for p in payments if p['year'] == year and p['status'] == 'Paid'}
+    assert {3, 4} <= paid
+
+
+def test_batch_validation(test_client):
+    assert test_client.post('/api/ops/batch', json={}).status_code == 400
+    assert test_client.post('/api/ops/batch', json={'ops': [{'type': 'payment.pay'}]}).status_code == 400
+    bad = test_client.post('/api/ops/batch', json={'ops': [{'op_id': str(uuid.uuid4()), 'type': 'nope', 'payload': {}}]})
+    assert bad.get_json()['results'][0]['status'] == 'rejected'
+
+
+def test_failed_commit_persists_nothing(test_client, monkeypatch):
+    m = _member(test_client)
+    op_id = str(uuid.uuid4())
+    ops = [{'op_id': op_id, 'type': 'payment.pay', 'payload': {'member_id': m['id'], 'year': datetime.now().year, 'month': 5}}]
+
+    def boom():
+        raise RuntimeError('disk full')
+    monkeypatch.setattr(db.session, 'commit', boom)
+    with pytest.raises(RuntimeError):
+        test_client.post('/api/ops/batch', json={'ops': ops})
+    monkeypatch.undo()
+    assert _tx_count(m['id']) == 0
+    with app.app_context():
+        assert db.session.get(AppliedOp, op_id) is None
@@ -0,0 +1,154 @@
+import io
+import os
+import uuid
+
+from app import app, db
+
+os.environ.setdefault('POS_GOOGLE_BACKUP_ENABLED', '0')
+
+
+def _product(client, **kwargs):
+    payload = {'name': 'Water', 'price': 50, 'stock': 10}
+    payload.update(kwargs)
+    res = client.post('/api/products', json=payload)
+    assert res.status_code == 201, res.data
+    return res.get_json()['product']
+
+
+def _stock(client, product_id):
+    return next(p['stock'] for p in client.get('/api/products').get_json() if p['id'] == product_id)
+
+
+def test_checkout_records_sale_and_decrements_stock(test_client):
+    p = _product(test_client)
+    res = test_client.post('/api/checkout', json={'items': [{'id': p['id'], 'name': p['name'], 'price': 50, 'quantity': 3}], 'tax': 5})
+    data = res.get_json()
+    assert data['ok'] and data['sale']['total'] == 155.0
+    assert len(data['sale']['items']) == 1
+    assert _stock(test_client, p['id']) == 7
+    assert test_client.post('/api/checkout', json={'items': []}).status_code == 400
+
+
+def test_offline_sync_batch_dedupes_by_invoice(test_client):
+    a = _product(test_client, name='Bar', stock=20)
+    b = _product(test_client, name='Shake', stock=20)
+    tag = uuid.uuid4().hex[:8].upper()
+    orders = [
+        {'invoice_number': f'OFF-{tag}-1', 'items': [{'id': a['id'], 'price': 100, 'quantity': 2}]},
+        {'invoice_number': f'OFF-{tag}-2', 'items': [{'id': a['id'], 'price': 100, 'quantity': 1}, {'id': b['id'], 'price': 300, 'quantity': 1}]},
+        {'invoice_number': f'OFF-{tag}-3', 'items': []},
+    ]
+    first = test_client.post('/api/offline-sync', json={'orders': orders}).get_json()
+    assert first['ok'] and first['created'] == 2 and first['rejected'] == 1
+    assert [r['status'] for r in first['results']] == ['rejected', 'created', 'created']
+    assert _stock(test_client, a['id']) == 17 and _stock(test_client, b['id']) == 19
+
+    again = test_client.post('/api/offline-sync', json={'orders': orders[:2]}).get_json()
+    assert again['created'] == 0 and again['duplicate'] == 2
+    assert _stock(test_client, a['id']) == 17
+
+
+def test_product_crud_and_import(test_client):
+    sku = 'SKU' + uuid.uuid4().hex[:6]
+    p = _product(test_client, name='Gloves', sku=sku)
+    assert test_client.post('/api/products', json={'name': 'Dup', 'sku': sku}).status_code == 409
+    upd = test_client.put(f"/api/products/{p['id']}", json={'price': '75.5', 'is_active': False}).get_json()
+    assert upd['product']['price'] == 75.5 and upd['product']['is_active'] is False
+    assert p['id'] not in [x['id'] for x in test_client.get('/api/products?active=1').get_json()]
+
+    csv = f"name,price,stock,sku\nGloves v2,80,4,{sku}\nTowel,20,15,\n,5,1,\n".encode()
+    res = test_client.post('/api/products/import', data={'file': (io.BytesIO(csv), 'products.csv')}, content_type='multipart/form-data')
+    data = res.get_json()
+    assert data['ok'] and (data['created'], data['updated'], data['skipped']) == (1, 1, 1)
+    assert test_client.delete(f"/api/products/{p['id']}").get_json() == {'ok': True, 'deactivated': False}
+
+
+def test_checkout_never_oversells_and_writes_ledger(test_client):
+    p = _product(test_client, name='Creatine', stock=2)
+    over = test_client.post('/api/checkout', json={'items': [{'id': p['id'], 'price': 10, 'quantity': 3}]})
+    assert over.status_code == 409
+    assert over.get_json()['available'] == 2
+    assert _stock(test_client, p['id']) == 2
+
+    # Two lines of the same product are taken together
+    ok = test_client.post('/api/checkout', json={'items': [{'id': p['id'], 'price': 10, 'quantity': 1}, {'id': p['id'], 'price': 10, 'quantity': 1}]})
+    assert ok.status_code == 200
+    assert _stock(test_client, p['id']) == 0
+    moves = test_client.get(f"/api/products/{p['id']}/movements").get_json()['movements']
+    assert [(m['reason'], m['delta'], m['stock_after']) for m in moves] == [('sale', -2, 0), ('create', 2, 2)]
+
+    # Offline sales already happened: clamp at zero instead of rejecting
+    tag = uuid.uuid4().hex[:8]
+    test_client.post('/api/offline-sync', json={'orders': [{'invoice_number': f'OFF-{tag}', 'items': [{'id': p['id'], 'price': 10, 'quantity': 4}]}]})
+    assert _stock(test_client, p['id']) == 0
+
+
+def test_low_stock_uses_index(test_client):
+    p = _product(test_client, name='Tape', stock=1)
+    hidden = _product(test_client, name='Old Tape', stock=0, is_active=False)
+    res = test_client.get('/api/products/low-stock?threshold=1').get_json()
+    ids = [x['id'] for x in res['products']]
+    assert p['id'] in ids and hidden['id'] not in ids
+    with app.app_context():
+        plan = db.session.execute(db.text(
+            "EXPLAIN QUERY PLAN SELECT id FROM product WHERE is_active = 1 AND stock <= 1"
+        )).fetchall()
+    assert 'ix_product_active_stock' in ' '.join(str(row[-1]) for row in plan)
+
+
+def test_sales_rollups_back_snapshot_and_summary(test_client):
+    from app import rebuild_sales_rollups
+    before = test_client.get('/api/pos/summary?days=30').get_json()
+    p = _product(test_client, name='Rollup Bar', stock=50)
+    sale = test_client.post('/api/checkout', json={'items': [{'id': p['id'], 'name': p['name'], 'price': 40, 'quantity': 3}, {'name': 'Ad-hoc', 'price': 5, 'quantity': 1}]}).get_json()
+    assert sale['snapshot']['today_total'] == round(before['snapshot']['today_total'] + 125.0, 2)
+
+    after = test_client.get('/api/pos/summary?days=30&limit=100').get_json()
+    assert after['count'] == before['count'] + 1
+    assert after['total'] == round(before['total'] + 125.0, 2)
+    best = {b['name']: b for b in after['best_sellers']}
+    assert best['Rollup Bar'] == {'name': 'Rollup Bar', 'quantity': 3, 'revenue': 120.0}
+
+    # A full rebuild from sale/sale_item yields the same figures
+    with app.app_context():
+        rebuild_sales_rollups()
+    assert test_client.get('/api/pos/summary?days=30&limit=100').get_json()['daily'] == after['daily']
+
+
+def test_offline_sync_keeps_the_till_time(test_client):
+    from datetime import datetime, timedelta, timezone
+    p = _product(test_client, name='Offline Towel', stock=10)
+    tag = uuid.uuid4().hex[:8]
+    sold_at = datetime.now(timezone.utc) - timedelta(days=3)
+    item = [{'id': p['id'], 'name': p['name'], 'price': 7, 'quantity': 1}]
+    before = {d['day']: d for d in test_client.get('/api/pos/summary?days=10').get_json()['daily']}
+    res = test_client.post('/api/offline-sync', json={'orders': [
+        {'invoice_number': f'OFF-{tag}-1', 'items': item, 'created_at': sold_at.isoformat().replace('+00:00', 'Z')},
+        {'invoice_number': f'OFF-{tag}-2', 'items': item, 'created_at': 'yesterday'},
+        {'invoice_number': f'OFF-{tag}-3', 'items': item, 'created_at': (sold_at + timedelta(days=30)).isoformat()},
+    ]}).get_json()
+    assert [r['status'] for r in res['results']] == ['rejected', 'rejected', 'created']
+    from app import Sale
+    sale = Sale.query.get(res['results'][2]['sale_id'])
+    assert abs(sale.created_at - sold_at.replace(tzinfo=None)) < timedelta(seconds=1)
+    day = sold_at.date().isoformat()
+    after = {d['day']: d for d in test_client.get('/api/pos/summary?days=10').get_json()['daily']}
+    assert after[day]['count'] == before.get(day, {'count': 0})['count'] + 1
+
+
+def test_offline_sync_rejects_failing_orders_only(test_client, monkeypatch):
+    import app as app_module
+    p = _product(test_client, name='Offline Chalk', stock=10)
+    taken = test_client.post('/api/checkout', json={'items': [{'id': p['id'], 'price': 5, 'quantity': 1}]}).get_json()['sale']['invoice_number']
+    # An unnumbered order whose generated number was taken by another till meanwhile
+    monkeypatch.setattr(app_module, 'invoice_numbers', lambda n: [taken] * n)
+    tag = uuid.uuid4().hex[:8]
+    item = [{'id': p['id'], 'price': 5, 'quantity': 1}]
+    res = test_client.post('/api/offline-sync', json={'orders': [
+        {'invoice_number': f'OFF-{tag}-1', 'items': [{'id': 10 ** 9, 'price': 5, 'quantity': 1}]},
+        {'items': item},
+        {'invoice_number': f'OFF-{tag}-3', 'items': item},
+    ]}).get_json()
+    assert [r['status'] for r in res['results']] == ['rejected', 'rejected', 'created']
+    assert 'Unknown product' in res['results'][0]['error']
+    assert _stock(test_client, p['id']) == 8
@@ -0,0 +1,68 @@
+import app as app_module
+from app import app, sale_export_queue
+
+
+def test_checkout_queues_export_and_flush_batches(test_client, monkeypatch):
+    calls = []
+    monkeypatch.setattr(app_module, '_sales_export_configured', lambda: True)
+    monkeypatch.setattr(app_module, '_append_sales_to_sheet', lambda sales: calls.append([s.invoice_number for s in sales]) or (True, 'appended'))
+    monkeypatch.setenv('SALES_SHEET_ID', 'sheet')
+    monkeypatch.delenv('DRIVE_FOLDER_ID', raising=False)
+    sale_export_queue.flush()
+    calls.clear()
+
+    invoices = []
+    for _ in range(3):
+        res = test_client.post('/api/checkout', json={'items': [{'name': 'Towel', 'price': 10, 'quantity': 1}]}).get_json()
+        assert res['ok'] and res['backup'] == {'queued': True}
+        invoices.append(res['sale']['invoice_number'])
+    assert calls == []
+    result = sale_export_queue.flush()
+    assert result['ok']
+    assert calls == [invoices]
+    assert sale_export_queue.pending_count() == 0
+
+
+def test_failed_batch_is_kept_for_retry(test_client, monkeypatch):
+    monkeypatch.setattr(app_module, '_sales_export_configured', lambda: True)
+    monkeypatch.setattr(app_module, '_append_sales_to_sheet', lambda sales: (False, 'quota'))
+    monkeypatch.setenv('SALES_SHEET_ID', 'sheet')
+    monkeypatch.delenv('DRIVE_FOLDER_ID', raising=False)
+    sale_export_queue.flush()
+    test_client.post('/api/checkout', json={'items': [{'name': 'Towel', 'price': 10, 'quantity': 1}]})
+    before = sale_export_queue.pending_count()
+    assert sale_export_queue.flush()['ok'] is False
+    assert sale_export_queue.pending_count() == before
+    monkeypatch.setattr(app_module, '_append_sales_to_sheet', lambda sales: (True, 'appended'))
+    assert sale_export_queue.flush()['ok']
+    assert sale_export_queue.pending_count() == 0
+
+
+def test_each_target_is_retried_on_its_own(test_client, monkeypatch):
+    sheet, csv = [], []
+    csv_ok = [False]
+    monkeypatch.setattr(app_module, '_sales_export_configured', lambda: True)
+    monkeypatch.setattr(app_module, '_append_sales_to_sheet', lambda sales: sheet.append([s.id for s in sales]) or (True, 'appended'))
+    monkeypatch.setattr(app_module, '_upload_sales_csv', lambda sales: csv.append([s.id for s in sales]) or (csv_ok[0], 'drive'))
+    monkeypatch.setenv('SALES_SHEET_ID', 'sheet')
+    monkeypatch.setenv('DRIVE_FOLDER_ID', 'folder')
+    sale_export_queue.flush()
+    with app.app_context():
+        app_module.db.session.execute(app_module.db.text('UPDATE sale SET sheet_exported_at = CURRENT_TIMESTAMP, csv_exported_at = CURRENT_TIMESTAMP'))
+        app_module.db.session.commit()
+    sheet.clear(); csv.clear()
+
+    sale = test_client.post('/api/checkout', json={'items': [{'name': 'Towel', 'price': 10, 'quantity': 1}]}).get_json()['sale']
+    assert sale_export_queue.flush()['ok'] is False
+    csv_ok[0] = True
+    assert sale_export_queue.flush()['ok']
+    assert sheet == [[sale['id']]] and csv == [[sale['id']], [sale['id']]]
+
+    # The markers survive a restart: nothing left to recover
+    with app.app_context():
+        assert sale_export_queue.recover() == 0
+        app_module.db.session.execute(app_module.db.text('UPDATE sale SET csv_exported_at = NULL WHERE id = :id'), {'id': sale['id']})
+        app_module.db.session.commit()
+        assert sale_export_queue.recover() == 1
+    sale_export_queue.flush()
+    assert sheet == [[sale['id']]] and csv[-1] == [sale['id']]
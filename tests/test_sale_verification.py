@@ -0,0 +1,37 @@
+from app import app, db, Sale, verify_sales
+
+
+def test_incremental_verification_reports_tampering(test_client):
+    with app.app_context():
+        verify_sales(full=True)
+    sale = test_client.post('/api/checkout', json={'items': [{'name': 'Towel', 'price': 10, 'quantity': 2}]}).get_json()['sale']
+    with app.app_context():
+        report = verify_sales()
+        assert report['checked'] == 1 and report['through_id'] == sale['id']
+        assert verify_sales()['checked'] == 0
+
+        db.session.get(Sale, sale['id']).total = 1.0
+        db.session.commit()
+        # Already past the high-water mark: only a full run sees the edit
+        assert verify_sales()['mismatch_count'] == 0
+        full = verify_sales(full=True, batch_size=2)
+        assert [m['id'] for m in full['mismatches']] == [sale['id']]
+        db.session.get(Sale, sale['id']).total = 20.0
+        db.session.commit()
+
+
+def test_verify_endpoint(test_client):
+    res = test_client.post('/api/admin/sales/verify', json={'full': True})
+    assert res.status_code == 200
+    body = res.get_json()
+    assert body['ok'] and body['report']['mismatch_count'] == 0
+    last = test_client.get('/api/admin/sales/verify').get_json()
+    assert last['report']['through_id'] == last['verified_through_id']
+
+
+def test_process_pool_matches_serial_run(test_client):
+    test_client.post('/api/checkout', json={'items': [{'name': 'Towel', 'price': 10, 'quantity': 2}]})
+    with app.app_context():
+        serial = verify_sales(full=True)
+        pooled = verify_sales(full=True, workers=2, batch_size=1)
+    assert pooled['checked'] == serial['checked'] and pooled['mismatches'] == serial['mismatches']
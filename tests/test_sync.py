@@ -0,0 +1,59 @@
+from datetime import datetime
+
+
+def test_first_sync_is_a_snapshot(test_client):
+    body = test_client.get('/api/sync').get_json()
+    assert body['ok'] and body['reset'] is True
+    assert isinstance(body['cursor'], int)
+    assert test_client.get('/api/sync?since=x').status_code == 400
+
+
+def test_deltas_and_tombstones(test_client):
+    # A non-empty change log, so the cursor is past the first-sync snapshot
+    test_client.post('/api/members', json={'name': 'Sync Seed', 'admission_date': datetime.now().date().isoformat()})
+    cursor = test_client.get('/api/sync').get_json()['cursor']
+    m = test_client.post('/api/members', json={'name': 'Sync User', 'admission_date': datetime.now().date().isoformat()}).get_json()
+    delta = test_client.get(f'/api/sync?since={cursor}').get_json()
+    assert delta['reset'] is False
+    assert [row['id'] for row in delta['members']] == [m['id']]
+    assert len(delta['payments']) == 12
+    assert {p['member_id'] for p in delta['payments']} == {m['id']}
+    payment_ids = {p['id'] for p in delta['payments']}
+
+    # Nothing changed: empty payload, cursor unchanged
+    quiet = test_client.get(f"/api/sync?since={delta['cursor']}").get_json()
+    assert quiet['members'] == [] and quiet['payments'] == [] and quiet['cursor'] == delta['cursor']
+
+    test_client.delete(f"/api/members/{m['id']}")
+    gone = test_client.get(f"/api/sync?since={delta['cursor']}").get_json()
+    assert gone['deleted']['member'] == [m['id']]
+    assert set(gone['deleted']['payment']) == payment_ids
+    assert gone['members'] == []
+
+
+def test_paging_with_has_more(test_client):
+    cursor = test_client.get('/api/sync').get_json()['cursor']
+    test_client.post('/api/members', json={'name': 'Sync Page', 'admission_date': datetime.now().date().isoformat()})
+    first = test_client.get(f'/api/sync?since={cursor}&limit=5').get_json()
+    assert first['has_more'] is True
+    rest = test_client.get(f"/api/sync?since={first['cursor']}&limit=500").get_json()
+    assert rest['has_more'] is False
+    assert len(first['payments']) + len(rest['payments']) == 12
+
+
+def test_snapshot_is_paged(test_client):
+    from app import Member, Payment, PaymentTransaction
+    test_client.post('/api/members', json={'name': 'Sync Snapshot', 'admission_date': datetime.now().date().isoformat()})
+    page = test_client.get('/api/sync?limit=7').get_json()
+    assert page['reset'] is True and page['has_more'] is True and page['after']
+    cursor, pages = page['cursor'], [page]
+    while page['has_more']:
+        page = test_client.get(f"/api/sync?since={cursor}&after={page['after']}&limit=7").get_json()
+        assert page['reset'] is False and page['cursor'] == cursor
+        pages.append(page)
+    assert page['after'] is None
+    assert all(len(p['members']) + len(p['payments']) + len(p['transactions']) <= 7 for p in pages)
+    for key, model in (('members', Member), ('payments', Payment), ('transactions', PaymentTransaction)):
+        ids = [row['id'] for p in pages for row in p[key]]
+        assert ids == sorted({r.id for r in model.query.all()})
+    assert test_client.get(f'/api/sync?since={cursor}&after=bogus').status_code == 400
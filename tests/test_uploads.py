@@ -0,0 +1,96 @@
+import io
+import os
+import uuid
+
+from app import app, data_store
+
+
+def _upload(client, data, name):
+    return client.post('/api/uploads', data={'file': (io.BytesIO(data), name)}, content_type='multipart/form-data')
+
+
+def test_csv_upload_counts_rows_and_dedupes(test_client, monkeypatch):
+    monkeypatch.setattr('app.UPLOAD_CSV_CHUNK_ROWS', 40)
+    tag = uuid.uuid4().hex
+    csv = ('name,joined,note\n' + ''.join(f'M{i},2024-01-{i % 28 + 1:02d},{tag}\n' for i in range(130))).encode()
+    first = _upload(test_client, csv, 'members.csv').get_json()
+    assert first['ok'] and first['file']['rows_count'] == 130 and 'duplicate' not in first
+    detail = test_client.get(f"/api/uploads/{first['file']['id']}").get_json()
+    assert len(detail['rows']) == 50 and detail['rows'][0]['name'] == 'M0'
+    assert data_store.exists(detail['stored_name'])
+    assert not [o for o in os.listdir(data_store.spool_dir) if o.startswith('.upload-')]
+
+    again = _upload(test_client, csv, 'renamed.csv').get_json()
+    assert again['duplicate'] and again['file']['id'] == first['file']['id']
+    assert _upload(test_client, b'', 'empty.csv').status_code == 400
+
+
+def test_xlsx_upload_ignores_trailing_blank_rows(test_client):
+    from openpyxl import Workbook
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['name', 'tag'])
+    tag = uuid.uuid4().hex
+    for i in range(75):
+        ws.append([f'X{i}', tag])
+    ws.cell(row=90, column=1, value='')
+    buf = io.BytesIO()
+    wb.save(buf)
+    res = _upload(test_client, buf.getvalue(), 'sheet.xlsx').get_json()
+    assert res['ok'] and res['file']['rows_count'] == 75
+    rows = test_client.get(f"/api/uploads/{res['file']['id']}").get_json()['rows']
+    assert len(rows) == 50 and rows[0] == {'name': 'X0', 'tag': tag}
+    q = test_client.get(f"/api/uploads/{res['file']['id']}/query?offset=74").get_json()
+    assert q['total'] == 75 and q['rows'] == [['X74', tag]]
+
+
+def test_upload_over_limit_is_413(test_client, monkeypatch):
+    monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 1024)
+    res = _upload(test_client, b'a,b\n' + b'1,2\n' * 1000, 'big.csv')
+    assert res.status_code == 413
+    assert res.get_json() == {'ok': False, 'error': 'Upload too large', 'max_bytes': 1024}
+
+
+def test_query_upload_dataset(test_client):
+    import app as app_module
+    tag = uuid.uuid4().hex[:8]
+    lines = ['plan,amount,city']
+    lines += [f"{'Gold' if i % 3 == 0 else 'Basic'},{i * 10},{'Lahore' if i % 2 else 'Karachi_' + tag}" for i in range(300)]
+    up = _upload(test_client, ('\n'.join(lines) + '\n').encode(), f'sales_{tag}.csv').get_json()
+    url = f"/api/uploads/{up['file']['id']}/query"
+
+    page = test_client.get(f'{url}?columns=amount,plan&filter=amount:gte:2900&order_by=-amount&limit=5').get_json()
+    assert page['ok'] and page['columns'] == ['amount', 'plan'] and page['total'] == 10
+    assert page['rows'][:2] == [[2990, 'Basic'], [2980, 'Basic']]
+    assert page['available_columns'] == ['plan', 'amount', 'city']
+
+    grouped = test_client.post(url, json={
+        'group_by': ['plan'], 'order_by': ['plan'],
+        'aggregates': [{'fn': 'count', 'column': '*'}, {'fn': 'sum', 'column': 'amount'}],
+    }).get_json()
+    assert grouped['columns'] == ['plan', 'count(*)', 'sum(amount)']
+    assert grouped['rows'] == [['Basic', 200, sum(i * 10 for i in range(300) if i % 3)], ['Gold', 100, sum(i * 10 for i in range(0, 300, 3))]]
+
+    # LIKE wildcards in the value are literal; the cache file is reused
+    like = test_client.get(f'{url}?filter=city:contains:Karachi_{tag}&limit=1').get_json()
+    assert like['total'] == 150
+    assert test_client.get(f'{url}?filter=city:contains:Karachi%25&limit=1').get_json()['total'] == 0
+    built = os.listdir(app_module.DATASET_CACHE_DIR)
+    test_client.get(f'{url}?limit=1')
+    assert os.listdir(app_module.DATASET_CACHE_DIR) == built
+
+    assert test_client.get(f'{url}?columns=nope').status_code == 400
+    assert test_client.get(f'{url}?filter=amount:drop:1').status_code == 400
+
+
+def test_query_keeps_numeric_looking_text(test_client):
+    tag = uuid.uuid4().hex[:8]
+    csv = f'phone,amount,tag\n00123,10,{tag}\n123,20,{tag}\n0300-1,1.50,{tag}\n'.encode()
+    up = _upload(test_client, csv, f'phones_{tag}.csv').get_json()
+    url = f"/api/uploads/{up['file']['id']}/query"
+    rows = test_client.get(f'{url}?columns=phone,amount').get_json()['rows']
+    assert rows == [['00123', 10], [123, 20], ['0300-1', 1.5]]
+    assert test_client.get(f'{url}?filter=phone:eq:00123').get_json()['rows'] == [['00123', 10, tag]]
+    assert test_client.get(f'{url}?filter=phone:eq:123').get_json()['rows'] == [[123, 20, tag]]
+    assert test_client.get(f'{url}?filter=phone:in:00123|123').get_json()['total'] == 2
+    assert test_client.get(f'{url}?filter=amount:gte:9&filter=amount:lt:20').get_json()['total'] == 1